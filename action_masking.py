@@ -0,0 +1,119 @@
+import gymnasium as gym
+import numpy as np
+
+
+def valid_action_mask(ts):
+    """
+    Actions (green phases) that actually do something for a sumo-rl
+    TrafficSignal right now:
+    - during yellow and until min_green has passed, sumo-rl ignores the
+      action and keeps the current green, so that is the only valid one
+    - once the current green has run max_green, it must be left (sumo-rl
+      doesn't enforce max_green on its own)
+    """
+    mask = np.ones(ts.num_green_phases, dtype=bool)
+    if ts.time_since_last_phase_change < ts.yellow_time + ts.min_green:
+        mask[:] = False
+        mask[ts.green_phase] = True
+    elif ts.time_since_last_phase_change >= ts.yellow_time + ts.max_green and ts.num_green_phases > 1:
+        mask[ts.green_phase] = False
+    return mask
+
+
+class EventDrivenDecisions(gym.Wrapper):
+    """
+    Macro-step wrapper for a single-agent sumo_rl.SumoEnvironment.
+
+    After each action the simulation keeps running until a decision
+    matters again: more than one action is valid and, with `skip_idle`,
+    some vehicle is on an incoming edge. In between, the only valid action
+    is applied (e.g. the forced switch after max_green), or the current
+    green is held. Rewards of the skipped steps are summed into the macro
+    step, so the agent (and PPO's rollout buffer) only sees the decisions
+    it can influence.
+
+    The skipped rewards are deliberately not discounted by gamma^k: SB3
+    discounts per transition and can't give a macro step its own horizon,
+    so the undiscounted sum is the one signal that charges a decision the
+    full cost of the forced steps it leads to (at gamma=0.995 and short
+    macro steps the difference is a few percent).
+
+    Exposes action_masks() for sb3-contrib's MaskablePPO.
+    """
+
+    def __init__(self, env, skip_idle=True):
+        super().__init__(env)
+        self.skip_idle = skip_idle
+        self.skipped = 0
+        self._carry_reward = 0.0
+
+    @property
+    def ts(self):
+        # sumo-rl rebuilds its TrafficSignal objects on every reset
+        sumo_env = self.env.unwrapped
+        return sumo_env.traffic_signals[sumo_env.ts_ids[0]]
+
+    def action_masks(self):
+        return valid_action_mask(self.ts)
+
+    def _has_approaching_vehicles(self):
+        # Edge counts work in both micro- and mesosim
+        ts = self.ts
+        edges = {lane.rsplit("_", 1)[0] for lane in ts.lanes}
+        return any(ts.sumo.edge.getLastStepVehicleNumber(edge) for edge in edges)
+
+    def _forced_action(self):
+        """The action to apply without asking the agent, or None if the decision matters."""
+        valid = np.flatnonzero(self.action_masks())
+        if len(valid) == 1:
+            return int(valid[0])
+        if self.skip_idle and not self._has_approaching_vehicles():
+            return self.ts.green_phase
+        return None
+
+    def decision_matters(self):
+        return self._forced_action() is None
+
+    def _advance(self, obs, reward, terminated, truncated, info):
+        skipped = 0
+        while not (terminated or truncated):
+            action = self._forced_action()
+            if action is None:
+                break
+            obs, step_reward, terminated, truncated, info = self.env.step(action)
+            reward += step_reward
+            skipped += 1
+        self.skipped += skipped
+        info["skipped_decisions"] = skipped
+        return obs, reward, terminated, truncated, info
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        # Forced decisions at the start of the episode are skipped too; their
+        # reward is credited to the first real decision
+        obs, reward, terminated, truncated, info = self._advance(obs, 0.0, False, False, info)
+        self._carry_reward = reward
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        reward += self._carry_reward
+        self._carry_reward = 0.0
+        return self._advance(obs, reward, terminated, truncated, info)
+
+
+class MaskedPolicy:
+    """
+    SB3-style predict() for a MaskablePPO model (train_optimized.py
+    --masked) on a VecEnv of EventDrivenDecisions envs: every call passes
+    the envs' current action masks, so only valid phases are chosen.
+    """
+
+    def __init__(self, model, venv):
+        self.model = model
+        self.venv = venv
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        masks = np.stack(self.venv.env_method("action_masks"))
+        return self.model.predict(observation, state=state, episode_start=episode_start,
+                                  deterministic=deterministic, action_masks=masks)
@@ -0,0 +1,517 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+
+import numpy as np
+
+# Check if SUMO_HOME is set (standard safety check)
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    sys.path.append(tools)
+else:
+    sys.exit("please declare environment variable 'SUMO_HOME'")
+
+import traci
+
+from emergency_tracker import EmergencyTracker
+from frame_history import with_saved_history
+from max_pressure import unwrap_sumo_env
+from scenario import NET_FILE
+from streaming_stats import StreamingStats, VehicleStats
+from sumo_pool import PooledSumoEnvironment, get_pool
+
+VTYPES_FILE = "vtypes.rou.xml"
+CIVILIAN_FILES = ["draft02.rou.xml"]
+EMERGENCY_FILE = "ambulance.rou.xml"
+# Written by distill.py
+STUDENT_FILE = os.path.join("distill_results", "student_policy.json")
+
+# Loaded once per worker process so every PPO run doesn't pay for PPO.load()
+_POLICY_CACHE = {}
+
+
+def write_scaled_vtypes(scale, out_dir):
+    """
+    Write a copy of vtypes.rou.xml whose civilian types carry SUMO's per-type
+    `scale` attribute. We don't use the global --scale option because it also
+    thins the emergency trips (a single ambulance never departs at scale < 1).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"vtypes_scale{scale:g}.rou.xml")
+    tree = ET.parse(VTYPES_FILE)
+    for vtype in tree.getroot().iter("vType"):
+        if vtype.get("vClass") != "emergency":
+            vtype.set("scale", f"{scale:g}")
+    tree.write(path)
+    return path
+
+
+def route_files_for(scale, out_dir, emergency_file=EMERGENCY_FILE):
+    return [write_scaled_vtypes(scale, out_dir)] + CIVILIAN_FILES + [emergency_file]
+
+
+class EpisodeRecorder:
+    """
+    Tracks the same metrics as the evaluation scripts: the transit of every
+    emergency vehicle (EmergencyTracker, every simulation step) and each
+    civilian vehicle's maximum waiting time and time loss (VehicleStats,
+    constant memory). Create it once the simulation is loaded.
+    """
+
+    def __init__(self, conn=traci):
+        self.conn = conn
+        self.emergency = EmergencyTracker(conn)
+        self.civilians = VehicleStats(conn, exclude=self.emergency)
+
+    def observe(self):
+        self.civilians.observe()
+
+    def close(self):
+        self.emergency.close()
+        self.civilians.finish()
+
+    @property
+    def ambulance_duration(self):
+        """Mean transit time of the emergency vehicles that finished (nan if none did)."""
+        transit = self.emergency.transit_times()
+        return float(transit.mean()) if len(transit) else float("nan")
+
+    def civilian_avg_wait(self):
+        return self.civilians.wait.mean if self.civilians.wait.count else 0.0
+
+
+def run_fixed_time_episode(seed, route_files, num_seconds, additional_files=None, **kwargs):
+    """
+    Headless version of run_baseline_pure_traci.py: SUMO's static program,
+    one traci.simulationStep() per simulated second. `additional_files` can
+    override the network's signal programs (e.g. draft02A.xml).
+    """
+    sumo_cmd = ["sumo", "-n", NET_FILE, "-r", ",".join(route_files),
+                "--seed", str(seed), "--no-step-log", "--no-warnings"]
+    if additional_files:
+        sumo_cmd += ["-a", ",".join(additional_files)]
+
+    wall_start = time.perf_counter()
+    with get_pool().leased() as sumo:
+        sumo.load(sumo_cmd[1:])
+        recorder = EpisodeRecorder(sumo.conn)
+        step = 0
+        while step < num_seconds:
+            sumo.conn.simulationStep()
+            step += 1
+            recorder.observe()
+        recorder.close()
+    wall_clock = time.perf_counter() - wall_start
+
+    return recorder, step, 0, wall_clock, 0.0
+
+
+def _load_policy(model_path, norm_path, masked=False):
+    key = (model_path, norm_path, masked)
+    if key not in _POLICY_CACHE:
+        from train_optimized import algorithm
+        _POLICY_CACHE[key] = algorithm(masked).load(model_path, device="cpu")
+    return _POLICY_CACHE[key]
+
+
+def _policy_for(env, model_path, norm_path, masked):
+    """The PPO (or, with masked, MaskablePPO fed the env's action masks) to drive `env` with."""
+    model = _load_policy(model_path, norm_path, masked)
+    if masked:
+        from action_masking import MaskedPolicy
+        return MaskedPolicy(model, env)
+    return model
+
+
+def make_sumo_rl_env(seed, route_files, num_seconds, emergency_obs=False, masked=False, emergency_radius=None):
+    """
+    Headless copy of the environment test_optimized.py evaluates in
+    (emergency_obs / masked: the model was trained with --emergency-obs /
+    --masked, which also makes the decisions event-driven; emergency_radius:
+    its --emergency-radius).
+    """
+    from stable_baselines3.common.vec_env import DummyVecEnv
+
+    extra = {}
+    if emergency_obs:
+        from emergency_observation import CONTEXT_RADIUS, emergency_observation
+        extra["observation_class"] = emergency_observation(emergency_radius or CONTEXT_RADIUS)
+
+    env = PooledSumoEnvironment(
+        net_file=NET_FILE,
+        route_file=",".join(route_files),
+        out_csv_name=None,
+        use_gui=False,
+        num_seconds=num_seconds,
+        fixed_ts=False,
+        yellow_time=4,
+        min_green=5,
+        max_green=60,
+        single_agent=True,
+        sumo_seed=seed,
+        sumo_warnings=False,
+        additional_sumo_cmd="--no-step-log",
+        **extra
+    )
+    if masked:
+        from action_masking import EventDrivenDecisions
+        env = EventDrivenDecisions(env)
+    return DummyVecEnv([lambda: env])
+
+
+def drive_episode(env, policy, wall_start):
+    """
+    Run one episode with anything exposing an SB3-style predict().
+    Returns (recorder, sim_steps, decisions, wall_clock, decision_seconds).
+    """
+    obs = env.reset()
+    recorder = EpisodeRecorder(unwrap_sumo_env(env).sumo)
+    decisions = 0
+    decision_seconds = 0.0
+    sim_steps = 0
+    while True:
+        t0 = time.perf_counter()
+        action, _ = policy.predict(obs, deterministic=True)
+        decision_seconds += time.perf_counter() - t0
+        decisions += 1
+        obs, reward, done, info = env.step(action)
+        # DummyVecEnv auto-resets on the final step, so stop before
+        # recording anything from the fresh simulation (the emergency
+        # tracker stops by itself when the simulation is reloaded)
+        if done[0]:
+            sim_steps = int(info[0]["step"])
+            break
+        recorder.observe()
+    recorder.close()
+    env.close()
+    wall_clock = time.perf_counter() - wall_start
+
+    return recorder, sim_steps, decisions, wall_clock, decision_seconds
+
+
+def run_policy_episode(seed, route_files, num_seconds, model_path, norm_path, emergency_obs=False, masked=False,
+                       emergency_radius=None, **kwargs):
+    """
+    Headless version of test_optimized.py: the PPO agent drives J4 through
+    sumo-rl with the normalisation stats frozen.
+    """
+    from stable_baselines3.common.vec_env import VecNormalize
+
+    wall_start = time.perf_counter()
+    env = make_sumo_rl_env(seed, route_files, num_seconds, emergency_obs, masked, emergency_radius)
+    env = VecNormalize.load(norm_path, with_saved_history(env, norm_path))
+    env.training = False
+    env.norm_reward = False
+
+    return drive_episode(env, _policy_for(env, model_path, norm_path, masked), wall_start)
+
+
+def run_max_pressure_episode(seed, route_files, num_seconds, **kwargs):
+    """Same environment and loop as the PPO run, decided by MaxPressureController."""
+    from max_pressure import MaxPressureController
+
+    wall_start = time.perf_counter()
+    env = make_sumo_rl_env(seed, route_files, num_seconds)
+    return drive_episode(env, MaxPressureController(env), wall_start)
+
+
+def run_preempted_policy_episode(seed, route_files, num_seconds, model_path, norm_path, emergency_obs=False,
+                                 masked=False, route_table=None, emergency_radius=None, **kwargs):
+    """
+    PPO run with the precomputed emergency-route table overriding J4 while
+    the ambulance approaches. run_benchmark builds the table before starting
+    the workers and passes its path as `route_table`.
+    """
+    from stable_baselines3.common.vec_env import VecNormalize
+    from emergency_routes import TABLE_FILE, EmergencyRouteIndex, PreemptionOverride
+
+    wall_start = time.perf_counter()
+    index = EmergencyRouteIndex.load(route_table or TABLE_FILE)
+    env = make_sumo_rl_env(seed, route_files, num_seconds, emergency_obs, masked, emergency_radius)
+    env = VecNormalize.load(norm_path, with_saved_history(env, norm_path))
+    env.training = False
+    env.norm_reward = False
+
+    policy = _policy_for(env, model_path, norm_path, masked)
+    return drive_episode(env, PreemptionOverride(policy, env, index), wall_start)
+
+
+def run_student_episode(seed, route_files, num_seconds, student_path=STUDENT_FILE, **kwargs):
+    """The decision tree distilled from the PPO agent (distill.py), on raw observations: no VecNormalize, no torch."""
+    from distill import DecisionTreePolicy
+    from frame_history import wrap_history
+
+    wall_start = time.perf_counter()
+    student = DecisionTreePolicy.load(student_path)
+    env = wrap_history(make_sumo_rl_env(seed, route_files, num_seconds), student.history)
+    return drive_episode(env, student, wall_start)
+
+
+CONTROLLERS = {
+    "fixed": run_fixed_time_episode,
+    "ppo": run_policy_episode,
+    "max-pressure": run_max_pressure_episode,
+    "ppo-preempt": run_preempted_policy_episode,
+    "tree": run_student_episode,
+}
+
+
+def run_job(job):
+    """Worker entry point: run one (controller, seed, scale) episode."""
+    controller = job["controller"]
+    recorder, sim_steps, decisions, wall_clock, decision_seconds = CONTROLLERS[controller](**job)
+    emergency = recorder.emergency.summary()
+    wait, time_loss = recorder.civilians.wait.summary(), recorder.civilians.time_loss.summary()
+    return {
+        "controller": controller,
+        "seed": job["seed"],
+        "scale": job["scale"],
+        "ambulance_time": recorder.ambulance_duration,
+        "emergency_departed": emergency["departed"],
+        "emergency_finished": emergency["finished"],
+        "emergency_p90": emergency["transit"].get("p90", float("nan")),
+        "emergency_max": emergency["transit"].get("max", float("nan")),
+        "emergency_stops": emergency["stops"].get("mean", float("nan")),
+        "emergency_time_loss": emergency["time_loss"].get("mean", float("nan")),
+        "civilian_avg_wait": recorder.civilian_avg_wait(),
+        "civilian_p50": wait.get("p50", float("nan")),
+        "civilian_p90": wait.get("p90", float("nan")),
+        "civilian_p99": wait.get("p99", float("nan")),
+        "civilian_time_loss_p90": time_loss.get("p90", float("nan")),
+        "civilian_time_loss_p99": time_loss.get("p99", float("nan")),
+        "sim_steps": sim_steps,
+        "decisions": decisions,
+        "decision_us": decision_seconds / decisions * 1e6 if decisions else float("nan"),
+        "wall_clock": wall_clock,
+        "steps_per_sec": sim_steps / wall_clock if wall_clock > 0 else float("nan"),
+        # Mergeable sketches, pooled per controller by run_benchmark (not written to runs.csv)
+        "civilian_stats": {"wait": recorder.civilians.wait, "time_loss": recorder.civilians.time_loss},
+    }
+
+
+def bootstrap_ci(values, n_boot, confidence, rng):
+    """Percentile bootstrap confidence interval of the mean."""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return float("nan"), float("nan")
+    idx = rng.integers(0, len(values), size=(n_boot, len(values)))
+    means = values[idx].mean(axis=1)
+    alpha = (1.0 - confidence) / 2.0
+    low, high = np.quantile(means, [alpha, 1.0 - alpha])
+    return float(low), float(high)
+
+
+def summarize(values, n_boot, confidence, rng):
+    values = np.asarray(values, dtype=float)
+    finished = values[~np.isnan(values)]
+    summary = {"n": int(len(values)), "missing": int(len(values) - len(finished))}
+    if len(finished) == 0:
+        return summary
+    p50, p90, p95 = np.percentile(finished, [50, 90, 95])
+    ci_low, ci_high = bootstrap_ci(finished, n_boot, confidence, rng)
+    summary.update({
+        "mean": float(finished.mean()),
+        "std": float(finished.std(ddof=1)) if len(finished) > 1 else 0.0,
+        "p50": float(p50),
+        "p90": float(p90),
+        "p95": float(p95),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+    })
+    return summary
+
+
+def paired_comparison(baseline, candidate, n_boot, confidence, rng):
+    """
+    Compare two controllers on the same (seed, scale) pairs.
+    Reports the bootstrap CI of the mean difference (candidate - baseline)
+    and a two-sided sign-flip permutation p-value.
+    """
+    baseline = np.asarray(baseline, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    keep = ~(np.isnan(baseline) | np.isnan(candidate))
+    diff = candidate[keep] - baseline[keep]
+    if len(diff) < 2:
+        return {"pairs": int(len(diff))}
+
+    ci_low, ci_high = bootstrap_ci(diff, n_boot, confidence, rng)
+    observed = abs(diff.mean())
+    signs = rng.choice([-1.0, 1.0], size=(n_boot, len(diff)))
+    flipped = np.abs((signs * diff).mean(axis=1))
+    p_value = (np.sum(flipped >= observed) + 1) / (n_boot + 1)
+
+    base_mean = baseline[keep].mean()
+    return {
+        "pairs": int(len(diff)),
+        "mean_diff": float(diff.mean()),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "p_value": float(p_value),
+        "improvement_pct": float(-diff.mean() / base_mean * 100) if base_mean != 0 else float("nan"),
+    }
+
+
+def build_report(rows, controllers, n_boot, confidence, seed):
+    rng = np.random.default_rng(seed)
+    report = {"controllers": {}, "comparisons": {}}
+    metrics = ["ambulance_time", "emergency_p90", "emergency_stops", "emergency_time_loss",
+               "civilian_avg_wait", "civilian_p90", "civilian_p99", "wall_clock", "steps_per_sec", "decision_us"]
+
+    by_controller = {c: sorted((r for r in rows if r["controller"] == c),
+                               key=lambda r: (r["scale"], r["seed"]))
+                     for c in controllers}
+
+    for controller, runs in by_controller.items():
+        report["controllers"][controller] = {
+            metric: summarize([r[metric] for r in runs], n_boot, confidence, rng)
+            for metric in metrics
+        }
+
+    baseline = controllers[0]
+    base_runs = {(r["scale"], r["seed"]): r for r in by_controller[baseline]}
+    for controller in controllers[1:]:
+        pairs = [(base_runs[(r["scale"], r["seed"])], r) for r in by_controller[controller]
+                 if (r["scale"], r["seed"]) in base_runs]
+        report["comparisons"][f"{controller}_vs_{baseline}"] = {
+            metric: paired_comparison([b[metric] for b, _ in pairs], [c[metric] for _, c in pairs],
+                                      n_boot, confidence, rng)
+            for metric in ["ambulance_time", "emergency_p90", "civilian_avg_wait"]
+        }
+    return report
+
+
+def print_report(report, confidence):
+    pct = int(confidence * 100)
+    for controller, stats in report["controllers"].items():
+        print(f"\n📊 {controller}")
+        for metric in ["ambulance_time", "emergency_p90", "emergency_time_loss", "civilian_avg_wait"]:
+            s = stats[metric]
+            if "mean" not in s:
+                print(f"   {metric}: no finished runs ({s['missing']} missing)")
+                continue
+            print(f"   {metric}: mean {s['mean']:.2f}s [{pct}% CI {s['ci_low']:.2f}, {s['ci_high']:.2f}] "
+                  f"p50 {s['p50']:.2f} p90 {s['p90']:.2f} p95 {s['p95']:.2f} (n={s['n']}, missing={s['missing']})")
+        pooled = report.get("pooled_civilians", {}).get(controller)
+        if pooled and pooled["wait"]["count"]:
+            wait, loss = pooled["wait"], pooled["time_loss"]
+            print(f"   all civilians ({wait['count']}): wait p50 {wait['p50']:.2f}s p90 {wait['p90']:.2f}s "
+                  f"p99 {wait['p99']:.2f}s | time loss p50 {loss['p50']:.2f}s p90 {loss['p90']:.2f}s "
+                  f"p99 {loss['p99']:.2f}s")
+        speed = stats["steps_per_sec"]
+        # Controllers without decisions (fixed-time) have no per-decision latency
+        decision_us = stats["decision_us"].get("mean")
+        decision = f"{decision_us:.1f}µs per decision" if decision_us is not None else "n/a per decision"
+        print(f"   throughput: {speed.get('mean', float('nan')):.0f} sim-steps/s, "
+              f"{stats['wall_clock'].get('mean', float('nan')):.2f}s wall per run, {decision}")
+
+    for name, comparison in report["comparisons"].items():
+        print(f"\n⚖️  {name}")
+        for metric, c in comparison.items():
+            if "mean_diff" not in c:
+                print(f"   {metric}: not enough paired runs ({c['pairs']})")
+                continue
+            verdict = "significant" if c["p_value"] < 1 - confidence else "not significant"
+            print(f"   {metric}: Δ {c['mean_diff']:+.2f}s [{pct}% CI {c['ci_low']:+.2f}, {c['ci_high']:+.2f}] "
+                  f"improvement {c['improvement_pct']:.1f}% p={c['p_value']:.4f} ({verdict})")
+
+
+def run_benchmark(controllers=("fixed", "ppo"), seeds=30, scales=(0.8, 1.0, 1.2), workers=None,
+                  num_seconds=1000, model_path="optimized_traffic_agent", norm_path="vec_normalize.pkl",
+                  n_boot=10000, confidence=0.95, out_dir="benchmark_results", emergency_file=EMERGENCY_FILE,
+                  student_path=STUDENT_FILE, emergency_obs=False, masked=False, emergency_radius=None):
+    controllers = list(controllers)
+    workers = workers or os.cpu_count()
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Written once here so the workers never race on the same scaled file
+    route_files = {scale: route_files_for(scale, out_dir, emergency_file) for scale in scales}
+    # Same for the emergency-route table: built (or checked against the net) once, only read by the workers
+    route_table = None
+    if "ppo-preempt" in controllers:
+        from emergency_routes import TABLE_FILE, load_or_build_table
+
+        route_table = TABLE_FILE
+        load_or_build_table(route_table, NET_FILE)
+    jobs = [
+        {"controller": c, "seed": seed, "scale": scale, "route_files": route_files[scale],
+         "num_seconds": num_seconds, "model_path": model_path, "norm_path": norm_path,
+         "student_path": student_path, "emergency_obs": emergency_obs, "masked": masked,
+         "emergency_radius": emergency_radius, "route_table": route_table}
+        for c in controllers for scale in scales for seed in range(seeds)
+    ]
+    print(f"🚀 Benchmarking {controllers} on {seeds} seeds x {len(scales)} demand scales "
+          f"({len(jobs)} runs, {workers} workers)...")
+
+    rows = []
+    pooled = {c: {"wait": StreamingStats(), "time_loss": StreamingStats()} for c in controllers}
+    bench_start = time.perf_counter()
+    # spawn: each worker gets its own traci/torch state instead of a forked copy
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        futures = [pool.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            row = future.result()
+            # Every vehicle of every run goes into one distribution per controller
+            for metric, stats in row.pop("civilian_stats").items():
+                pooled[row["controller"]][metric].merge(stats)
+            rows.append(row)
+            print(f"   [{len(rows)}/{len(jobs)}] {row['controller']} seed={row['seed']} scale={row['scale']:g} "
+                  f"emergency={row['ambulance_time']:.1f}s ({row['emergency_finished']}/{row['emergency_departed']}) "
+                  f"wait={row['civilian_avg_wait']:.2f}s (p99 {row['civilian_p99']:.1f}s) "
+                  f"wall={row['wall_clock']:.2f}s ({row['steps_per_sec']:.0f} steps/s)")
+    print(f"✅ {len(rows)} runs finished in {time.perf_counter() - bench_start:.1f}s")
+
+    rows.sort(key=lambda r: (r["controller"], r["scale"], r["seed"]))
+    with open(os.path.join(out_dir, "runs.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    report = build_report(rows, controllers, n_boot, confidence, seed=0)
+    report["pooled_civilians"] = {c: {metric: stats.summary() for metric, stats in pooled[c].items()}
+                                  for c in controllers}
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report, confidence)
+    print(f"\n💾 Saved {out_dir}/runs.csv and {out_dir}/summary.json")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-seed A/B benchmark of traffic signal controllers")
+    parser.add_argument("--controllers", nargs="+", default=["fixed", "ppo"], choices=sorted(CONTROLLERS),
+                        help="First controller is the baseline the others are compared against")
+    parser.add_argument("--seeds", type=int, default=30, help="Number of SUMO seeds per demand scale")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.8, 1.0, 1.2],
+                        help="Civilian demand multipliers")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel SUMO processes (default: CPU count)")
+    parser.add_argument("--num-seconds", type=int, default=1000)
+    parser.add_argument("--model", default="optimized_traffic_agent")
+    parser.add_argument("--vecnorm", default="vec_normalize.pkl")
+    parser.add_argument("--bootstrap", type=int, default=10000, help="Bootstrap/permutation resamples")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--out", default="benchmark_results")
+    parser.add_argument("--emergency-routes", default=EMERGENCY_FILE,
+                        help="Route file with the emergency vehicles (e.g. one from emergency_tracker.py)")
+    parser.add_argument("--student", default=STUDENT_FILE, help="Distilled tree for the 'tree' controller")
+    parser.add_argument("--emergency-obs", action="store_true",
+                        help="The PPO model was trained with train_optimized.py --emergency-obs")
+    parser.add_argument("--emergency-radius", type=float, default=None,
+                        help="Its train_optimized.py --emergency-radius (default: the default radius)")
+    parser.add_argument("--masked", action="store_true",
+                        help="The model is a MaskablePPO one from train_optimized.py --masked")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_benchmark(controllers=args.controllers, seeds=args.seeds, scales=args.scales, workers=args.workers,
+                  num_seconds=args.num_seconds, model_path=args.model, norm_path=args.vecnorm,
+                  n_boot=args.bootstrap, confidence=args.confidence, out_dir=args.out,
+                  emergency_file=args.emergency_routes, student_path=args.student, emergency_obs=args.emergency_obs,
+                  masked=args.masked, emergency_radius=args.emergency_radius)
@@ -0,0 +1,228 @@
+import copy
+import glob
+import gzip
+import os
+import pickle
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import torch
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import save_to_zip_file
+from stable_baselines3.common.vec_env import VecNormalize
+
+
+def snapshot_training_state(model, vec_normalize):
+    """
+    Copy everything needed to resume training into memory.
+
+    This is the only part that runs on the training thread: tensors are
+    cloned and small objects deep-copied so the background writer never
+    reads anything PPO is still mutating.
+    """
+    # Same attribute selection as BaseAlgorithm.save()
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for torch_var in state_dicts_names + torch_variable_names:
+        exclude.add(torch_var.split(".")[0])
+    for param_name in exclude:
+        data.pop(param_name, None)
+    # Deques are appended to in place during rollouts
+    for name, value in data.items():
+        if isinstance(value, deque):
+            data[name] = copy.deepcopy(value)
+
+    # state_dict() tensors share storage with the live parameters/optimiser
+    params = copy.deepcopy(model.get_parameters())
+
+    rng = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "torch_cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+    return {
+        "num_timesteps": model.num_timesteps,
+        "data": data,
+        "params": params,
+        "vecnormalize": copy.deepcopy(vec_normalize.__getstate__()) if vec_normalize is not None else None,
+        "rng": rng,
+    }
+
+
+def write_checkpoint(snapshot, save_path, name_prefix):
+    """
+    Serialise a snapshot to disk:
+    - {prefix}_{steps}_steps.zip: a regular SB3 model file (PPO.load works),
+      including the optimiser state
+    - {prefix}_{steps}_steps.resume.gz: gzip-compressed VecNormalize stats and
+      RNG states, written last so its presence marks a complete checkpoint
+    """
+    base = os.path.join(save_path, f"{name_prefix}_{snapshot['num_timesteps']}_steps")
+
+    save_to_zip_file(base + ".zip.tmp", data=snapshot["data"], params=snapshot["params"])
+    os.replace(base + ".zip.tmp", base + ".zip")
+
+    resume = {"num_timesteps": snapshot["num_timesteps"], "vecnormalize": snapshot["vecnormalize"],
+              "rng": snapshot["rng"]}
+    with gzip.open(base + ".resume.gz.tmp", "wb", compresslevel=6) as f:
+        pickle.dump(resume, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(base + ".resume.gz.tmp", base + ".resume.gz")
+    return base
+
+
+class BackgroundCheckpointWriter:
+    """
+    Single background thread that writes snapshots. If training produces a
+    new snapshot while the previous one is still being written, only the
+    newest pending snapshot is kept, so the training thread never waits.
+    """
+
+    def __init__(self, save_path, name_prefix, verbose=0):
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+        self.verbose = verbose
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self.error = None
+        os.makedirs(save_path, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, snapshot):
+        if self.error is not None:
+            raise RuntimeError("Background checkpoint writer failed") from self.error
+        with self._lock:
+            if self._pending is not None and self.verbose:
+                print(f"⚠️ Dropping unwritten checkpoint at {self._pending['num_timesteps']} steps (writer busy)")
+            self._pending = snapshot
+            self._idle.clear()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                snapshot, self._pending = self._pending, None
+                self._wakeup.clear()
+                if snapshot is None:
+                    self._idle.set()
+                    if self._closed:
+                        return
+                    continue
+            try:
+                start = time.perf_counter()
+                base = write_checkpoint(snapshot, self.save_path, self.name_prefix)
+                if self.verbose:
+                    print(f"💾 Checkpoint written in background: {base} ({time.perf_counter() - start:.2f}s)")
+            except Exception as e:
+                self.error = e
+                print(f"❌ Checkpoint write failed: {e}")
+            self._wakeup.set()
+
+    def flush(self):
+        """Block until every submitted snapshot is on disk."""
+        self._idle.wait()
+        if self.error is not None:
+            raise RuntimeError("Background checkpoint writer failed") from self.error
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """
+    Replacement for CheckpointCallback: snapshots the full training state in
+    memory and hands it to a background writer, so rollout collection is not
+    stalled by disk I/O.
+
+    Snapshots are taken at the first rollout boundary after every
+    `save_freq` environment steps (i.e. right after a PPO update), plus one
+    at the end of training, so a resumed run continues from exactly the
+    state the next rollout would have started from.
+    """
+
+    def __init__(self, save_freq, save_path, name_prefix="rl_model", verbose=0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+        self.writer = None
+        self._last_saved = 0
+
+    def _init_callback(self):
+        self.writer = BackgroundCheckpointWriter(self.save_path, self.name_prefix, self.verbose)
+        self._last_saved = self.model.num_timesteps
+
+    def _snapshot(self):
+        start = time.perf_counter()
+        self.writer.submit(snapshot_training_state(self.model, self.model.get_vec_normalize_env()))
+        self._last_saved = self.model.num_timesteps
+        if self.verbose > 1:
+            print(f"📸 Snapshot at {self.num_timesteps} steps took {time.perf_counter() - start:.3f}s")
+
+    def _on_rollout_start(self):
+        if self.num_timesteps // self.save_freq > self._last_saved // self.save_freq:
+            self._snapshot()
+
+    def _on_step(self):
+        return True
+
+    def _on_training_end(self):
+        if self.num_timesteps != self._last_saved:
+            self._snapshot()
+        self.writer.close()
+
+
+def find_latest_checkpoint(save_path, name_prefix):
+    """Return the base path of the newest complete checkpoint, or None."""
+    pattern = re.compile(re.escape(name_prefix) + r"_(\d+)_steps\.resume\.gz$")
+    candidates = []
+    for path in glob.glob(os.path.join(save_path, f"{name_prefix}_*_steps.resume.gz")):
+        match = pattern.search(os.path.basename(path))
+        if match:
+            candidates.append((int(match.group(1)), path[: -len(".resume.gz")]))
+    return max(candidates)[1] if candidates else None
+
+
+def load_training_state(base, venv, device="auto", algorithm=None):
+    """
+    Rebuild (model, VecNormalize env) from a checkpoint written by
+    write_checkpoint and restore the RNG states it captured. `algorithm`
+    is the class the checkpoint was trained with (PPO by default).
+    """
+    if algorithm is None:
+        from stable_baselines3 import PPO as algorithm
+
+    with gzip.open(base + ".resume.gz", "rb") as f:
+        resume = pickle.load(f)
+
+    env = venv
+    if resume["vecnormalize"] is not None:
+        env = VecNormalize.__new__(VecNormalize)
+        env.__setstate__(resume["vecnormalize"])
+        env.set_venv(venv)
+
+    model = algorithm.load(base + ".zip", env=env, device=device)
+
+    rng = resume["rng"]
+    random.setstate(rng["python"])
+    np.random.set_state(rng["numpy"])
+    torch.set_rng_state(rng["torch"])
+    if rng["torch_cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng["torch_cuda"])
+
+    return model, env
@@ -0,0 +1,356 @@
+import argparse
+import json
+import os
+import timeit
+
+import numpy as np
+
+from action_masking import MaskedPolicy
+from benchmark import (EMERGENCY_FILE, STUDENT_FILE, make_sumo_rl_env, route_files_for, run_policy_episode,
+                       run_student_episode)
+from frame_history import with_saved_history
+from max_pressure import unwrap_sumo_env
+
+OUT_DIR = os.path.dirname(STUDENT_FILE)
+
+
+class DecisionTreePolicy:
+    """
+    Bounded-depth decision tree over the stacked sumo-rl observation, in
+    flat arrays: node i tests obs[feature[i]] <= threshold[i] and goes to
+    left[i] or right[i]; leaves have left[i] == -1 and return value[i].
+
+    act() is a loop over plain Python lists, so the exported tree needs
+    nothing but the JSON file (or the generated Python/C source). predict()
+    gives it the SB3 interface for benchmark.py.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, history=1):
+        self.feature = list(map(int, feature))
+        self.threshold = list(map(float, threshold))
+        self.left = list(map(int, left))
+        self.right = list(map(int, right))
+        self.value = list(map(int, value))
+        self.history = history
+
+    def act(self, obs):
+        node = 0
+        left, right, feature, threshold = self.left, self.right, self.feature, self.threshold
+        while left[node] >= 0:
+            node = left[node] if obs[feature[node]] <= threshold[node] else right[node]
+        return self.value[node]
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        obs = np.asarray(observation)
+        if obs.ndim > 1:
+            return np.array([self.act(row) for row in obs]), state
+        return self.act(obs), state
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def depth(self):
+        def depth(node):
+            return 0 if self.left[node] < 0 else 1 + max(depth(self.left[node]), depth(self.right[node]))
+        return depth(0)
+
+    def fold_normalization(self, mean, var, epsilon=1e-8):
+        """
+        Tree fitted on VecNormalize'd observations -> same tree on raw ones.
+        Normalisation is increasing per feature, so x_norm <= t exactly when
+        x <= t * sqrt(var + eps) + mean (thresholds lie between observed,
+        unclipped values).
+        """
+        threshold = [t * np.sqrt(var[f] + epsilon) + mean[f] if f >= 0 else 0.0
+                     for f, t in zip(self.feature, self.threshold)]
+        return DecisionTreePolicy(self.feature, threshold, self.left, self.right, self.value, self.history)
+
+    def save(self, path=STUDENT_FILE):
+        with open(path, "w") as f:
+            json.dump({"history": self.history, "feature": self.feature, "threshold": self.threshold,
+                       "left": self.left, "right": self.right, "value": self.value}, f)
+
+    @classmethod
+    def load(cls, path=STUDENT_FILE):
+        with open(path) as f:
+            tree = json.load(f)
+        return cls(tree["feature"], tree["threshold"], tree["left"], tree["right"], tree["value"], tree["history"])
+
+    def to_python(self):
+        """Source of a dependency-free act(obs) with the tree unrolled into if/else."""
+        lines = [f"# Generated by distill.py: depth {self.depth}, {self.n_nodes} nodes, "
+                 f"observation history {self.history}", "", "", "def act(obs):"]
+
+        def emit(node, indent):
+            pad = "    " * indent
+            if self.left[node] < 0:
+                lines.append(f"{pad}return {self.value[node]}")
+                return
+            lines.append(f"{pad}if obs[{self.feature[node]}] <= {self.threshold[node]!r}:")
+            emit(self.left[node], indent + 1)
+            lines.append(f"{pad}else:")
+            emit(self.right[node], indent + 1)
+
+        emit(0, 1)
+        return "\n".join(lines) + "\n"
+
+    def to_c(self):
+        """Source of `int student_act(const float *obs)` over static node tables."""
+        n = self.n_nodes
+
+        def table(ctype, name, values):
+            return f"static const {ctype} {name}[{n}] = {{{', '.join(values)}}};"
+
+        return "\n".join([
+            f"/* Generated by distill.py: depth {self.depth}, {n} nodes, observation history {self.history} */",
+            table("short", "FEATURE", map(str, self.feature)),
+            table("float", "THRESHOLD", (f"{t!r}f" for t in self.threshold)),
+            table("short", "LEFT", map(str, self.left)),
+            table("short", "RIGHT", map(str, self.right)),
+            table("unsigned char", "VALUE", map(str, self.value)),
+            "",
+            "int student_act(const float *obs)",
+            "{",
+            "    int node = 0;",
+            "    while (LEFT[node] >= 0)",
+            "        node = obs[FEATURE[node]] <= THRESHOLD[node] ? LEFT[node] : RIGHT[node];",
+            "    return VALUE[node];",
+            "}",
+            "",
+        ])
+
+
+def _best_split(X, y, n_actions, min_samples_leaf):
+    """(feature, threshold, gini decrease) of the best split of (X, y), or None."""
+    n = len(y)
+    onehot = np.eye(n_actions)[y]
+    total = onehot.sum(axis=0)
+    parent = n - (total ** 2).sum() / n
+    best = None
+    for f in range(X.shape[1]):
+        order = np.argsort(X[:, f], kind="stable")
+        values = X[order, f]
+        left = np.cumsum(onehot[order], axis=0)[:-1]       # class counts left of each cut
+        n_left = np.arange(1, n)
+        n_right = n - n_left
+        # Cut only between distinct values and with enough samples on both sides
+        valid = (values[1:] > values[:-1]) & (n_left >= min_samples_leaf) & (n_right >= min_samples_leaf)
+        if not valid.any():
+            continue
+        right = total - left
+        # n * weighted gini = sum over sides of (n_side - sum(counts^2) / n_side)
+        impurity = (n_left - (left ** 2).sum(axis=1) / n_left) + (n_right - (right ** 2).sum(axis=1) / n_right)
+        impurity[~valid] = np.inf
+        cut = int(np.argmin(impurity))
+        gain = parent - impurity[cut]
+        if gain > 1e-9 and (best is None or gain > best[2]):
+            best = (f, (values[cut] + values[cut + 1]) / 2, gain)
+    return best
+
+
+def fit_tree(X, y, n_actions, max_depth=8, min_samples_leaf=5, history=1):
+    """
+    CART (Gini) classifier of depth <= max_depth, grown greedily. Sibling
+    leaves that predict the same action are merged back into their parent.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=int)
+    feature, threshold, left, right, value = [], [], [], [], []
+
+    def build(idx, depth):
+        node = len(feature)
+        counts = np.bincount(y[idx], minlength=n_actions)
+        feature.append(-1)
+        threshold.append(0.0)
+        left.append(-1)
+        right.append(-1)
+        value.append(int(counts.argmax()))
+        if depth == max_depth or counts.max() == len(idx) or len(idx) < 2 * min_samples_leaf:
+            return node
+        split = _best_split(X[idx], y[idx], n_actions, min_samples_leaf)
+        if split is None:
+            return node
+        f, t, _ = split
+        goes_left = X[idx, f] <= t
+        l = build(idx[goes_left], depth + 1)
+        r = build(idx[~goes_left], depth + 1)
+        if left[l] < 0 and left[r] < 0 and value[l] == value[r]:
+            # Both children are leaves (the last two nodes) with the same answer
+            value[node] = value[l]
+            for array in (feature, threshold, left, right, value):
+                del array[l:]
+            return node
+        feature[node], threshold[node], left[node], right[node] = f, t, l, r
+        return node
+
+    build(np.arange(len(y)), 0)
+    return DecisionTreePolicy(feature, threshold, left, right, value, history)
+
+
+def make_teacher_env(seed, route_files, num_seconds, norm_path, masked=False):
+    """Evaluation env of the teacher: history and frozen VecNormalize stats from `norm_path`."""
+    from stable_baselines3.common.vec_env import VecNormalize
+
+    env = make_sumo_rl_env(seed, route_files, num_seconds, masked=masked)
+    env = VecNormalize.load(norm_path, with_saved_history(env, norm_path))
+    env.training = False
+    env.norm_reward = False
+    return env
+
+
+def collect(scenarios, teacher, norm_path, num_seconds, student=None, beta=1.0, rng=None, masked=False):
+    """
+    Roll out each (seed, route_files) scenario and label every visited state
+    with the teacher's action. With a student, each step is driven by the
+    teacher with probability beta and by the student otherwise (DAgger), so
+    the data covers the states the student itself gets into.
+    With masked, the teacher is a MaskablePPO model labelling the
+    event-driven decisions it was trained on, given their action masks.
+    Returns (normalised obs, raw obs, teacher actions).
+    """
+    rng = rng or np.random.default_rng(0)
+    normalized, raw, actions = [], [], []
+    for seed, route_files in scenarios:
+        env = make_teacher_env(seed, route_files, num_seconds, norm_path, masked)
+        labeller = MaskedPolicy(teacher, env) if masked else teacher
+        obs = env.reset()
+        while True:
+            action, _ = labeller.predict(obs, deterministic=True)
+            original = env.get_original_obs()
+            normalized.append(obs[0].copy())
+            raw.append(original[0].copy())
+            actions.append(int(action[0]))
+            if student is not None and rng.random() >= beta:
+                action = np.array([student.act(original[0])])
+            obs, _, done, _ = env.step(action)
+            if done[0]:
+                break
+        env.close()
+    return np.array(normalized), np.array(raw), np.array(actions)
+
+
+def agreement(student, raw, actions, num_green_phases):
+    """Share of states where the student picks the teacher's action: overall, and where switching is allowed."""
+    chosen = np.array([student.act(obs) for obs in raw])
+    # Newest frame's min-green flag: 1 once sumo-rl would act on a switch
+    can_switch = raw[:, -(raw.shape[1] // student.history) + num_green_phases] > 0.5
+    matches = chosen == actions
+    return float(matches.mean()), float(matches[can_switch].mean()) if can_switch.any() else float("nan")
+
+
+def distill(model_path="optimized_traffic_agent", norm_path="vec_normalize.pkl", seeds=10, scales=(0.8, 1.0, 1.2),
+            eval_seeds=3, iterations=3, max_depth=8, min_samples_leaf=5, num_seconds=1000,
+            out=None, out_dir=OUT_DIR, emergency_file=EMERGENCY_FILE, masked=False):
+    """
+    Distill the PPO agent into a DecisionTreePolicy. The tree (`out`,
+    default student_policy.json in out_dir) and its generated .py/.c
+    exports are written next to each other, with the report in out_dir.
+    With masked, the teacher is a train_optimized.py --masked model.
+    """
+    from train_optimized import algorithm
+
+    out = out or os.path.join(out_dir, os.path.basename(STUDENT_FILE))
+
+    # 1. Teacher and scenarios (held-out seeds start after the training ones)
+    teacher = algorithm(masked).load(model_path, device="cpu")
+    norm = make_teacher_env(0, route_files_for(1.0, out_dir, emergency_file), num_seconds, norm_path)
+    mean, var, epsilon = norm.obs_rms.mean, norm.obs_rms.var, norm.epsilon
+    obs_size = norm.observation_space.shape[0]
+    history = obs_size // unwrap_sumo_env(norm).observation_space.shape[0]
+    # sumo-rl: one action per green phase
+    n_actions = int(norm.action_space.n)
+    norm.close()
+    route_files = {scale: route_files_for(scale, out_dir, emergency_file) for scale in scales}
+    train = [(seed, route_files[s]) for s in scales for seed in range(seeds)]
+    held_out = [(seed, route_files[s]) for s in scales for seed in range(seeds, seeds + eval_seeds)]
+
+    # 2. DAgger: teacher rollouts first, then more and more student-driven ones
+    print(f"🎓 Distilling {model_path} into a depth-{max_depth} tree ({len(train)} scenarios, {iterations} rounds)...")
+    rng = np.random.default_rng(0)
+    X, y = np.empty((0, obs_size)), np.empty(0, dtype=int)
+    student = None
+    for i in range(iterations):
+        beta = 1.0 if student is None else 0.5 ** i
+        normalized, _, actions = collect(train, teacher, norm_path, num_seconds, student, beta, rng, masked)
+        X, y = np.concatenate([X, normalized]), np.concatenate([y, actions])
+        student = fit_tree(X, y, n_actions, max_depth, min_samples_leaf, history).fold_normalization(
+            mean, var, epsilon)
+        print(f"   round {i + 1}: {len(y)} labelled states, tree depth {student.depth}, {student.n_nodes} nodes")
+
+    # 3. Agreement with the teacher on held-out scenarios the student drives itself
+    _, raw, actions = collect(held_out, teacher, norm_path, num_seconds, student, beta=0.0, masked=masked)
+    overall, switchable = agreement(student, raw, actions, n_actions)
+
+    # 4. Export: JSON tables + generated Python and C
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    student.save(out)
+    stem = os.path.splitext(out)[0]
+    with open(stem + ".py", "w") as f:
+        f.write(student.to_python())
+    with open(stem + ".c", "w") as f:
+        f.write(student.to_c())
+
+    # 5. Episode metrics and inference cost, teacher vs student
+    metrics = {"teacher": [], "student": []}
+    for seed, files in held_out:
+        for name, run in (("teacher", run_policy_episode), ("student", run_student_episode)):
+            recorder, _, decisions, _, decision_seconds = run(seed=seed, route_files=files, num_seconds=num_seconds,
+                                                              model_path=model_path, norm_path=norm_path,
+                                                              student_path=out, masked=masked)
+            metrics[name].append((recorder.ambulance_duration, recorder.civilian_avg_wait(),
+                                  decision_seconds / decisions * 1e6))
+    namespace = {}
+    exec(student.to_python(), namespace)
+    calls = 100000
+    # Plain floats, the way an embedded caller would hold them
+    obs = raw[0].tolist()
+    generated_us = timeit.timeit(lambda: namespace["act"](obs), number=calls) / calls * 1e6
+    tree_us = timeit.timeit(lambda: student.act(obs), number=calls) / calls * 1e6
+
+    report = {
+        "scenarios": len(train), "held_out": len(held_out), "labelled_states": len(y),
+        "depth": student.depth, "nodes": student.n_nodes, "history": history,
+        "agreement": overall, "agreement_when_switchable": switchable,
+        "student_act_us": tree_us, "generated_act_us": generated_us,
+    }
+    for name, rows in metrics.items():
+        rows = np.array(rows, dtype=float)
+        report[name] = {"ambulance_time": float(np.nanmean(rows[:, 0])), "civilian_avg_wait": float(rows[:, 1].mean()),
+                        "decision_us": float(rows[:, 2].mean())}
+    with open(os.path.join(out_dir, "distill_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✅ Student saved: {out}, {stem}.py, {stem}.c (depth {student.depth}, {student.n_nodes} nodes)")
+    print(f"🎯 Action agreement on {len(held_out)} held-out runs: {overall:.1%} "
+          f"({switchable:.1%} where a switch is allowed)")
+    for name in ("teacher", "student"):
+        r = report[name]
+        print(f"📊 {name}: emergency {r['ambulance_time']:.1f}s | civilian wait {r['civilian_avg_wait']:.2f}s | "
+              f"{r['decision_us']:.1f}µs per decision in the env loop")
+    print(f"⚡ Student inference: {tree_us:.2f}µs (table walk), {generated_us:.2f}µs (generated if/else)")
+    return student, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the PPO agent into a small decision tree")
+    parser.add_argument("--model", default="optimized_traffic_agent")
+    parser.add_argument("--vecnorm", default="vec_normalize.pkl")
+    parser.add_argument("--seeds", type=int, default=10, help="Training seeds per demand scale")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.8, 1.0, 1.2])
+    parser.add_argument("--eval-seeds", type=int, default=3, help="Held-out seeds per demand scale")
+    parser.add_argument("--iterations", type=int, default=3, help="DAgger rounds")
+    parser.add_argument("--max-depth", type=int, default=8)
+    parser.add_argument("--min-samples-leaf", type=int, default=5)
+    parser.add_argument("--num-seconds", type=int, default=1000)
+    parser.add_argument("--out", default=None,
+                        help="Student JSON (default: student_policy.json in --out-dir); .py/.c go next to it")
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--masked", action="store_true",
+                        help="The teacher is a MaskablePPO model from train_optimized.py --masked")
+    args = parser.parse_args()
+    distill(model_path=args.model, norm_path=args.vecnorm, seeds=args.seeds, scales=args.scales,
+            eval_seeds=args.eval_seeds, iterations=args.iterations, max_depth=args.max_depth,
+            min_samples_leaf=args.min_samples_leaf, num_seconds=args.num_seconds, out=args.out,
+            out_dir=args.out_dir, masked=args.masked)
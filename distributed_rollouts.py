@@ -0,0 +1,708 @@
+import argparse
+import functools
+import json
+import multiprocessing as mp
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.running_mean_std import RunningMeanStd
+from stable_baselines3.common.vec_env import VecEnv, VecNormalize
+
+# ---------------------------------------------------------------------------
+# Wire protocol
+#
+# Every frame is a 5-byte header (message type, payload length) followed by
+# the payload. Array payloads are a count followed by, per array, a dtype
+# code, ndim, the dims and the raw C-ordered bytes, so the receiver can wrap
+# them with np.frombuffer without copying.
+# ---------------------------------------------------------------------------
+
+MSG_HELLO = 1       # worker -> learner: requested slot
+MSG_WEIGHTS = 2     # learner -> worker: version, rollout length, meso flag, obs stats, policy tensors
+MSG_BATCH = 3       # worker -> learner: version + transition arrays
+MSG_HEARTBEAT = 4   # worker -> learner: liveness
+MSG_SHUTDOWN = 5    # learner -> worker
+MSG_CONFIG = 6      # learner -> worker: env config (JSON), sent once the slot is assigned
+
+HEADER = struct.Struct("!BI")
+DTYPES = [np.dtype(np.float32), np.dtype(np.float64), np.dtype(np.int64), np.dtype(np.uint8)]
+DTYPE_CODES = {dtype: code for code, dtype in enumerate(DTYPES)}
+
+BATCH_FIELDS = ["obs", "actions", "action_masks", "rewards", "episode_starts", "dones", "values", "log_probs",
+                "terminal_values", "last_obs", "last_value", "episodes"]
+
+
+def pack_arrays(arrays):
+    parts = [struct.pack("!I", len(arrays))]
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        parts.append(struct.pack("!BB", DTYPE_CODES[array.dtype], array.ndim))
+        parts.append(struct.pack(f"!{array.ndim}I", *array.shape))
+        parts.append(array.tobytes())
+    return b"".join(parts)
+
+
+def unpack_arrays(payload):
+    view = memoryview(payload)
+    (count,), offset = struct.unpack_from("!I", view, 0), 4
+    arrays = []
+    for _ in range(count):
+        code, ndim = struct.unpack_from("!BB", view, offset)
+        offset += 2
+        shape = struct.unpack_from(f"!{ndim}I", view, offset)
+        offset += 4 * ndim
+        dtype = DTYPES[code]
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays.append(np.frombuffer(view[offset:offset + nbytes], dtype=dtype).reshape(shape))
+        offset += nbytes
+    return arrays
+
+
+def send_frame(sock, msg_type, payload=b"", lock=None):
+    frame = HEADER.pack(msg_type, len(payload)) + payload
+    if lock is None:
+        sock.sendall(frame)
+    else:
+        with lock:
+            sock.sendall(frame)
+
+
+def _recv_exact(sock, n):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        chunk = sock.recv_into(view[received:], n - received)
+        if chunk == 0:
+            raise ConnectionError("Connection closed")
+        received += chunk
+    return buffer
+
+
+def recv_frame(sock):
+    msg_type, length = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return msg_type, _recv_exact(sock, length) if length else b""
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+def make_worker_env(config, meso):
+    """
+    The VecEnv train_optimized.py trains on for the options in `config`
+    (history, masked, emergency_obs, emergency_radius, meso_step_length,
+    meso_delta_time; missing ones take train_optimized.py's defaults),
+    meso- or microscopic.
+    """
+    from emergency_observation import CONTEXT_RADIUS, emergency_observation
+    from train_optimized import HISTORY_LENGTH, MESO_DELTA_TIME, MESO_STEP_LENGTH, make_env, make_meso_env, vectorize
+
+    # Every worker process would write the same training_results_conn0 CSVs
+    if meso:
+        env_fn = functools.partial(make_meso_env, config.get("meso_step_length", MESO_STEP_LENGTH),
+                                   config.get("meso_delta_time", MESO_DELTA_TIME), out_csv_name=None)
+    else:
+        observation_class = None
+        if config.get("emergency_obs"):
+            observation_class = emergency_observation(config.get("emergency_radius", CONTEXT_RADIUS))
+        env_fn = functools.partial(make_env, observation_class, out_csv_name=None)
+    return vectorize(env_fn, config.get("history", HISTORY_LENGTH), config.get("masked", False))
+
+
+def run_worker(host, port, slot=-1, heartbeat_interval=1.0, seed=None):
+    """
+    Host one SUMO environment and serve rollouts to the learner.
+
+    The learner first sends the env config (history, masking, emergency
+    observation, meso step settings). Each round it then sends the current
+    policy weights, observation normalisation stats and whether to run the
+    mesoscopic env; the worker runs `n_steps` transitions with its local
+    copy of the policy and streams them back as one batch. A background
+    thread sends heartbeats so the learner can tell a slow SUMO episode from
+    a dead worker.
+    """
+    from train_optimized import POLICY_KWARGS
+
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    send_lock = threading.Lock()
+    send_frame(sock, MSG_HELLO, struct.pack("!i", slot), send_lock)
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(heartbeat_interval):
+            try:
+                send_frame(sock, MSG_HEARTBEAT, lock=send_lock)
+            except OSError:
+                return
+
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+
+    if seed is not None:
+        torch.manual_seed(seed)
+    env = policy = config = None
+    meso = None
+
+    try:
+        while True:
+            msg_type, payload = recv_frame(sock)
+            if msg_type == MSG_SHUTDOWN:
+                break
+            if msg_type == MSG_CONFIG:
+                config = json.loads(bytes(payload))
+                continue
+            if msg_type != MSG_WEIGHTS or config is None:
+                continue
+
+            header, mean, var, *tensors = unpack_arrays(payload)
+            version, n_steps = int(header[0]), int(header[1])
+            clip_obs, epsilon, gamma = float(header[2]), float(header[3]), float(header[4])
+
+            # (Re)build the env on the first round and when the learner leaves mesoscopic pretraining
+            if bool(header[5]) != meso:
+                if env is not None:
+                    env.close()
+                meso = bool(header[5])
+                env = make_worker_env(config, meso)
+                if seed is not None:
+                    env.seed(seed)
+                obs = env.reset()
+                episode_start = True
+                episode_return, episode_length = 0.0, 0
+            if policy is None:
+                policy = worker_policy(env, config.get("masked", False), POLICY_KWARGS)
+                param_names = list(policy.state_dict().keys())
+            policy.load_state_dict({name: torch.from_numpy(t.copy()) for name, t in zip(param_names, tensors)})
+
+            def normalize(x):
+                return np.clip((x - mean) / np.sqrt(var + epsilon), -clip_obs, clip_obs).astype(np.float32)
+
+            obs_dim = env.observation_space.shape[0]
+            batch = {
+                "obs": np.empty((n_steps, obs_dim), dtype=np.float32),
+                "actions": np.empty(n_steps, dtype=np.int64),
+                "action_masks": np.ones((n_steps, env.action_space.n), dtype=np.uint8),
+                "rewards": np.empty(n_steps, dtype=np.float32),
+                "episode_starts": np.empty(n_steps, dtype=np.uint8),
+                "dones": np.empty(n_steps, dtype=np.uint8),
+                "values": np.empty(n_steps, dtype=np.float32),
+                "log_probs": np.empty(n_steps, dtype=np.float32),
+                "terminal_values": np.zeros(n_steps, dtype=np.float32),
+            }
+            episodes = []
+            for t in range(n_steps):
+                extra = {}
+                if config.get("masked"):
+                    batch["action_masks"][t] = env.env_method("action_masks")[0]
+                    extra["action_masks"] = batch["action_masks"][t][None].astype(bool)
+                with torch.no_grad():
+                    obs_tensor = policy.obs_to_tensor(normalize(obs))[0]
+                    actions, values, log_probs = policy(obs_tensor, **extra)
+                action = actions.cpu().numpy()
+                new_obs, reward, done, info = env.step(action)
+
+                batch["obs"][t] = obs[0]
+                batch["actions"][t] = action[0]
+                batch["rewards"][t] = reward[0]
+                batch["episode_starts"][t] = episode_start
+                batch["dones"][t] = done[0]
+                batch["values"][t] = values.item()
+                batch["log_probs"][t] = log_probs.item()
+
+                episode_return += float(reward[0])
+                episode_length += 1
+                if done[0]:
+                    # Bootstrap truncated episodes the same way PPO.collect_rollouts does
+                    if info[0].get("TimeLimit.truncated", False) and "terminal_observation" in info[0]:
+                        terminal = normalize(info[0]["terminal_observation"][None])
+                        with torch.no_grad():
+                            batch["terminal_values"][t] = policy.predict_values(
+                                policy.obs_to_tensor(terminal)[0]).item()
+                    episodes.append((episode_return, episode_length))
+                    episode_return, episode_length = 0.0, 0
+                obs = new_obs
+                episode_start = bool(done[0])
+
+            with torch.no_grad():
+                last_value = policy.predict_values(policy.obs_to_tensor(normalize(obs))[0]).item()
+            batch["last_obs"] = obs[0].astype(np.float32)
+            batch["last_value"] = np.array([last_value, float(episode_start)], dtype=np.float32)
+            batch["episodes"] = np.array(episodes, dtype=np.float64).reshape(-1, 2)
+
+            payload = pack_arrays([np.array([version], dtype=np.int64)] + [batch[k] for k in BATCH_FIELDS])
+            send_frame(sock, MSG_BATCH, payload, send_lock)
+    except ConnectionError:
+        print(f"⚠️ Worker slot {slot}: learner went away")
+    finally:
+        stop.set()
+        if env is not None:
+            env.close()
+        sock.close()
+
+
+def worker_policy(env, masked, policy_kwargs):
+    """Local copy of the learner's policy network (MaskablePPO's with masked)."""
+    if masked:
+        from sb3_contrib.common.maskable.policies import MaskableActorCriticPolicy as policy_class
+    else:
+        from stable_baselines3.common.policies import ActorCriticPolicy as policy_class
+    policy = policy_class(env.observation_space, env.action_space, lambda _: 0.0, **policy_kwargs)
+    policy.set_training_mode(False)
+    return policy
+
+
+def _local_worker_main(host, port, slot):
+    run_worker(host, port, slot, seed=slot + int(time.time()) % 10000)
+
+
+# ---------------------------------------------------------------------------
+# Learner side
+# ---------------------------------------------------------------------------
+
+class WorkerHandle:
+    def __init__(self, slot):
+        self.slot = slot
+        self.sock = None
+        self.process = None
+        self.send_lock = threading.Lock()
+        self.batches = queue.Queue()
+        self.last_seen = 0.0
+        self.alive = False
+        self.restarts = 0
+
+
+class RolloutWorkerPool:
+    """
+    TCP server that rollout workers connect to (one slot per remote SUMO
+    environment); each worker gets `env_config` on connecting. Tracks liveness from heartbeats and batches; dead local
+    workers are respawned, remote ones are expected to be restarted by their
+    host's supervisor and reconnect to the same slot.
+    """
+
+    def __init__(self, num_workers, host="127.0.0.1", port=0, spawn_local=True,
+                 heartbeat_timeout=15.0, verbose=1, env_config=None):
+        self.num_workers = num_workers
+        self.env_config = env_config or {}
+        self.spawn_local = spawn_local
+        self.heartbeat_timeout = heartbeat_timeout
+        self.verbose = verbose
+        self.handles = [WorkerHandle(slot) for slot in range(num_workers)]
+        self._slots_lock = threading.Lock()
+        self._closing = False
+
+        self.server = socket.create_server((host, port))
+        self.host, self.port = self.server.getsockname()[:2]
+        threading.Thread(target=self._accept_loop, name="rollout-accept", daemon=True).start()
+        if self.verbose:
+            print(f"📡 Rollout learner listening on {self.host}:{self.port} for {num_workers} workers")
+
+        if spawn_local:
+            for handle in self.handles:
+                self._spawn(handle)
+
+    def _spawn(self, handle):
+        ctx = mp.get_context("spawn")
+        handle.process = ctx.Process(target=_local_worker_main, args=(self.host, self.port, handle.slot), daemon=True)
+        handle.process.start()
+
+    def _accept_loop(self):
+        while not self._closing:
+            try:
+                sock, address = self.server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                msg_type, payload = recv_frame(sock)
+            except ConnectionError:
+                continue
+            if msg_type != MSG_HELLO:
+                sock.close()
+                continue
+            (requested,) = struct.unpack("!i", payload)
+            with self._slots_lock:
+                free = [h for h in self.handles if not h.alive]
+                if 0 <= requested < self.num_workers and not self.handles[requested].alive:
+                    handle = self.handles[requested]
+                elif free:
+                    handle = free[0]
+                else:
+                    sock.close()
+                    continue
+                handle.sock = sock
+                handle.batches = queue.Queue()
+                handle.last_seen = time.monotonic()
+            try:
+                send_frame(sock, MSG_CONFIG, json.dumps(self.env_config).encode(), handle.send_lock)
+            except OSError:
+                continue
+            handle.alive = True
+            if self.verbose:
+                print(f"🤝 Worker {address[0]}:{address[1]} connected to slot {handle.slot}")
+            threading.Thread(target=self._reader_loop, args=(handle, sock), daemon=True).start()
+
+    def _reader_loop(self, handle, sock):
+        try:
+            while True:
+                msg_type, payload = recv_frame(sock)
+                handle.last_seen = time.monotonic()
+                if msg_type == MSG_BATCH:
+                    handle.batches.put(unpack_arrays(payload))
+        except (ConnectionError, OSError):
+            pass
+        if handle.sock is sock:
+            handle.alive = False
+            if self.verbose and not self._closing:
+                print(f"🔌 Worker slot {handle.slot} disconnected")
+
+    def wait_for_workers(self, timeout=120.0):
+        deadline = time.monotonic() + timeout
+        while not all(h.alive for h in self.handles):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Only {sum(h.alive for h in self.handles)}/{self.num_workers} workers connected")
+            time.sleep(0.05)
+
+    def _is_hung(self, handle):
+        if handle.process is not None and not handle.process.is_alive():
+            return True
+        return time.monotonic() - handle.last_seen > self.heartbeat_timeout
+
+    def _restart(self, handle):
+        handle.restarts += 1
+        handle.alive = False
+        if handle.sock is not None:
+            try:
+                handle.sock.close()
+            except OSError:
+                pass
+            handle.sock = None
+        print(f"♻️ Worker slot {handle.slot} lost (restart #{handle.restarts})")
+        if self.spawn_local:
+            if handle.process is not None and handle.process.is_alive():
+                handle.process.kill()
+            self._spawn(handle)
+        handle.last_seen = time.monotonic()
+
+    def collect(self, weights_payload, version):
+        """Broadcast weights and gather one batch per slot, restarting dead workers as needed."""
+        sent = {}
+        batches = [None] * self.num_workers
+        while any(b is None for b in batches):
+            for handle in self.handles:
+                slot = handle.slot
+                if batches[slot] is not None:
+                    continue
+                if not handle.alive:
+                    # Local workers that died before (re)connecting are respawned;
+                    # remote ones reconnect to their slot on their own
+                    if self.spawn_local and handle.process is not None and not handle.process.is_alive():
+                        self._restart(handle)
+                    time.sleep(0.01)
+                    continue
+                if self._is_hung(handle):
+                    self._restart(handle)
+                    continue
+                if sent.get(slot) is not handle.sock:
+                    try:
+                        send_frame(handle.sock, MSG_WEIGHTS, weights_payload, handle.send_lock)
+                        sent[slot] = handle.sock
+                    except OSError:
+                        handle.alive = False
+                        continue
+                try:
+                    arrays = handle.batches.get(timeout=0.01)
+                except queue.Empty:
+                    continue
+                if int(arrays[0][0]) == version:  # drop stale batches from before a restart
+                    batches[slot] = dict(zip(BATCH_FIELDS, arrays[1:]))
+        return batches
+
+    def close(self):
+        self._closing = True
+        for handle in self.handles:
+            if handle.alive:
+                try:
+                    send_frame(handle.sock, MSG_SHUTDOWN, lock=handle.send_lock)
+                except OSError:
+                    pass
+        for handle in self.handles:
+            if handle.process is not None:
+                handle.process.join(timeout=10)
+                if handle.process.is_alive():
+                    handle.process.kill()
+        self.server.close()
+
+
+class RemoteSpacesVecEnv(VecEnv):
+    """
+    Stand-in VecEnv for the learner: it only carries the spaces and the
+    number of remote environments (one per worker slot). Stepping happens on
+    the workers.
+    """
+
+    def __init__(self, num_envs, observation_space, action_space):
+        super().__init__(num_envs, observation_space, action_space)
+
+    def reset(self):
+        return np.zeros((self.num_envs,) + self.observation_space.shape, dtype=np.float32)
+
+    def step_async(self, actions):
+        raise RuntimeError("Remote environments are stepped by rollout workers")
+
+    def step_wait(self):
+        raise RuntimeError("Remote environments are stepped by rollout workers")
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [None for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        pass
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [None for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class DistributedRollouts:
+    """
+    Mixin for an SB3 on-policy algorithm whose rollouts come from
+    RolloutWorkerPool instead of a local VecEnv (DistributedPPO, or the
+    MaskablePPO one from distributed_algorithm(masked=True)).
+
+    The learner keeps the authoritative VecNormalize statistics: workers
+    normalise observations with the stats broadcast at the start of each
+    rollout and return raw observations and rewards, which the learner then
+    normalises and folds into its running statistics. `meso_rollouts`
+    tells the workers to run the mesoscopic env.
+    """
+
+    masked = False
+
+    def __init__(self, *args, pool=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+        self.meso_rollouts = False
+        self._rollout_version = 0
+
+    def _excluded_save_params(self):
+        return super()._excluded_save_params() + ["pool", "meso_rollouts"]
+
+    def _setup_learn(self, *args, **kwargs):
+        # The stand-in env's reset() returns zeros: keep them out of the stats
+        vecnorm = self.get_vec_normalize_env()
+        vecnorm.training = False
+        try:
+            return super()._setup_learn(*args, **kwargs)
+        finally:
+            vecnorm.training = True
+
+    def _weights_payload(self, vecnorm, n_steps):
+        state = self.policy.state_dict()
+        header = np.array([self._rollout_version, n_steps, vecnorm.clip_obs, vecnorm.epsilon, self.gamma,
+                           self.meso_rollouts], dtype=np.float64)
+        tensors = [t.detach().cpu().numpy() for t in state.values()]
+        return pack_arrays([header, vecnorm.obs_rms.mean.astype(np.float64),
+                            vecnorm.obs_rms.var.astype(np.float64)] + tensors)
+
+    def collect_rollouts(self, env, callback, rollout_buffer, n_rollout_steps, use_masking=True):
+        vecnorm = self.get_vec_normalize_env()
+        self.policy.set_training_mode(False)
+        rollout_buffer.reset()
+        callback.on_rollout_start()
+
+        self._rollout_version += 1
+        batches = self.pool.collect(self._weights_payload(vecnorm, n_rollout_steps), self._rollout_version)
+
+        # Normalise with the same frozen stats the workers acted on
+        obs = np.stack([vecnorm.normalize_obs(b["obs"]) for b in batches], axis=1)
+        actions = np.stack([b["actions"] for b in batches], axis=1)
+        action_masks = np.stack([b["action_masks"] for b in batches], axis=1).astype(bool)
+        raw_rewards = np.stack([b["rewards"] for b in batches], axis=1).astype(np.float64)
+        episode_starts = np.stack([b["episode_starts"] for b in batches], axis=1).astype(np.float32)
+        dones = np.stack([b["dones"] for b in batches], axis=1).astype(bool)
+        values = np.stack([b["values"] for b in batches], axis=1)
+        log_probs = np.stack([b["log_probs"] for b in batches], axis=1)
+        terminal_values = np.stack([b["terminal_values"] for b in batches], axis=1)
+
+        for t in range(n_rollout_steps):
+            # Same reward scaling as VecNormalize.step_wait, per time step across workers
+            # (the running discounted return its private _update_reward keeps)
+            vecnorm.returns = vecnorm.returns * vecnorm.gamma + raw_rewards[t]
+            vecnorm.ret_rms.update(vecnorm.returns)
+            rewards = vecnorm.normalize_reward(raw_rewards[t]) + self.gamma * terminal_values[t]
+            vecnorm.returns[dones[t]] = 0
+
+            self.num_timesteps += self.pool.num_workers
+            callback.update_locals(locals())
+            if not callback.on_step():
+                return False
+            extra = {"action_masks": action_masks[t]} if self.masked and use_masking else {}
+            rollout_buffer.add(obs[t], actions[t].reshape(-1, 1), rewards, episode_starts[t],
+                               torch.as_tensor(values[t]), torch.as_tensor(log_probs[t]), **extra)
+
+        vecnorm.obs_rms.update(np.concatenate([b["obs"] for b in batches]))
+        for b in batches:
+            self.ep_info_buffer.extend({"r": r, "l": int(l)} for r, l in b["episodes"])
+
+        self._last_obs = np.stack([b["last_obs"] for b in batches])
+        last_values = torch.as_tensor(np.array([b["last_value"][0] for b in batches]))
+        last_dones = np.array([b["last_value"][1] for b in batches])
+        rollout_buffer.compute_returns_and_advantage(last_values=last_values, dones=last_dones)
+
+        callback.update_locals(locals())
+        callback.on_rollout_end()
+        return True
+
+
+class DistributedPPO(DistributedRollouts, PPO):
+    """PPO whose rollouts come from RolloutWorkerPool instead of a local VecEnv."""
+
+
+def distributed_algorithm(masked):
+    """DistributedPPO, or a distributed MaskablePPO when invalid actions are masked (train_optimized.py --masked)."""
+    if not masked:
+        return DistributedPPO
+    from train_optimized import algorithm
+
+    return type("DistributedMaskablePPO", (DistributedRollouts, algorithm(True)), {"masked": True})
+
+
+def train_distributed(num_workers=4, total_timesteps=None, host="127.0.0.1", port=0, spawn_local=True,
+                      heartbeat_timeout=15.0, resume=None, meso_timesteps=None, meso_step_length=None,
+                      meso_delta_time=None, history=None, masked=False, emergency_obs=False, emergency_radius=None):
+    """
+    train_optimized.py's training (same options, except the surrogate) with
+    the rollouts collected by `num_workers` workers. Unset options take
+    train_optimized.py's defaults; the workers get them as their env config.
+    """
+    from checkpointing import AsyncCheckpointCallback, load_training_state
+    from emergency_observation import CONTEXT_RADIUS
+    from mesoscopic import check_space_compatibility, remember_signal_timings
+    from train_optimized import (CHECKPOINT_DIR, CHECKPOINT_PREFIX, HISTORY_LENGTH, MESO_DELTA_TIME,
+                                 MESO_STEP_LENGTH, MESO_TIMESTEPS, PPO_KWARGS, POLICY_KWARGS, TOTAL_TIMESTEPS,
+                                 resolve_checkpoint)
+
+    total_timesteps = total_timesteps or TOTAL_TIMESTEPS
+    meso_timesteps = MESO_TIMESTEPS if meso_timesteps is None else meso_timesteps
+    env_config = {"history": history or HISTORY_LENGTH, "masked": masked, "emergency_obs": emergency_obs,
+                  "emergency_radius": emergency_radius or CONTEXT_RADIUS,
+                  "meso_step_length": meso_step_length or MESO_STEP_LENGTH,
+                  "meso_delta_time": meso_delta_time or MESO_DELTA_TIME}
+    if emergency_obs and meso_timesteps:
+        print("ℹ️ --emergency-obs trains on microsimulation only, skipping mesoscopic pretraining")
+        meso_timesteps = 0
+    checkpoint = None
+    if resume:
+        checkpoint = resolve_checkpoint(resume)
+        if checkpoint is None or not os.path.exists(checkpoint + ".resume.gz"):
+            print(f"❌ No complete checkpoint found for '{resume}' in {CHECKPOINT_DIR}")
+            return
+
+    # Only used to read the spaces and timings (sumo-rl briefly starts SUMO to build them)
+    probe = make_worker_env(env_config, meso=False)
+    observation_space, action_space = probe.observation_space, probe.action_space
+    probe.close()
+    if meso_timesteps:
+        meso_probe = make_worker_env(env_config, meso=True)
+        meso_probe.close()
+        check_space_compatibility(meso_probe, probe)
+
+    pool = RolloutWorkerPool(num_workers, host=host, port=port, spawn_local=spawn_local,
+                             heartbeat_timeout=heartbeat_timeout, env_config=env_config)
+    try:
+        pool.wait_for_workers()
+        venv = RemoteSpacesVecEnv(num_workers, observation_space, action_space)
+        algorithm = distributed_algorithm(masked)
+        if checkpoint:
+            # Policy, optimiser, step counter, VecNormalize stats and RNG state
+            model, env = load_training_state(checkpoint, venv, algorithm=algorithm)
+            model.pool = pool
+            print(f"🔄 Resuming from {checkpoint} at {model.num_timesteps} steps")
+        else:
+            env = VecNormalize(venv, norm_obs=True, norm_reward=True, clip_obs=10.)
+            print(f"🧠 Initializing Distributed PPO Agent ({num_workers} rollout workers)...")
+            # Same samples per update as single-host training, split across workers
+            ppo_kwargs = dict(PPO_KWARGS, n_steps=max(PPO_KWARGS["n_steps"] // num_workers, 1))
+            model = algorithm("MlpPolicy", env, pool=pool, verbose=1, policy_kwargs=POLICY_KWARGS, **ppo_kwargs)
+        # The learner's env is a stand-in: save the timings of the env the workers run
+        remember_signal_timings(model, probe)
+
+        checkpoint_callback = AsyncCheckpointCallback(save_freq=10000, save_path=CHECKPOINT_DIR,
+                                                      name_prefix=CHECKPOINT_PREFIX, verbose=1)
+        resumed = checkpoint is not None
+        if model.num_timesteps < meso_timesteps:
+            model.meso_rollouts = True
+            remaining = meso_timesteps - model.num_timesteps
+            print(f"🏎️ Mesoscopic Pretraining ({remaining} of {meso_timesteps} Steps)...")
+            model.learn(total_timesteps=remaining, callback=checkpoint_callback,
+                        reset_num_timesteps=not resumed)
+            resumed = True
+            print("🔬 Switching the workers to microsimulation (same policy & observation stats)")
+            model.meso_rollouts = False
+            # Like train_optimized.switch_to_microsim: the micro reward is another waiting time
+            env.ret_rms = RunningMeanStd(shape=())
+            env.returns = np.zeros(env.num_envs)
+
+        remaining = total_timesteps - model.num_timesteps
+        print(f"🚀 Starting Distributed Training ({remaining} of {total_timesteps} Steps)...")
+        model.learn(total_timesteps=remaining, callback=checkpoint_callback, reset_num_timesteps=not resumed)
+
+        model.save("optimized_traffic_agent")
+        env.save("vec_normalize.pkl")
+        print("✅ Model & Normalization Stats saved.")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed SUMO rollouts for PPO training")
+    sub = parser.add_subparsers(dest="role", required=True)
+
+    learner = sub.add_parser("learner", help="Run the central learner")
+    learner.add_argument("--workers", type=int, default=4)
+    learner.add_argument("--host", default="127.0.0.1", help="Interface to listen on (0.0.0.0 for a cluster)")
+    learner.add_argument("--port", type=int, default=5555)
+    learner.add_argument("--remote", action="store_true",
+                         help="Don't spawn local workers; wait for remote ones to connect")
+    learner.add_argument("--timesteps", type=int, default=None)
+    learner.add_argument("--heartbeat-timeout", type=float, default=15.0)
+    # Same training options as train_optimized.py (default: its defaults); the workers build the matching env
+    learner.add_argument("--resume", nargs="?", const="latest", default=None,
+                         help="Resume from the latest checkpoint in modelsop/ or from a given checkpoint path")
+    learner.add_argument("--meso-steps", type=int, default=None,
+                         help="Timesteps of mesoscopic pretraining before microsimulation (0 to disable)")
+    learner.add_argument("--meso-step-length", type=int, default=None)
+    learner.add_argument("--meso-delta-time", type=int, default=None)
+    learner.add_argument("--history", type=int, default=None)
+    learner.add_argument("--masked", action="store_true", help="Event-driven decisions with MaskablePPO")
+    learner.add_argument("--emergency-obs", action="store_true")
+    learner.add_argument("--emergency-radius", type=float, default=None)
+
+    worker = sub.add_parser("worker", help="Run a rollout worker hosting one SUMO environment")
+    worker.add_argument("--learner", required=True, help="host:port of the learner")
+    worker.add_argument("--slot", type=int, default=-1)
+
+    args = parser.parse_args()
+    if args.role == "learner":
+        train_distributed(num_workers=args.workers, total_timesteps=args.timesteps, host=args.host, port=args.port,
+                          spawn_local=not args.remote, heartbeat_timeout=args.heartbeat_timeout, resume=args.resume,
+                          meso_timesteps=args.meso_steps, meso_step_length=args.meso_step_length,
+                          meso_delta_time=args.meso_delta_time, history=args.history, masked=args.masked,
+                          emergency_obs=args.emergency_obs, emergency_radius=args.emergency_radius)
+    else:
+        learner_host, learner_port = args.learner.rsplit(":", 1)
+        run_worker(learner_host, int(learner_port), args.slot)
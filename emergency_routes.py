@@ -0,0 +1,282 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import traci
+import traci.constants as tc
+
+from emergency_tracker import EMERGENCY_VEHICLE_VARS, SIMULATION_VARS
+from max_pressure import EMERGENCY_CLASS, unwrap_sumo_env
+from scenario import NET_FILE, is_green
+
+AMBULANCE_TYPE_FILE = "ambulance.rou.xml"
+AMBULANCE_TYPE = "ambulance_type"
+TABLE_FILE = "emergency_routes.json"
+
+
+def signal_transitions(sumo):
+    """
+    {(in_edge, out_edge): entry} for every movement through a traffic
+    light. An entry lists the incoming lanes and link indices of the
+    movement and the phases that give it a green: `phases` index the
+    network's program, `green_phases` index sumo-rl's action space (the
+    program's green phases in order).
+    """
+    transitions = {}
+    for tl in sumo.trafficlight.getIDList():
+        phases = sumo.trafficlight.getAllProgramLogics(tl)[0].phases
+        green_index = {}
+        for i, phase in enumerate(phases):
+            if is_green(phase.state):
+                green_index[i] = len(green_index)
+
+        links = {}
+        for link_index, link in enumerate(sumo.trafficlight.getControlledLinks(tl)):
+            for in_lane, out_lane, _ in link:
+                key = (sumo.lane.getEdgeID(in_lane), sumo.lane.getEdgeID(out_lane))
+                lanes, indices = links.setdefault(key, (set(), set()))
+                lanes.add(in_lane)
+                indices.add(link_index)
+
+        for key, (lanes, indices) in links.items():
+            # Prefer phases where the movement has priority (G) on every link,
+            # then any phase that lets it through at all (g = must yield)
+            serving = [i for i in green_index if all(phases[i].state[k] == "G" for k in indices)]
+            if not serving:
+                serving = [i for i in green_index if any(phases[i].state[k] in "Gg" for k in indices)]
+            transitions[key] = {
+                "tl": tl,
+                "lanes": sorted(lanes),
+                "links": sorted(indices),
+                "phases": serving,
+                "green_phases": [green_index[i] for i in serving],
+            }
+    return transitions
+
+
+def next_signals(route, transitions):
+    """
+    For every position on the route, the next signalised movement ahead of
+    the vehicle (or None past the last one): the transition entry plus the
+    route index of the edge that ends at the signal.
+    """
+    ahead = [None] * len(route)
+    upcoming = None
+    for i in range(len(route) - 2, -1, -1):
+        entry = transitions.get((route[i], route[i + 1]))
+        if entry is not None:
+            upcoming = {"route_index": i, **entry}
+        ahead[i] = upcoming
+    return ahead
+
+
+def net_digest(net_file):
+    """SHA-256 of the network file, stored in the table so edits to the net invalidate it."""
+    with open(net_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_route_table(net_file=NET_FILE, vtype_file=AMBULANCE_TYPE_FILE, vtype=AMBULANCE_TYPE):
+    """
+    Resolve the emergency route between every pair of edges once with
+    simulation.findRoute and index the signal phases each route needs.
+    """
+    traci.start(["sumo", "-n", net_file, "-r", vtype_file, "--no-step-log", "--no-warnings"])
+    try:
+        transitions = signal_transitions(traci)
+        edges = [e for e in traci.edge.getIDList() if not e.startswith(":")]
+        routes = {}
+        for origin in edges:
+            for destination in edges:
+                if origin == destination:
+                    continue
+                route = traci.simulation.findRoute(origin, destination, vType=vtype).edges
+                if route:
+                    routes[f"{origin}|{destination}"] = {
+                        "edges": list(route),
+                        "next_signal": next_signals(route, transitions),
+                    }
+    finally:
+        traci.close()
+
+    return {
+        "net_file": net_file,
+        "net_sha256": net_digest(net_file),
+        "vtype": vtype,
+        "transitions": {f"{a}|{b}": entry for (a, b), entry in transitions.items()},
+        "routes": routes,
+    }
+
+
+def save_table(table, path=TABLE_FILE):
+    """Write to a temp file next to `path` and rename it over, so readers never see a partial table."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(table, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_or_build_table(path=TABLE_FILE, net_file=NET_FILE):
+    """The cached table at `path`, rebuilt when missing or built for another (or since edited) network."""
+    if os.path.exists(path):
+        with open(path) as f:
+            table = json.load(f)
+        if table.get("net_file") == net_file and table.get("net_sha256") == net_digest(net_file):
+            return table
+        print(f"🗺️ {path} was built for another version of the network, rebuilding it")
+    table = build_route_table(net_file)
+    save_table(table, path)
+    return table
+
+
+class EmergencyRouteIndex(traci.StepListener):
+    """
+    Runtime side of the route table: which signal and green phase every
+    emergency vehicle in the simulation needs next.
+
+    Once attached to a connection it follows departures and arrivals
+    through the simulation subscription delivered with every step (like
+    EmergencyTracker). A departing vehicle's class is read once per vType;
+    an emergency vehicle's route is read once and it is subscribed to its
+    route index, so answering requests() is a list lookup per emergency
+    vehicle on the road, with no TraCI round trips. Vehicles whose route
+    isn't in the table (edges missing from it) get their list built once
+    from the transition index.
+    """
+
+    def __init__(self, table):
+        self.transitions = {tuple(key.split("|")): entry for key, entry in table["transitions"].items()}
+        self.routes = {tuple(key.split("|")): (tuple(r["edges"]), r["next_signal"])
+                       for key, r in table["routes"].items()}
+        self.conn = None
+        self.listening = False
+        self._classes = {}   # vType -> vClass
+        self._plans = {}     # veh_id -> next_signal list, for the emergency vehicles on the road
+        self._last_time = -1.0
+
+    @classmethod
+    def load(cls, path=TABLE_FILE):
+        return cls(load_or_build_table(path))
+
+    def lookup(self, origin, destination, route_index):
+        """O(1): next signalised movement for a vehicle on origin->destination at route_index."""
+        route = self.routes.get((origin, destination))
+        return route[1][route_index] if route else None
+
+    def attach(self, conn):
+        """
+        Follow the emergency vehicles of the simulation loaded in `conn`.
+        Call it again after every reset: reloading drops the subscriptions
+        (the listener then removes itself).
+        """
+        self.close()
+        self.conn = conn
+        self._plans = {}
+        self._last_time = -1.0
+        conn.simulation.subscribe(SIMULATION_VARS)
+        for veh_id in conn.vehicle.getIDList():   # already on the road when attached
+            self._depart(veh_id)
+        conn.addStepListener(self)
+        self.listening = True
+
+    def _depart(self, veh_id):
+        conn = self.conn
+        vtype = conn.vehicle.getTypeID(veh_id)
+        if vtype not in self._classes:
+            self._classes[vtype] = conn.vehicletype.getVehicleClass(vtype)
+        if self._classes[vtype] != EMERGENCY_CLASS:
+            return
+        route = tuple(conn.vehicle.getRoute(veh_id))
+        known = self.routes.get((route[0], route[-1]))
+        self._plans[veh_id] = known[1] if known and known[0] == route else next_signals(route, self.transitions)
+        conn.vehicle.subscribe(veh_id, EMERGENCY_VEHICLE_VARS)
+
+    def step(self, t=0):
+        results = self.conn.simulation.getSubscriptionResults()
+        now = results.get(tc.VAR_TIME)
+        if now is None or now < self._last_time:
+            self.listening = False
+            return False   # reloaded: a new attach() follows the new run
+        self._last_time = now
+        for veh_id in results[tc.VAR_ARRIVED_VEHICLES_IDS]:
+            self._plans.pop(veh_id, None)
+        for veh_id in results[tc.VAR_DEPARTED_VEHICLES_IDS]:
+            self._depart(veh_id)
+        return True
+
+    def cleanUp(self):
+        self.listening = False
+
+    def close(self):
+        if self.listening:
+            self.conn.removeStepListener(self.getID())
+            self.listening = False
+
+    def requests(self):
+        """{tl: [(veh_id, entry), ...]} for every emergency vehicle still approaching a signal."""
+        requests = {}
+        for veh_id, plan in self._plans.items():
+            values = self.conn.vehicle.getSubscriptionResults(veh_id)
+            if not values:
+                continue   # teleported out of the network this step
+            index = values[tc.VAR_ROUTE_INDEX]
+            entry = plan[index] if 0 <= index < len(plan) else None
+            if entry is not None:
+                requests.setdefault(entry["tl"], []).append((veh_id, entry))
+        return requests
+
+
+class PreemptionOverride:
+    """
+    Wrap a policy (PPO model, MaxPressureController, ...) so that whenever an
+    emergency vehicle is approaching the controlled signal, the action is the
+    green phase its route needs; otherwise the wrapped policy decides.
+    """
+
+    def __init__(self, policy, env, index, ts_id=None):
+        self.policy = policy
+        self.env = unwrap_sumo_env(env)
+        self.ts_id = ts_id or self.env.ts_ids[0]
+        self.index = index
+        self.overrides = 0
+        self._ts = None
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        ts = self.env.traffic_signals[self.ts_id]
+        if ts is not self._ts:
+            # sumo-rl rebuilds its TrafficSignal objects on every reset
+            self._ts = ts
+            self.index.attach(ts.sumo)
+        pending = self.index.requests().get(self.ts_id)
+        if not pending:
+            return self.policy.predict(observation, state=state, episode_start=episode_start,
+                                       deterministic=deterministic)
+        self.overrides += 1
+        green = pending[0][1]["green_phases"]
+        action = ts.green_phase if ts.green_phase in green else green[0]
+        if isinstance(observation, np.ndarray) and observation.ndim > 1:
+            return np.full(observation.shape[0], action), state
+        return action, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute emergency-route signal phases for every O/D pair")
+    parser.add_argument("--net", default=NET_FILE)
+    parser.add_argument("--out", default=TABLE_FILE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = build_route_table(args.net)
+    save_table(table, args.out)
+    signalised = sum(any(s is not None for s in r["next_signal"]) for r in table["routes"].values())
+    print(f"🗺️ {len(table['routes'])} routes ({signalised} through signals), "
+          f"{len(table['transitions'])} signalised movements in {time.perf_counter() - start:.2f}s")
+    print(f"💾 Saved route table to {args.out}")
@@ -0,0 +1,246 @@
+import argparse
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import sumolib
+import traci
+import traci.constants as tc
+
+EMERGENCY_CLASS = "emergency"
+# SUMO counts a vehicle as halted below 0.1 m/s (tripinfo waitingCount / waitingTime)
+HALTING_SPEED = 0.1
+FLEET_FILE = "emergency_fleet.rou.xml"
+
+# TraCI keeps one variable list per subscribed object and a new subscribe()
+# replaces it, so everything that subscribes to the simulation or to an
+# emergency vehicle (this tracker, emergency_routes.EmergencyRouteIndex)
+# asks for exactly these lists
+SIMULATION_VARS = [tc.VAR_TIME, tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS]
+EMERGENCY_VEHICLE_VARS = [tc.VAR_SPEED, tc.VAR_TIMELOSS, tc.VAR_ROUTE_INDEX]
+
+
+class EmergencyTracker(traci.StepListener):
+    """
+    Per-vehicle transit record of every emergency vehicle (any vType with
+    vClass="emergency") in one run: departure and arrival time, number of
+    stops, time spent halted and time loss (as of its last step on the road).
+
+    Registered as a TraCI step listener, so it sees every simulation step,
+    including the ones sumo-rl takes between two agent decisions. Per step
+    it reads only subscription results already delivered with the step:
+    the departed/arrived ID lists and the variables of the emergency
+    vehicles currently driving. Its cost grows with the number of
+    departures and active emergency vehicles, never with a scan of every
+    vehicle in the network.
+
+    Records live in preallocated NumPy arrays indexed by slot (doubled when
+    full); `slots` maps vehicle IDs to slots and `active` holds the slots
+    still on the road.
+    """
+
+    def __init__(self, conn=traci, capacity=64):
+        self.conn = conn
+        self.ids = []
+        self.slots = {}
+        self.active = set()
+        self._classes = {}   # vType -> vClass, read once per type
+        self._last_time = -1.0
+        self._allocate(capacity)
+
+        self.step_length = conn.simulation.getDeltaT()
+        conn.simulation.subscribe(SIMULATION_VARS)
+        self.listening = True
+        conn.addStepListener(self)
+
+    def _allocate(self, capacity):
+        self.depart = np.full(capacity, np.nan)
+        self.arrival = np.full(capacity, np.nan)
+        self.stops = np.zeros(capacity, dtype=np.int32)
+        self.halted_time = np.zeros(capacity)
+        self.time_loss = np.zeros(capacity)
+        self.halted = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        size = len(self.depart)
+        old = (self.depart, self.arrival, self.stops, self.halted_time, self.time_loss, self.halted)
+        self._allocate(2 * size)
+        new = (self.depart, self.arrival, self.stops, self.halted_time, self.time_loss, self.halted)
+        for src, dst in zip(old, new):
+            dst[:size] = src
+
+    def is_emergency(self, veh_id):
+        vtype = self.conn.vehicle.getTypeID(veh_id)
+        if vtype not in self._classes:
+            self._classes[vtype] = self.conn.vehicletype.getVehicleClass(vtype)
+        return self._classes[vtype] == EMERGENCY_CLASS
+
+    def __contains__(self, veh_id):
+        return veh_id in self.slots
+
+    def step(self, t=0):
+        results = self.conn.simulation.getSubscriptionResults()
+        now = results.get(tc.VAR_TIME)
+        # traci.load() drops the subscription and restarts the clock: the
+        # run this tracker records is over, so stop listening
+        if now is None or now < self._last_time:
+            return False
+        self._last_time = now
+        # The clock has already advanced past the step the events happened in
+        event_time = now - self.step_length
+
+        self._update()
+        for veh_id in results[tc.VAR_ARRIVED_VEHICLES_IDS]:
+            slot = self.slots.get(veh_id)
+            if slot is not None and slot in self.active:
+                self.arrival[slot] = event_time
+                self.active.discard(slot)
+        for veh_id in results[tc.VAR_DEPARTED_VEHICLES_IDS]:
+            if self.is_emergency(veh_id):
+                self._depart(veh_id, event_time)
+        return True
+
+    def _depart(self, veh_id, time):
+        if len(self.ids) == len(self.depart):
+            self._grow()
+        slot = len(self.ids)
+        self.ids.append(veh_id)
+        self.slots[veh_id] = slot
+        self.active.add(slot)
+        self.depart[slot] = time
+        self.conn.vehicle.subscribe(veh_id, EMERGENCY_VEHICLE_VARS)
+
+    def _update(self):
+        if not self.active:
+            return
+        slots = np.fromiter(self.active, dtype=np.intp, count=len(self.active))
+        values = [self.conn.vehicle.getSubscriptionResults(self.ids[slot]) for slot in slots]
+        # Arrived vehicles have no results left; they keep their last values
+        present = np.array([bool(v) for v in values])
+        if not present.all():
+            slots = slots[present]
+            values = [v for v in values if v]
+            if not values:
+                return
+        speed = np.array([v[tc.VAR_SPEED] for v in values])
+        halted = speed < HALTING_SPEED
+        self.stops[slots] += halted & ~self.halted[slots]
+        self.halted_time[slots] += halted * self.step_length
+        self.halted[slots] = halted
+        self.time_loss[slots] = [v[tc.VAR_TIMELOSS] for v in values]
+
+    def cleanUp(self):
+        # Called by TraCI when it removes the listener (connection closed)
+        self.listening = False
+
+    def close(self):
+        """Stop listening (also happens on its own when the simulation is reloaded or closed)."""
+        if self.listening:
+            self.conn.removeStepListener(self.getID())
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    def transit_times(self):
+        """Depart-to-arrival time of every emergency vehicle that finished (seconds)."""
+        n = self.count
+        transit = self.arrival[:n] - self.depart[:n]
+        return transit[~np.isnan(transit)]
+
+    def finished(self):
+        return self.count - len(self.active)
+
+    def records(self):
+        """One dict per emergency vehicle, in departure order (for CSV output)."""
+        n = self.count
+        return [{"veh_id": veh_id, "depart": float(self.depart[i]), "arrival": float(self.arrival[i]),
+                 "transit": float(self.arrival[i] - self.depart[i]), "stops": int(self.stops[i]),
+                 "halted_time": float(self.halted_time[i]), "time_loss": float(self.time_loss[i])}
+                for i, veh_id in zip(range(n), self.ids)]
+
+    def summary(self):
+        """Distribution of the per-vehicle metrics over the finished emergency vehicles of this run."""
+        n = self.count
+        done = ~np.isnan(self.arrival[:n])
+        summary = {"departed": n, "finished": int(done.sum()), "on_road": len(self.active)}
+        metrics = {
+            "transit": self.arrival[:n][done] - self.depart[:n][done],
+            "stops": self.stops[:n][done].astype(float),
+            "halted_time": self.halted_time[:n][done],
+            "time_loss": self.time_loss[:n][done],
+        }
+        for name, values in metrics.items():
+            if len(values) == 0:
+                summary[name] = {}
+                continue
+            p50, p90 = np.percentile(values, [50, 90])
+            summary[name] = {"mean": float(values.mean()), "p50": float(p50), "p90": float(p90),
+                             "max": float(values.max())}
+        return summary
+
+
+def print_summary(summary, label="Emergency vehicles"):
+    print(f"🚑 {label}: {summary['departed']} departed, {summary['finished']} finished, "
+          f"{summary['on_road']} still on the road")
+    for name in ["transit", "stops", "halted_time", "time_loss"]:
+        s = summary[name]
+        if s:
+            print(f"   {name}: mean {s['mean']:.2f} p50 {s['p50']:.2f} p90 {s['p90']:.2f} max {s['max']:.2f}")
+
+
+def count_emergency_vehicles(route_files):
+    """Number of vehicles/trips (and flow `number`s) of emergency vTypes declared in the route files."""
+    roots = [ET.parse(path).getroot() for path in route_files]
+    emergency_types = {vtype.get("id") for root in roots for vtype in root.iter("vType")
+                       if vtype.get("vClass") == EMERGENCY_CLASS}
+    count = 0
+    for root in roots:
+        for element in root:
+            if element.tag in ("vehicle", "trip") and element.get("type") in emergency_types:
+                count += 1
+            elif element.tag == "flow" and element.get("type") in emergency_types:
+                count += int(element.get("number", 0))
+    return count
+
+
+def write_emergency_fleet(count, path=FLEET_FILE, begin=60, end=600, seed=0, net_file="draft02.net.xml",
+                          vtype_file="ambulance.rou.xml"):
+    """
+    Write a route file with `count` emergency trips between random fringe
+    edges of the network, departing uniformly over [begin, end). The vType
+    definitions of `vtype_file` are copied in, so the file replaces
+    ambulance.rou.xml in a route-file list.
+    """
+    rng = np.random.default_rng(seed)
+    net = sumolib.net.readNet(net_file)
+    vtypes = [v for v in ET.parse(vtype_file).getroot().iter("vType") if v.get("vClass") == EMERGENCY_CLASS]
+    sources = [e for e in net.getEdges() if not e.getIncoming() and e.allows(EMERGENCY_CLASS)]
+    sinks = [e for e in net.getEdges() if not e.getOutgoing() and e.allows(EMERGENCY_CLASS)]
+    pairs = [(a.getID(), b.getID()) for a in sources for b in sinks
+             if a.getToNode() != b.getFromNode() and net.getShortestPath(a, b, vClass=EMERGENCY_CLASS)[0]]
+
+    root = ET.Element("routes")
+    for vtype in vtypes:
+        root.append(vtype)
+    departs = np.sort(rng.uniform(begin, end, size=count))
+    for i, depart in enumerate(departs):
+        origin, destination = pairs[rng.integers(len(pairs))]
+        vtype = vtypes[rng.integers(len(vtypes))].get("id")
+        ET.SubElement(root, "trip", id=f"emergency_{i}", type=vtype, depart=f"{depart:.1f}",
+                      attrib={"from": origin, "to": destination, "departPos": "last"})
+    ET.indent(root)
+    ET.ElementTree(root).write(path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a scenario with many overlapping emergency runs")
+    parser.add_argument("--count", type=int, default=24, help="Number of emergency trips")
+    parser.add_argument("--begin", type=float, default=60)
+    parser.add_argument("--end", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=FLEET_FILE)
+    args = parser.parse_args()
+
+    path = write_emergency_fleet(args.count, args.out, args.begin, args.end, args.seed)
+    print(f"🚑 Wrote {args.count} emergency trips ({args.begin:g}-{args.end:g}s) to {path}")
@@ -0,0 +1,92 @@
+import pickle
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+
+class RingFrameStack(VecEnvWrapper):
+    """
+    Observation history over the last `history` decisions for every env,
+    flattened oldest-to-newest: (num_envs, history * obs_dim).
+
+    Frames live in one preallocated buffer of 2 * (history + 1) slots per
+    env. Each new frame is written twice (slot p and p + history + 1), so
+    the latest `history` frames are always a contiguous slice and the
+    returned observation is a strided view into the buffer: a step costs
+    two frame writes, independent of the history length, and nothing is
+    rolled or concatenated. The spare slot keeps a returned view intact
+    for one more step (PPO adds the previous observation to its rollout
+    buffer after stepping); when episodes end, the histories are cleared in
+    a second buffer for the same reason.
+
+    Place it inside VecNormalize, which normalises the stacked vector.
+    """
+
+    def __init__(self, venv, history):
+        obs_space = venv.observation_space
+        if len(obs_space.shape) != 1:
+            raise ValueError(f"RingFrameStack expects flat observations, got shape {obs_space.shape}")
+        self.history = history
+        self.obs_dim = obs_space.shape[0]
+        self.slots = history + 1
+        stacked_space = spaces.Box(
+            low=np.tile(obs_space.low, history),
+            high=np.tile(obs_space.high, history),
+            dtype=obs_space.dtype,
+        )
+        super().__init__(venv, observation_space=stacked_space)
+        self._buffers = [np.zeros((venv.num_envs, 2 * self.slots, self.obs_dim), dtype=obs_space.dtype)
+                         for _ in range(2)]
+        self.buffer = self._buffers[0]
+        self.pos = 0
+
+    def _window(self):
+        start = self.pos + self.slots - self.history + 1
+        return self.buffer[:, start:start + self.history]
+
+    def _push(self, obs):
+        self.pos = (self.pos + 1) % self.slots
+        self.buffer[:, self.pos] = obs
+        self.buffer[:, self.pos + self.slots] = obs
+
+    def reset(self):
+        obs = self.venv.reset()
+        self.buffer = self._buffers[0]
+        self.buffer[:] = 0
+        self._push(obs)
+        return self._window().reshape(self.num_envs, -1)
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        done = np.flatnonzero(dones)
+        if len(done):
+            # Stack the terminal frame onto the finished episode's history for
+            # bootstrapping, then start the new episode from an empty history
+            for i in done:
+                if "terminal_observation" in infos[i]:
+                    previous = self._window()[i, 1:].reshape(-1)
+                    infos[i]["terminal_observation"] = np.concatenate([previous, infos[i]["terminal_observation"]])
+            other = self._buffers[1] if self.buffer is self._buffers[0] else self._buffers[0]
+            np.copyto(other, self.buffer)
+            other[done] = 0
+            self.buffer = other
+        self._push(obs)
+        return self._window().reshape(self.num_envs, -1), rewards, dones, infos
+
+
+def wrap_history(venv, history):
+    """Stack `history` observations (1 = plain single-frame observations)."""
+    return RingFrameStack(venv, history) if history > 1 else venv
+
+
+def saved_history(norm_path, venv):
+    """History length a saved VecNormalize was trained with, from its observation size."""
+    with open(norm_path, "rb") as f:
+        stats = pickle.load(f)
+    return stats.observation_space.shape[0] // venv.observation_space.shape[0]
+
+
+def with_saved_history(venv, norm_path):
+    """Wrap `venv` so it matches the observation history of a saved VecNormalize."""
+    return wrap_history(venv, saved_history(norm_path, venv))
@@ -0,0 +1,168 @@
+import numpy as np
+import traci.constants as tc
+
+EMERGENCY_CLASS = "emergency"
+# Added to the pressure of any movement carrying an emergency vehicle, so
+# pre-emption always wins over ordinary queue pressure
+EMERGENCY_PRIORITY = 1e6
+
+
+def build_phase_movements(ts, links):
+    """
+    Turn a sumo-rl TrafficSignal's green phases into a dense
+    (num_green_phases x num_movements) incidence matrix.
+
+    A movement is an (incoming lane, outgoing lane) pair from the junction's
+    controlled links; a phase serves it if its state has G/g at that link.
+    """
+    movements = []
+    for i, link in enumerate(links):
+        for in_lane, out_lane, _ in link:
+            movements.append((i, in_lane, out_lane))
+
+    in_index = {lane: k for k, lane in enumerate(ts.lanes)}
+    out_lanes = sorted({out_lane for _, _, out_lane in movements})
+    out_index = {lane: k for k, lane in enumerate(out_lanes)}
+
+    incidence = np.zeros((ts.num_green_phases, len(movements)), dtype=np.float64)
+    for p, phase in enumerate(ts.green_phases):
+        for m, (link_index, _, _) in enumerate(movements):
+            if phase.state[link_index] in "Gg":
+                incidence[p, m] = 1.0
+
+    move_in = np.array([in_index[in_lane] for _, in_lane, _ in movements], dtype=np.intp)
+    move_out = np.array([out_index[out_lane] for _, _, out_lane in movements], dtype=np.intp)
+    move_out_edge = np.array([out_lane.rsplit("_", 1)[0] for _, _, out_lane in movements])
+    return incidence, move_in, move_out, out_lanes, move_out_edge
+
+
+def max_pressure_actions(incidence, in_queues, out_queues, move_in, move_out, emergency=None):
+    """
+    Vectorised max-pressure decision.
+
+    in_queues: (..., num_in_lanes) halting vehicles per incoming lane
+    out_queues: (..., num_out_lanes) vehicles per outgoing lane
+    emergency: optional (..., num_movements) mask of movements an emergency
+        vehicle needs next
+
+    Returns the argmax-pressure green phase index for every leading batch
+    element. Pure NumPy, so a single junction decides in a few microseconds
+    and a batch of junctions costs one matmul.
+    """
+    pressure = in_queues[..., move_in] - out_queues[..., move_out]
+    if emergency is not None:
+        pressure = pressure + EMERGENCY_PRIORITY * emergency
+    return np.argmax(pressure @ incidence.T, axis=-1)
+
+
+def unwrap_sumo_env(env):
+    """Find the sumo_rl.SumoEnvironment inside a VecEnv / gym wrapper stack."""
+    while True:
+        if hasattr(env, "traffic_signals"):
+            return env
+        if hasattr(env, "venv"):
+            env = env.venv
+        elif hasattr(env, "envs"):
+            env = env.envs[0]
+        elif hasattr(env, "env"):
+            env = env.env
+        else:
+            raise ValueError("No sumo_rl.SumoEnvironment found in the wrapper stack")
+
+
+class MaxPressureController:
+    """
+    Max-pressure signal controller with emergency pre-emption for the
+    traffic signal the single-agent sumo-rl env exposes to the policy.
+
+    It has the same predict() signature as a Stable-Baselines3 model, so the
+    evaluation loops can swap it in for the PPO agent. Lane state comes from
+    TraCI lane subscriptions on the live simulation, which is why it ignores
+    the (possibly normalised) observation it is given.
+
+    Queues come from plain lane subscriptions; the vehicles on each incoming
+    lane come from a lane context subscription with their class, route and
+    route index. Both are delivered with every simulationStep, so a decision
+    makes no TraCI round trips, emergency vehicles included, and keeps no
+    per-vehicle state between decisions.
+    """
+
+    def __init__(self, env, ts_id=None):
+        self.env = unwrap_sumo_env(env)
+        self.ts_id = ts_id or self.env.ts_ids[0]
+        self._ts = None
+
+    def _bind(self, ts):
+        # sumo-rl rebuilds its TrafficSignal objects on every reset
+        self._ts = ts
+        links = ts.sumo.trafficlight.getControlledLinks(ts.id)
+        (self.incidence, self.move_in, self.move_out,
+         self.out_lanes, self.move_out_edge) = build_phase_movements(ts, links)
+        # Lane subscriptions arrive with every simulationStep, so a decision
+        # reads cached values instead of making one TraCI round trip per lane
+        for lane in ts.lanes:
+            ts.sumo.lane.subscribe(lane, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER])
+            # Vehicles on the lane itself (range 0) with what pre-emption needs
+            ts.sumo.lane.subscribeContext(lane, tc.CMD_GET_VEHICLE_VARIABLE, 0,
+                                          [tc.VAR_VEHICLECLASS, tc.VAR_ROUTE_INDEX, tc.VAR_EDGES])
+        for lane in self.out_lanes:
+            ts.sumo.lane.subscribe(lane, [tc.LAST_STEP_VEHICLE_NUMBER])
+
+    @staticmethod
+    def _query_lane_vehicles(ts):
+        """What the lane context subscriptions deliver, queried directly (routes of emergency vehicles only)."""
+        vehicle = ts.sumo.vehicle
+        lane_vehicles = {}
+        for lane in ts.lanes:
+            lane_vehicles[lane] = {}
+            for veh_id in ts.sumo.lane.getLastStepVehicleIDs(lane):
+                values = {tc.VAR_VEHICLECLASS: vehicle.getVehicleClass(veh_id)}
+                if values[tc.VAR_VEHICLECLASS] == EMERGENCY_CLASS:
+                    values[tc.VAR_ROUTE_INDEX] = vehicle.getRouteIndex(veh_id)
+                    values[tc.VAR_EDGES] = vehicle.getRoute(veh_id)
+                lane_vehicles[lane][veh_id] = values
+        return lane_vehicles
+
+    def _emergency_movements(self, ts, lane_vehicles):
+        """Mask of movements an emergency vehicle on an incoming lane is about to use."""
+        mask = np.zeros(len(self.move_in), dtype=np.float64)
+        for k, lane in enumerate(ts.lanes):
+            for values in (lane_vehicles.get(lane) or {}).values():
+                if values[tc.VAR_VEHICLECLASS] != EMERGENCY_CLASS:
+                    continue
+                route = values[tc.VAR_EDGES]
+                index = values[tc.VAR_ROUTE_INDEX]
+                next_edge = route[index + 1] if index + 1 < len(route) else None
+                on_lane = self.move_in == k
+                wanted = on_lane & (self.move_out_edge == next_edge)
+                mask[wanted if wanted.any() else on_lane] = 1.0
+        return mask
+
+    def decide(self):
+        ts = self.env.traffic_signals[self.ts_id]
+        if ts is not self._ts:
+            self._bind(ts)
+        lane_data = ts.sumo.lane.getAllSubscriptionResults()
+        lane_vehicles = ts.sumo.lane.getAllContextSubscriptionResults()
+        if not lane_data:
+            # Subscribed after the last simulationStep: nothing delivered yet,
+            # so query the same values (emergency vehicles included) directly
+            lane_data = {lane: {tc.LAST_STEP_VEHICLE_HALTING_NUMBER: ts.sumo.lane.getLastStepHaltingNumber(lane)}
+                         for lane in ts.lanes}
+            lane_data.update({lane: {tc.LAST_STEP_VEHICLE_NUMBER: ts.sumo.lane.getLastStepVehicleNumber(lane)}
+                              for lane in self.out_lanes})
+            lane_vehicles = self._query_lane_vehicles(ts)
+        in_queues = np.array([lane_data[lane][tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for lane in ts.lanes],
+                             dtype=np.float64)
+        out_queues = np.array([lane_data[lane][tc.LAST_STEP_VEHICLE_NUMBER] for lane in self.out_lanes],
+                              dtype=np.float64)
+        emergency = self._emergency_movements(ts, lane_vehicles)
+        return int(max_pressure_actions(self.incidence, in_queues, out_queues, self.move_in, self.move_out,
+                                        emergency if emergency.any() else None))
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        action = self.decide()
+        if isinstance(observation, np.ndarray) and observation.ndim > 1:
+            return np.full(observation.shape[0], action), state
+        return action, state
+
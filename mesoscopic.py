@@ -0,0 +1,131 @@
+import numpy as np
+from sumo_rl.environment.observations import DefaultObservationFunction
+
+# Mesoscopic model: vehicles live in edge segments (no lanes, no lane
+# changing). --meso-junction-control keeps the traffic lights in charge of
+# the flow through J4/J6, otherwise signals would barely matter.
+MESO_SUMO_CMD = "--mesosim --meso-junction-control"
+
+
+def is_mesosim(env):
+    return "--mesosim" in (env.additional_sumo_cmd or "")
+
+
+def step_length(env):
+    """Seconds per simulation step of a sumo-rl env (SUMO's --step-length, 1 by default)."""
+    args = (env.additional_sumo_cmd or "").split()
+    return float(args[args.index("--step-length") + 1]) if "--step-length" in args else 1.0
+
+
+def signal_timings(obj):
+    """
+    Yellow/min/max green of the sumo-rl env behind `obj`, in seconds
+    (sumo-rl counts them in simulation steps). A loaded SB3 model has no
+    env: it falls back to the timings remember_signal_timings() saved in
+    the model. None when there are neither (e.g. the surrogate).
+    """
+    from max_pressure import unwrap_sumo_env
+
+    try:
+        env = unwrap_sumo_env(obj)
+    except ValueError:
+        return getattr(obj, "sumo_signal_timings", None)
+    seconds = step_length(env)
+    return {"yellow_time": env.yellow_time * seconds, "min_green": env.min_green * seconds,
+            "max_green": env.max_green * seconds, "step_length": seconds}
+
+
+def remember_signal_timings(model, env):
+    """
+    Record the timings of the env `model` trains on as a model attribute,
+    so model.save() and the checkpoints store them with the weights.
+    """
+    model.sumo_signal_timings = signal_timings(env)
+
+
+def _edge(lane):
+    return lane.rsplit("_", 1)[0]
+
+
+def edge_share_per_lane(ts, getter):
+    """
+    Spread an edge-level value evenly over the edge's lanes, in ts.lanes
+    order. In mesosim every lane-level TraCI query returns 0, only the edge
+    (segment) values are populated.
+    """
+    edges = {}
+    for lane in ts.lanes:
+        edges.setdefault(_edge(lane), []).append(lane)
+    values = {}
+    for edge, lanes in edges.items():
+        share = getter(edge) / ts.sumo.edge.getLaneNumber(edge)
+        for lane in lanes:
+            values[lane] = share
+    return [values[lane] for lane in ts.lanes]
+
+
+def lane_waiting_times(ts):
+    """
+    Per-lane waiting time for the reward in either simulation mode. Not the
+    same quantity: microsim uses sumo-rl's accumulated waiting time per
+    vehicle, mesosim (which doesn't track it) the current waiting time on
+    each incoming edge, so the reward scale changes at the hand-off and the
+    reward normalisation starts over there (switch_to_microsim).
+    """
+    if is_mesosim(ts.env):
+        return edge_share_per_lane(ts, ts.sumo.edge.getWaitingTime)
+    return ts.get_accumulated_waiting_time_per_lane()
+
+
+class MesoObservationFunction(DefaultObservationFunction):
+    """
+    Same layout and space as sumo-rl's default observation (phase one-hot,
+    min-green flag, lane densities, lane queues), with densities and queues
+    estimated from edge counts, the only values mesosim reports. The micro
+    env keeps sumo-rl's default observation from lane values; the two
+    describe the same quantities in the same slots, so the pretrained
+    policy can move over unchanged, but they are approximations of each
+    other, not identical.
+    """
+
+    def _capacity(self, lane):
+        length = self.ts.sumo.edge.getLastStepLength(_edge(lane))
+        return self.ts.lanes_length[lane] / (self.ts.MIN_GAP + length)
+
+    def __call__(self):
+        ts = self.ts
+        phase_id = [1 if ts.green_phase == i else 0 for i in range(ts.num_green_phases)]
+        min_green = [0 if ts.time_since_last_phase_change < ts.min_green + ts.yellow_time else 1]
+        vehicles = edge_share_per_lane(ts, ts.sumo.edge.getLastStepVehicleNumber)
+        halting = edge_share_per_lane(ts, ts.sumo.edge.getLastStepHaltingNumber)
+        capacity = [self._capacity(lane) for lane in ts.lanes]
+        density = [min(1, v / c) for v, c in zip(vehicles, capacity)]
+        queue = [min(1, h / c) for h, c in zip(halting, capacity)]
+        return np.array(phase_id + min_green + density + queue, dtype=np.float32)
+
+
+def check_space_compatibility(source, target):
+    """
+    Raise ValueError unless a policy trained on `source` can act on
+    `target` unchanged (same observation layout and bounds, same actions,
+    and the same signal timings in seconds when both are sumo-rl envs).
+    Both may be envs, VecEnvs or SB3 models.
+    """
+    problems = []
+    a, b = source.observation_space, target.observation_space
+    if a.shape != b.shape:
+        problems.append(f"observation shape {a.shape} != {b.shape}")
+    elif a.dtype != b.dtype or not (np.array_equal(a.low, b.low) and np.array_equal(a.high, b.high)):
+        problems.append("observation bounds/dtype differ")
+    if source.action_space != target.action_space:
+        problems.append(f"action space {source.action_space} != {target.action_space}")
+    timings = signal_timings(source), signal_timings(target)
+    if None not in timings:
+        a, b = timings
+        # Timings are rounded up to whole steps, so allow less than one step of difference
+        tolerance = max(a["step_length"], b["step_length"])
+        for name in ("yellow_time", "min_green", "max_green"):
+            if abs(a[name] - b[name]) >= tolerance:
+                problems.append(f"{name} {a[name]:g}s != {b[name]:g}s")
+    if problems:
+        raise ValueError("Incompatible simulation modes: " + "; ".join(problems))
@@ -0,0 +1,257 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+import numpy as np
+
+from benchmark import route_files_for, run_job
+from scenario import NET_FILE, is_green
+
+MIN_GREEN = 5
+MAX_GREEN = 60
+# A fresh programID is required: SUMO refuses a second "0" program for the
+# same junction, and the last program loaded becomes the active one
+PROGRAM_ID = "optimized"
+
+
+def load_signal_plans(path):
+    """
+    Read every static tlLogic from a .net.xml or additional file into
+    {tl_id: {"offset": int, "phases": [(duration, state), ...]}}.
+    """
+    plans = {}
+    for tl in ET.parse(path).getroot().iter("tlLogic"):
+        plans[tl.get("id")] = {
+            "offset": int(float(tl.get("offset", "0"))),
+            "phases": [(int(float(p.get("duration"))), p.get("state")) for p in tl.iter("phase")],
+        }
+    return plans
+
+
+class PlanSpace:
+    """
+    Flat parameter vector over all signalised junctions: the duration of
+    every green phase followed by the junction's offset. Yellow phases keep
+    the durations from the template plan.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.names = []
+        self.lower = []
+        self.upper = []
+        for tl_id, plan in sorted(template.items()):
+            for i, (duration, state) in enumerate(plan["phases"]):
+                if is_green(state):
+                    self.names.append((tl_id, "green", i))
+                    self.lower.append(MIN_GREEN)
+                    self.upper.append(MAX_GREEN)
+            self.names.append((tl_id, "offset", None))
+            self.lower.append(0)
+            self.upper.append(None)  # bounded by the cycle length, see clip()
+
+    def encode(self, plans):
+        values = []
+        for tl_id, kind, i in self.names:
+            values.append(plans[tl_id]["phases"][i][0] if kind == "green" else plans[tl_id]["offset"])
+        return tuple(values)
+
+    def decode(self, params):
+        plans = {tl_id: {"offset": plan["offset"], "phases": list(plan["phases"])}
+                 for tl_id, plan in self.template.items()}
+        for (tl_id, kind, i), value in zip(self.names, params):
+            if kind == "green":
+                plans[tl_id]["phases"][i] = (int(value), plans[tl_id]["phases"][i][1])
+            else:
+                plans[tl_id]["offset"] = int(value)
+        return plans
+
+    def clip(self, params):
+        greens = [min(max(value, low), high) if kind == "green" else value
+                  for (_, kind, _), value, low, high in zip(self.names, params, self.lower, self.upper)]
+        plans = self.decode(greens)
+        clipped = []
+        for (tl_id, kind, _), value in zip(self.names, greens):
+            if kind == "offset":
+                value = value % sum(d for d, _ in plans[tl_id]["phases"])
+            clipped.append(int(value))
+        return tuple(clipped)
+
+    def neighbours(self, params, step):
+        """Every single-coordinate move of +/- step (pattern search stencil)."""
+        moves = set()
+        for k, (_, kind, _) in enumerate(self.names):
+            for delta in (-step, step):
+                candidate = list(params)
+                candidate[k] += delta
+                candidate = self.clip(tuple(candidate))
+                if candidate != params:
+                    moves.add(candidate)
+        return sorted(moves)
+
+
+def write_plan_file(plans, path):
+    """Emit the plans as a SUMO additional file (same layout as draft02A.xml)."""
+    root = ET.Element("additional")
+    for tl_id, plan in sorted(plans.items()):
+        tl = ET.SubElement(root, "tlLogic", id=tl_id, type="static", programID=PROGRAM_ID, offset=str(plan["offset"]))
+        for duration, state in plan["phases"]:
+            ET.SubElement(tl, "phase", duration=str(duration), state=state)
+    ET.indent(root, space="    ")
+    ET.ElementTree(root).write(path, encoding="UTF-8", xml_declaration=True)
+
+
+def plan_hash(plans, eval_config):
+    payload = json.dumps({"plans": plans, "eval": eval_config}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class PlanEvaluator:
+    """
+    Scores signal plans by running headless fixed-time SUMO episodes for
+    every (seed, scale) on a process pool. Results are cached on disk by a
+    hash of the plan and the evaluation settings, so re-runs and revisited
+    points cost nothing.
+    """
+
+    def __init__(self, pool, seeds, scales, num_seconds, ambulance_weight, work_dir, cache_path):
+        self.pool = pool
+        self.seeds = seeds
+        self.scales = scales
+        self.num_seconds = num_seconds
+        self.ambulance_weight = ambulance_weight
+        self.work_dir = work_dir
+        self.cache_path = cache_path
+        self.route_files = {scale: route_files_for(scale, work_dir) for scale in scales}
+        self.eval_config = {"seeds": seeds, "scales": list(scales), "num_seconds": num_seconds,
+                            "ambulance_weight": ambulance_weight}
+        self.cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.cache = json.load(f)
+        self.simulations = 0
+
+    def objective(self, rows):
+        """Mean civilian wait plus weighted ambulance transit time (missed runs count as the full horizon)."""
+        waits = [r["civilian_avg_wait"] for r in rows]
+        ambulance = [self.num_seconds if np.isnan(r["ambulance_time"]) else r["ambulance_time"] for r in rows]
+        return float(np.mean(waits) + self.ambulance_weight * np.mean(ambulance))
+
+    def evaluate(self, plan_list):
+        keys = [plan_hash(plans, self.eval_config) for plans in plan_list]
+        pending = {}
+        for key, plans in zip(keys, plan_list):
+            if key in self.cache or key in pending:
+                continue
+            plan_path = os.path.join(self.work_dir, f"plan_{key[:12]}.add.xml")
+            write_plan_file(plans, plan_path)
+            pending[key] = [
+                self.pool.submit(run_job, {
+                    "controller": "fixed", "seed": seed, "scale": scale, "route_files": self.route_files[scale],
+                    "num_seconds": self.num_seconds, "additional_files": [plan_path],
+                })
+                for scale in self.scales for seed in range(self.seeds)
+            ]
+
+        for key, futures in pending.items():
+            rows = [future.result() for future in futures]
+            self.simulations += len(rows)
+            self.cache[key] = {
+                "score": self.objective(rows),
+                "civilian_avg_wait": float(np.mean([r["civilian_avg_wait"] for r in rows])),
+                "ambulance_time": float(np.nanmean([r["ambulance_time"] for r in rows]))
+                if not all(np.isnan(r["ambulance_time"]) for r in rows) else float("nan"),
+            }
+            os.remove(os.path.join(self.work_dir, f"plan_{key[:12]}.add.xml"))
+        if pending:
+            with open(self.cache_path, "w") as f:
+                json.dump(self.cache, f)
+
+        return [self.cache[key] for key in keys]
+
+
+def optimize_signal_plan(init_files=(NET_FILE, "draft02A.xml"), seeds=5, scales=(1.0,), num_seconds=1000,
+                         ambulance_weight=1.0, initial_step=8, max_iterations=30, workers=None,
+                         out_file="optimized_plan.add.xml", work_dir="plan_search",
+                         cache_path="plan_search/plan_cache.json"):
+    """
+    Parallel coordinate (pattern) search over green durations and offsets of
+    all signalised junctions. Each iteration evaluates every +/- step move of
+    every coordinate at once, takes the best improving move, and halves the
+    step when nothing improves.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    template = load_signal_plans(NET_FILE)
+    space = PlanSpace(template)
+
+    # Start points: the network's own program overlaid with each init file
+    starts = []
+    for path in init_files:
+        plans = {tl_id: dict(plan) for tl_id, plan in template.items()}
+        plans.update({tl_id: plan for tl_id, plan in load_signal_plans(path).items() if tl_id in plans})
+        starts.append(space.clip(space.encode(plans)))
+    starts = sorted(set(starts))
+
+    print(f"🚀 Optimising {len(space.names)} plan parameters for {sorted(template)} "
+          f"({seeds} seeds x {len(scales)} scales per plan)...")
+    search_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=mp.get_context("spawn")) as pool:
+        evaluator = PlanEvaluator(pool, seeds, scales, num_seconds, ambulance_weight, work_dir, cache_path)
+
+        results = evaluator.evaluate([space.decode(p) for p in starts])
+        best_index = int(np.argmin([r["score"] for r in results]))
+        best, best_result = starts[best_index], results[best_index]
+        for params, result in zip(starts, results):
+            print(f"   start {params}: score {result['score']:.2f}")
+
+        step = initial_step
+        for iteration in range(max_iterations):
+            if step < 1:
+                break
+            candidates = space.neighbours(best, step)
+            results = evaluator.evaluate([space.decode(p) for p in candidates])
+            k = int(np.argmin([r["score"] for r in results]))
+            if results[k]["score"] < best_result["score"]:
+                best, best_result = candidates[k], results[k]
+                print(f"   [iter {iteration}] step {step}: ✅ {best} score {best_result['score']:.2f} "
+                      f"(wait {best_result['civilian_avg_wait']:.2f}s, ambulance {best_result['ambulance_time']:.1f}s)")
+            else:
+                step //= 2
+                print(f"   [iter {iteration}] no improving move, step -> {step}")
+
+    best_plans = space.decode(best)
+    write_plan_file(best_plans, out_file)
+    print(f"🏁 Best score {best_result['score']:.2f} after {evaluator.simulations} simulations "
+          f"in {time.perf_counter() - search_start:.1f}s")
+    print(f"💾 Saved best plan to {out_file} (load with: sumo -c draft02.sumocfg -a {out_file})")
+    return best_plans, best_result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parallel fixed-time signal plan optimiser")
+    parser.add_argument("--init", nargs="+", default=[NET_FILE, "draft02A.xml"],
+                        help="Plan files to start from (the best one seeds the search)")
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--num-seconds", type=int, default=1000)
+    parser.add_argument("--ambulance-weight", type=float, default=1.0,
+                        help="Weight of ambulance transit time relative to civilian wait")
+    parser.add_argument("--step", type=int, default=8, help="Initial search step in seconds")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="optimized_plan.add.xml")
+    parser.add_argument("--work-dir", default="plan_search")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    optimize_signal_plan(init_files=args.init, seeds=args.seeds, scales=args.scales, num_seconds=args.num_seconds,
+                         ambulance_weight=args.ambulance_weight, initial_step=args.step,
+                         max_iterations=args.iterations, workers=args.workers, out_file=args.out,
+                         work_dir=args.work_dir, cache_path=os.path.join(args.work_dir, "plan_cache.json"))
@@ -0,0 +1,294 @@
+import argparse
+import json
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from action_masking import valid_action_mask
+from emergency_observation import CONTEXT_RADIUS, emergency_observation
+from emergency_tracker import EmergencyTracker, print_summary
+from frame_history import wrap_history
+from max_pressure import MaxPressureController
+from mesoscopic import check_space_compatibility, signal_timings, step_length
+from streaming_stats import StreamingStats
+from train_optimized import algorithm, make_env, make_meso_env
+
+# Histogram bucket edges (ms): 1-2-5 steps from 10µs to 10s
+BUCKET_EDGES_MS = np.array([m * 10.0 ** e for e in range(-2, 4) for m in (1, 2, 5)] + [1e4])
+# The ticker sleeps until this close to a deadline, then spins (sleep() overshoots by ~0.1-1ms)
+SPIN_SECONDS = 0.002
+
+
+class DriftFreeTicker:
+    """
+    Wakes up at start + k * period. Deadlines are absolute, so a late wake-up
+    or a slow tick never shifts the ones after it: the simulation catches up
+    instead of drifting behind wall-clock (a plain sleep(period) per step
+    adds every overshoot and every step's own run time to the schedule).
+    """
+
+    def __init__(self, period, clock=time.perf_counter, sleep=time.sleep):
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.tick = 0
+
+    def deadline(self, tick=None):
+        return self.start + (self.tick if tick is None else tick) * self.period
+
+    def wait(self):
+        """Block until the next tick; returns how late (s) it woke up. The first call starts the clock."""
+        if self.start is None:
+            self.start = self.clock()
+            return 0.0
+        self.tick += 1
+        deadline = self.deadline()
+        remaining = deadline - self.clock()
+        if remaining > SPIN_SECONDS:
+            self.sleep(remaining - SPIN_SECONDS)
+        while self.clock() < deadline:
+            pass
+        return self.clock() - deadline
+
+
+class LatencyHistogram:
+    """Counts of durations in fixed log-spaced buckets (BUCKET_EDGES_MS) plus streaming mean/quantiles."""
+
+    def __init__(self, edges_ms=BUCKET_EDGES_MS):
+        self.edges_ms = edges_ms
+        self.counts = np.zeros(len(edges_ms) + 1, dtype=int)   # last bucket: above the top edge
+        self.stats = StreamingStats()
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[np.searchsorted(self.edges_ms, ms)] += 1
+        self.stats.add(ms)
+
+    def summary(self):
+        return {**self.stats.summary(), "edges_ms": self.edges_ms.tolist(), "counts": self.counts.tolist()}
+
+    def print(self, label, width=40):
+        summary = self.stats.summary()
+        if not summary["count"]:
+            print(f"⏱️ {label}: no samples")
+            return
+        print(f"⏱️ {label} (ms, n={summary['count']}): mean {summary['mean']:.3f} p50 {summary['p50']:.3f} "
+              f"p99 {summary['p99']:.3f} max {summary['max']:.3f}")
+        used = np.flatnonzero(self.counts)
+        peak = self.counts.max()
+        for i in range(used[0], used[-1] + 1):
+            upper = f"<= {self.edges_ms[i]:g}" if i < len(self.edges_ms) else f"> {self.edges_ms[-1]:g}"
+            print(f"   {upper:>10} | {'#' * int(np.ceil(width * self.counts[i] / peak)):<{width}} {self.counts[i]}")
+
+
+class PolicyInference:
+    """
+    The trained PPO policy as a plain function of the raw sumo-rl
+    observation, for a worker thread: VecNormalize statistics and the
+    observation history (read back from vec_normalize.pkl) are applied
+    here instead of through a VecEnv. With masked, the model is a
+    MaskablePPO one and every call gets the action mask of the decision.
+    """
+
+    def __init__(self, model_path="optimized_traffic_agent", norm_path="vec_normalize.pkl", obs_dim=None,
+                 masked=False):
+        self.masked = masked
+        self.model = algorithm(masked).load(model_path, device="cpu")
+        with open(norm_path, "rb") as f:
+            self.norm = pickle.load(f)
+        self.norm.training = False
+        stacked = self.norm.observation_space.shape[0]
+        self.history = stacked // obs_dim if obs_dim else 1
+        self.frames = np.zeros((self.history, stacked // self.history), dtype=np.float32)
+
+    def push(self, obs):
+        """Add a frame (main thread) and return the stacked observation to infer on, oldest to newest."""
+        self.frames[:-1] = self.frames[1:]
+        self.frames[-1] = obs
+        return self.frames.reshape(1, -1).copy()
+
+    def __call__(self, stacked, mask=None):
+        """(action, start, end) with perf_counter timestamps."""
+        start = time.perf_counter()
+        extra = {"action_masks": mask[None]} if self.masked else {}
+        action, _ = self.model.predict(self.norm.normalize_obs(stacked), deterministic=True, **extra)
+        return int(action[0]), start, time.perf_counter()
+
+
+def run_realtime(speed=1.0, controller="ppo", num_seconds=1000, model_path="optimized_traffic_agent",
+                 norm_path="vec_normalize.pkl", use_gui=False, report_path=None, emergency_obs=False, meso=False,
+                 masked=False, fallback=False, emergency_radius=CONTEXT_RADIUS):
+    """
+    Run one episode paced to wall-clock: one SUMO step (1 sim-second, or
+    the mesoscopic step length) per step/speed real seconds, in the env
+    train_optimized.py builds for the same flags (emergency_obs and its
+    emergency_radius, meso;
+    masked: the model is a MaskablePPO one, given each decision's mask).
+    The controlled signal takes exactly the steps and decisions sumo-rl's
+    env.step would, but each decision's observation is handed to a worker
+    thread, and the answer must be back by the next tick's deadline.
+
+    A late answer is a deadline miss, even when the loop itself is running
+    behind: the current green is held (the only safe action) and the late
+    result is dropped. While the worker is still busy with a late answer,
+    the next decisions aren't submitted at all (they would only queue
+    behind it) and count as misses too. With fallback, a missed decision
+    (or one the policy raised on) is made by MaxPressureController on this
+    thread instead of holding the green.
+    """
+    # 1. The training env itself (train_optimized.py's factories), run for num_seconds
+    if emergency_obs and meso:
+        raise ValueError("The emergency observation is microsimulation only, it can't be combined with meso")
+    if fallback and meso:
+        raise ValueError("The max-pressure fallback reads lane queues, which mesosim doesn't report")
+    overrides = dict(out_csv_name=None, use_gui=use_gui, num_seconds=num_seconds, fixed_ts=controller == "fixed")
+    if meso:
+        env = make_meso_env(**overrides)
+    else:
+        env = make_env(emergency_observation(emergency_radius) if emergency_obs else None, **overrides)
+    obs, _ = env.reset()
+    ts = env.traffic_signals[env.ts_ids[0]]
+    tracker = EmergencyTracker(env.sumo)
+
+    # 2. Policy inference runs in one worker thread (TraCI stays on this one)
+    policy = None
+    executor = ThreadPoolExecutor(max_workers=1)
+    if controller == "ppo":
+        policy = PolicyInference(model_path, norm_path, obs_dim=len(obs), masked=masked)
+        # Fail now, not mid-run, if the model was trained on another observation or timings
+        check_space_compatibility(policy.model, wrap_history(DummyVecEnv([lambda: env]), policy.history))
+        if signal_timings(policy.model) is None:
+            print(f"⚠️ {model_path} has no saved signal timings (trained before they were saved), "
+                  f"yellow/min/max green not checked")
+        policy(policy.push(obs), valid_action_mask(ts))  # warm-up, so the first decision isn't charged for lazy init
+        policy.frames[:] = 0
+    # Deterministic controller for the decisions the learned policy misses (binds its subscriptions now)
+    backup = MaxPressureController(env) if fallback and policy else None
+    if backup:
+        backup.decide()
+
+    # 3. Instrumentation
+    tick_work = LatencyHistogram()     # time spent inside a tick
+    jitter = LatencyHistogram()        # how late each tick started
+    inference = LatencyHistogram()     # policy latency in the worker
+    tick_misses = decision_misses = decisions = busy_skips = 0
+
+    seconds_per_step = step_length(env)
+    period = seconds_per_step / speed
+    ticker = DriftFreeTicker(period)
+    print(f"⏱️ Real-time run: {controller} controller, {speed:g}x wall-clock "
+          f"({period * 1000:.1f}ms per {seconds_per_step:g}s simulation step)")
+    # Tick 0 only observes: the first decision is due, like every other one, a tick later
+    ticker.wait()
+    pending = executor.submit(policy, policy.push(obs), valid_action_mask(ts)) if policy else None
+    in_flight = pending  # The last submitted call, which may outlive its decision
+    due = ticker.deadline(1)
+
+    while env.sim_step < num_seconds:
+        jitter.record(ticker.wait())
+        start = time.perf_counter()
+
+        # 4. Apply the decision that is due now, or hold (fall back) on a miss
+        if policy and ts.time_to_act:
+            decisions += 1
+            on_time = False
+            if pending is not None and pending.done():
+                try:
+                    result, started, finished = pending.result()
+                except Exception as e:
+                    if backup is None:
+                        raise
+                    print(f"⚠️ Learned policy failed ({e}), using the max-pressure fallback")
+                else:
+                    inference.record(finished - started)
+                    on_time = finished <= due
+            if on_time:
+                action = result
+            else:
+                decision_misses += 1
+                action = backup.decide() if backup else ts.green_phase
+            pending = None
+            ts.set_next_phase(action)
+
+        # 5. One simulation step (what SumoEnvironment._run_steps does per step)
+        env._sumo_step()
+        if policy:
+            for signal in env.traffic_signals.values():
+                signal.update()
+            if ts.time_to_act:
+                stacked = policy.push(ts.compute_observation())
+                if in_flight.done():
+                    # The mask is read here too: TraCI and the signal state belong to this thread
+                    pending = in_flight = executor.submit(policy, stacked, valid_action_mask(ts))
+                else:
+                    busy_skips += 1
+                due = ticker.deadline(ticker.tick + 1)
+
+        work = time.perf_counter() - start
+        tick_work.record(work)
+        if start + work > ticker.deadline(ticker.tick + 1):
+            tick_misses += 1
+
+    executor.shutdown(wait=True)
+    summary = tracker.summary()
+    tracker.close()
+    env.close()
+
+    # 6. Report
+    ticks = tick_work.stats.count
+    print(f"\n✅ {ticks} ticks in {time.perf_counter() - ticker.start:.1f}s wall-clock")
+    tick_work.print("Tick work")
+    jitter.print("Wake-up jitter")
+    print(f"🚨 Tick deadline misses: {tick_misses}/{ticks}")
+    if policy:
+        inference.print("Policy inference")
+        handled = "max-pressure decided" if backup else "current green held"
+        print(f"🚨 Decision deadline misses: {decision_misses}/{decisions} ({handled}), "
+              f"{busy_skips} not submitted while the worker was busy")
+    print_summary(summary)
+
+    report = {
+        "controller": controller, "speed": speed, "emergency_obs": emergency_obs, "meso": meso, "masked": masked,
+        "fallback": fallback, "period_ms": period * 1000, "ticks": ticks,
+        "tick_misses": tick_misses, "decisions": decisions, "decision_misses": decision_misses,
+        "busy_skips": busy_skips,
+        "tick_work_ms": tick_work.summary(), "jitter_ms": jitter.summary(), "inference_ms": inference.summary(),
+        "emergency": summary,
+    }
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report saved to {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a controller against SUMO paced to wall-clock, "
+                                                 "measuring latency, jitter and deadline misses")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Simulated seconds per wall-clock second (1 = real time)")
+    parser.add_argument("--controller", choices=["ppo", "fixed"], default="ppo")
+    parser.add_argument("--seconds", type=int, default=1000, help="Simulated seconds to run")
+    parser.add_argument("--model", default="optimized_traffic_agent")
+    parser.add_argument("--norm", default="vec_normalize.pkl")
+    parser.add_argument("--gui", action="store_true")
+    parser.add_argument("--report", default=None, help="Write histograms and counts to this JSON file")
+    parser.add_argument("--emergency-obs", action="store_true",
+                        help="The model was trained with train_optimized.py --emergency-obs")
+    parser.add_argument("--emergency-radius", type=float, default=CONTEXT_RADIUS,
+                        help="Its train_optimized.py --emergency-radius")
+    parser.add_argument("--meso", action="store_true",
+                        help="Run on the mesoscopic env train_optimized.py pretrains on (default step length)")
+    parser.add_argument("--masked", action="store_true",
+                        help="The model is a MaskablePPO one from train_optimized.py --masked")
+    parser.add_argument("--fallback", action="store_true",
+                        help="Let the max-pressure controller make the decisions the policy misses")
+    args = parser.parse_args()
+    run_realtime(speed=args.speed, controller=args.controller, num_seconds=args.seconds, model_path=args.model,
+                 norm_path=args.norm, use_gui=args.gui, report_path=args.report, emergency_obs=args.emergency_obs,
+                 meso=args.meso, masked=args.masked, fallback=args.fallback,
+                 emergency_radius=args.emergency_radius)
@@ -1,6 +1,8 @@
 import sumo_rl
 import traci
 
+from realtime import DriftFreeTicker
+
 def run_baseline():
     env = sumo_rl.SumoEnvironment(
         net_file="draft02.net.xml",
@@ -25,14 +27,15 @@ def run_baseline():
     except:
         pass # Ignore if GUI isn't ready
     
+    # 50ms of wall-clock per env step, on absolute deadlines so slow steps don't stretch the run
+    ticker = DriftFreeTicker(0.05)
     while not done:
         # Action None = "Do nothing, let the fixed timer run"
         obs, reward, done, info = env.step(None)
 
         # --- FIX: Slow down manually if setSchema fails ---
         # traci.simulation.getDeltaT() usually returns 1.0s
-        import time
-        time.sleep(0.05) # Sleep 50ms per step to make it visible
+        ticker.wait() # 50ms per step to make it visible
         
         # --- FIX: Print current time so you know it's running ---
         current_time = traci.simulation.getTime()
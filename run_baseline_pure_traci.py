@@ -10,6 +10,12 @@ if 'SUMO_HOME' in os.environ:
 else:
     sys.exit("please declare environment variable 'SUMO_HOME'")
 
+from emergency_tracker import EmergencyTracker, count_emergency_vehicles, print_summary
+from streaming_stats import VehicleStats, print_vehicle_summary
+
+# Route files listed in draft02.sumocfg
+ROUTE_FILES = ["vtypes.rou.xml", "draft02.rou.xml", "ambulance.rou.xml"]
+
 def run_pure_baseline():
     print("🚀 Starting Pure TraCI Baseline...")
     
@@ -22,11 +28,14 @@ def run_pure_baseline():
     traci.start(sumoCmd)
     
     # 3. Setup tracking variables
-    ambulance_start = 0
-    ambulance_end = 0
-    ambulance_duration = 0
+    # The tracker records every emergency vehicle on each simulation step
+    tracker = EmergencyTracker(traci)
+    expected = count_emergency_vehicles(ROUTE_FILES)
+    reported = 0
     step = 0
-    vehicle_waiting_times = {}  # Track max waiting time per vehicle
+    # Max waiting time / time loss per civilian vehicle; arrived vehicles are
+    # folded into streaming quantiles so memory stays constant
+    civilians = VehicleStats(traci, exclude=tracker)
     
     # 4. Set the GUI to look nice (Optional)
     try:
@@ -48,47 +57,40 @@ def run_pure_baseline():
         # Track the Ambulance and civilian waiting times
         # We wrap this in try-catch to prevent crashes if TraCI hiccups
         try:
-            vehicle_list = traci.vehicle.getIDList()
-            
             # Track max waiting time for each civilian vehicle
-            for veh_id in vehicle_list:
-                if veh_id != "hero_ambulance":
-                    waiting = traci.vehicle.getWaitingTime(veh_id)
-                    # Keep the maximum waiting time seen for this vehicle
-                    if veh_id not in vehicle_waiting_times or waiting > vehicle_waiting_times[veh_id]:
-                        vehicle_waiting_times[veh_id] = waiting
+            civilians.observe()
             
-            if "hero_ambulance" in vehicle_list:
-                if ambulance_start == 0:
-                    ambulance_start = traci.simulation.getTime()
-                    print(f"🚑 Ambulance entered at time: {ambulance_start}")
-            
-            # Check if it finished
-            if ambulance_start > 0 and "hero_ambulance" not in vehicle_list and ambulance_end == 0:
-                ambulance_end = traci.simulation.getTime()
-                ambulance_duration = ambulance_end - ambulance_start
-                print(f"🏁 Ambulance FINISHED! Total Time: {ambulance_duration} seconds")
-                # Stop immediately after ambulance finishes for fair comparison
-                break 
+            for veh_id in tracker.ids[reported:]:
+                print(f"🚑 {veh_id} entered at time: {tracker.depart[tracker.slots[veh_id]]}")
+            reported = tracker.count
+
+            # Check if all emergency vehicles finished
+            if expected and tracker.finished() == expected:
+                print(f"🏁 All {expected} emergency vehicles FINISHED!")
+                # Stop immediately after the last one finishes for fair comparison
+                break
                 
         except Exception as e:
             print(f"⚠️ Error checking vehicle: {e}")
 
     # 6. Clean up
     print("✅ Simulation Finished.")
+    summary = tracker.summary()
+    civilians.finish()
     traci.close()
+    print_summary(summary)
+    transit = summary["transit"]
+    ambulance_duration = transit["mean"] if transit else 0
     
     # 7. Calculate civilian average waiting time
-    if vehicle_waiting_times:
-        civilian_avg_wait = sum(vehicle_waiting_times.values()) / len(vehicle_waiting_times)
-    else:
-        civilian_avg_wait = 0
+    print_vehicle_summary(civilians.summary())
+    civilian_avg_wait = civilians.wait.mean if civilians.wait.count else 0
     
     # 8. Save results to file for plotting
     with open("baseline_result.txt", "w") as f:
         f.write(f"{ambulance_duration}\n")
         f.write(f"{civilian_avg_wait}\n")
-    print(f"📊 Baseline ambulance time: {ambulance_duration}s")
+    print(f"📊 Baseline ambulance time (mean): {ambulance_duration}s")
     print(f"📊 Baseline civilian avg waiting time: {civilian_avg_wait:.2f}s")
     
     return ambulance_duration, civilian_avg_wait
@@ -0,0 +1,9 @@
+# The network every tool runs on, and signal helpers shared by the tools
+# that read its programs. Kept free of SUMO/TraCI imports so anything
+# (including spawned benchmark workers) can import it cheaply.
+NET_FILE = "draft02.net.xml"
+
+
+def is_green(state):
+    """True for a signal state that gives some movement a green (no yellow, not all red)."""
+    return "y" not in state and (state.count("r") + state.count("s") != len(state))
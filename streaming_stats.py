@@ -0,0 +1,256 @@
+import numpy as np
+import traci
+import traci.constants as tc
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class RunningMoments:
+    """Count, mean, variance (Welford) and min/max of a stream; merge() combines two streams exactly."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        batch = RunningMoments()
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch.m2 = float(((values - batch.mean) ** 2).sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        self.merge(batch)
+
+    def merge(self, other):
+        # Chan et al. parallel update
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang & Liberty 2016).
+
+    Items are kept in levels of NumPy arrays; an item at level h stands
+    for 2**h stream values. Level capacities are k at the top, shrinking
+    by 2/3 per level below (at least 2). Once the sketch holds as many
+    items as all capacities together, the lowest full level is sorted and
+    every second item, starting at a random offset, moves up one level.
+    Memory stays O(k) however long the stream is (~540 items at the
+    default k=200), and two sketches merge by concatenating their levels,
+    so workers can each keep one and the results are combined.
+
+    The error is in rank, roughly proportional to 1/k. At k=200, on 500k
+    exponential samples, a quantile is off by ~0.2% of the stream on
+    average and up to 0.5% (0.6% after merging 200 sketches). In a long
+    tail that is a larger error in value: p99 is typically off by ~3%,
+    up to 8% (13% merged). k=800 (~2100 items) keeps p99 within ~3%.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._buffer = []   # level-0 items not yet moved into levels[0]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, x):
+        self._buffer.append(x)
+        self.n += 1
+        if len(self._buffer) >= self.k:
+            self._compress()
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        self.levels[0] = np.concatenate([self.levels[0], self._buffer, values])
+        self._buffer = []
+        self.n += len(values)
+        self._compress()
+
+    def _compress(self):
+        if self._buffer:
+            self.levels[0] = np.concatenate([self.levels[0], self._buffer])
+            self._buffer = []
+        # Lazy compaction: only once the whole sketch is full, and only the
+        # lowest level(s) over capacity, so as many items as possible survive
+        while len(self) >= sum(self._capacity(h) for h in range(len(self.levels))):
+            level = next(h for h in range(len(self.levels)) if len(self.levels[h]) >= self._capacity(h))
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            # An odd item out stays behind so the total weight is exact
+            odd = len(items) % 2
+            promoted = items[odd + self._rng.integers(2)::2]
+            self.levels[level] = items[:odd]
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._buffer.extend(other._buffer)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _weighted(self):
+        items = [np.asarray(self._buffer, dtype=float)] + self.levels
+        weights = [np.ones(len(self._buffer))] + [np.full(len(a), 2.0 ** h) for h, a in enumerate(self.levels)]
+        values = np.concatenate(items)
+        order = np.argsort(values, kind="stable")
+        return values[order], np.cumsum(np.concatenate(weights)[order])
+
+    def quantiles(self, qs):
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        values, cumulative = self._weighted()
+        ranks = np.asarray(qs, dtype=float) * cumulative[-1]
+        return values[np.minimum(np.searchsorted(cumulative, ranks), len(values) - 1)]
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+    def cdf(self, x):
+        """Estimated fraction of the stream <= x."""
+        if self.n == 0:
+            return float("nan")
+        values, cumulative = self._weighted()
+        i = np.searchsorted(values, x, side="right")
+        return float(cumulative[i - 1] / cumulative[-1]) if i else 0.0
+
+    def __len__(self):
+        return len(self._buffer) + sum(len(a) for a in self.levels)
+
+
+class StreamingStats:
+    """Running moments plus a KLL sketch of one metric; constant memory, mergeable."""
+
+    def __init__(self, k=200, seed=None):
+        self.moments = RunningMoments()
+        self.sketch = KLLSketch(k, seed)
+
+    def add(self, x):
+        self.moments.add(x)
+        self.sketch.update(x)
+
+    def add_many(self, values):
+        self.moments.add_many(values)
+        self.sketch.update_many(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    @property
+    def mean(self):
+        return self.moments.mean if self.moments.count else float("nan")
+
+    def summary(self, qs=QUANTILES):
+        """{count, mean, std, min, max, p50, p90, p99} (quantiles as given by qs)."""
+        if self.count == 0:
+            return {"count": 0}
+        summary = {"count": self.count, "mean": self.moments.mean, "std": self.moments.std,
+                   "min": self.moments.min, "max": self.moments.max}
+        for q, value in zip(qs, self.sketch.quantiles(qs)):
+            summary[f"p{q * 100:g}"] = float(value)
+        return summary
+
+
+class VehicleStats:
+    """
+    Per-vehicle waiting time (maximum seen, like the evaluation scripts
+    always reported) and time loss over a run, in memory bounded by the
+    vehicles currently on the road.
+
+    Each vehicle is subscribed once when first seen, so an observe() is
+    one ID-list call plus the subscription results delivered with the
+    simulation step. A vehicle that is no longer listed has arrived: its
+    final values go into the StreamingStats and its entry is evicted.
+    `exclude` (e.g. an EmergencyTracker) keeps vehicles out of the stats.
+    """
+
+    def __init__(self, conn=traci, exclude=(), k=200):
+        self.conn = conn
+        self.exclude = exclude
+        self.active = {}   # veh_id -> [max waiting time, time loss]
+        self.wait = StreamingStats(k)
+        self.time_loss = StreamingStats(k)
+
+    def observe(self):
+        ids = self.conn.vehicle.getIDList()
+        for veh_id in self.active.keys() - set(ids):
+            self._evict(veh_id)
+        results = self.conn.vehicle.getAllSubscriptionResults()
+        for veh_id in ids:
+            if veh_id in self.exclude:
+                continue
+            record = self.active.get(veh_id)
+            if record is None:
+                self.conn.vehicle.subscribe(veh_id, [tc.VAR_WAITING_TIME, tc.VAR_TIMELOSS])
+                values = self.conn.vehicle.getSubscriptionResults(veh_id)
+                record = self.active[veh_id] = [0.0, 0.0]
+            else:
+                values = results.get(veh_id)
+            if not values:
+                continue
+            record[0] = max(record[0], values[tc.VAR_WAITING_TIME])
+            record[1] = values[tc.VAR_TIMELOSS]
+
+    def _evict(self, veh_id):
+        max_wait, time_loss = self.active.pop(veh_id)
+        self.wait.add(max_wait)
+        self.time_loss.add(time_loss)
+
+    def finish(self):
+        """Count the vehicles still on the road with their values so far (call once at the end of the run)."""
+        for veh_id in list(self.active):
+            self._evict(veh_id)
+
+    def summary(self):
+        return {"wait": self.wait.summary(), "time_loss": self.time_loss.summary()}
+
+
+def print_vehicle_summary(summary, label="Civilian vehicles"):
+    wait, time_loss = summary["wait"], summary["time_loss"]
+    if not wait["count"]:
+        print(f"📊 {label}: no vehicles")
+        return
+    print(f"📊 {label} ({wait['count']}): wait p50 {wait['p50']:.2f}s p90 {wait['p90']:.2f}s "
+          f"p99 {wait['p99']:.2f}s | time loss p50 {time_loss['p50']:.2f}s p90 {time_loss['p90']:.2f}s "
+          f"p99 {time_loss['p99']:.2f}s")
@@ -0,0 +1,236 @@
+import atexit
+import itertools
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import sumolib
+import traci
+from traci.exceptions import FatalTraCIError, TraCIException
+from sumo_rl import SumoEnvironment
+import sumo_rl.environment.env as sumo_rl_env
+
+from scenario import NET_FILE
+
+
+class SumoProcess:
+    """
+    One long-lived headless SUMO process with its own TraCI connection.
+    New episodes are started with traci.load(), which re-reads the given
+    network/route files inside the running process instead of paying for a
+    process launch and TraCI handshake every time.
+    """
+
+    _labels = itertools.count()
+
+    def __init__(self, sumo_binary="sumo", net_file=NET_FILE, connect_timeout=30.0):
+        self.label = f"pool_{os.getpid()}_{next(self._labels)}"
+        self.loads = 0
+        port = sumolib.miscutils.getFreeSocketPort()
+        cmd = [sumolib.checkBinary(sumo_binary), "-n", net_file, "--remote-port", str(port),
+               "--no-step-log", "--no-warnings"]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        # traci.start() sleeps a whole second before its first retry; poll instead
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                self.conn = traci.connect(port, numRetries=0, proc=self.process, label=self.label)
+                break
+            except (FatalTraCIError, TraCIException):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.process.kill()
+                    raise
+                time.sleep(0.01)
+
+    def load(self, args):
+        """Restart the simulation with new options (everything after the binary name)."""
+        self.conn.load(list(args))
+        self.loads += 1
+        # Code that uses the module-level traci API (rewards, recorders) talks to this process
+        traci.switch(self.label)
+
+    def healthy(self):
+        if self.process.poll() is not None:
+            return False
+        try:
+            self.conn.simulation.getTime()
+            return True
+        except (FatalTraCIError, TraCIException, OSError):
+            return False
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass  # already gone
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class SumoPool:
+    """
+    Warm SUMO processes that simulations lease and give back.
+
+    Leasing health-checks the process (a TraCI round trip) and replaces
+    dead ones; processes are recycled after `max_loads` episodes to bound
+    any memory growth inside SUMO.
+    """
+
+    def __init__(self, size=0, max_size=None, sumo_binary="sumo", net_file=NET_FILE, max_loads=500):
+        self.sumo_binary = sumo_binary
+        self.net_file = net_file
+        self.max_size = max_size
+        self.max_loads = max_loads
+        self._idle = []
+        self._leased = set()
+        self._lock = threading.Lock()
+        self.started = 0
+        for _ in range(size):
+            self._idle.append(self._start())
+
+    def _start(self):
+        self.started += 1
+        return SumoProcess(self.sumo_binary, self.net_file)
+
+    def lease(self):
+        with self._lock:
+            while self._idle:
+                process = self._idle.pop()
+                if process.healthy() and process.loads < self.max_loads:
+                    self._leased.add(process)
+                    return process
+                process.close()
+            if self.max_size is not None and len(self._leased) >= self.max_size:
+                raise RuntimeError(f"All {self.max_size} SUMO processes are leased")
+        process = self._start()
+        with self._lock:
+            self._leased.add(process)
+        return process
+
+    def release(self, process):
+        with self._lock:
+            self._leased.discard(process)
+            if process.healthy():
+                self._idle.append(process)
+                return
+        process.close()
+
+    @contextmanager
+    def leased(self):
+        process = self.lease()
+        try:
+            yield process
+        finally:
+            self.release(process)
+
+    def close(self):
+        with self._lock:
+            processes = self._idle + list(self._leased)
+            self._idle, self._leased = [], set()
+        for process in processes:
+            process.close()
+
+
+_POOL = None
+
+
+def get_pool():
+    """Per-process default pool, created on first use and shut down at exit."""
+    global _POOL
+    if _POOL is None:
+        _POOL = SumoPool()
+        atexit.register(_POOL.close)
+    return _POOL
+
+
+class _PooledConnection:
+    """Leased connection handed to SumoEnvironment.__init__; its close() gives the process back."""
+
+    def __init__(self, pool, process):
+        self._pool = pool
+        self._process = process
+
+    def __getattr__(self, name):
+        return getattr(self._process.conn, name)
+
+    def close(self):
+        self._pool.release(self._process)
+
+
+class _InitTraci:
+    """
+    Stands in for the traci module while SumoEnvironment.__init__ runs:
+    it starts SUMO once just to read the traffic lights, which we serve
+    from a pooled process instead.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    def start(self, cmd, label="default", **kwargs):
+        process = self._pool.lease()
+        process.load(cmd[1:])
+        self._conn = _PooledConnection(self._pool, process)
+
+    def getConnection(self, label):
+        return self._conn
+
+
+def sumo_rl_args(env):
+    """The SUMO options SumoEnvironment._start_simulation() would launch with (headless)."""
+    args = ["-n", env._net, "-r", env._route,
+            "--max-depart-delay", str(env.max_depart_delay),
+            "--waiting-time-memory", str(env.waiting_time_memory),
+            "--time-to-teleport", str(env.time_to_teleport)]
+    if env.begin_time > 0:
+        args += ["-b", str(env.begin_time)]
+    if env.sumo_seed == "random":
+        args.append("--random")
+    else:
+        args += ["--seed", str(env.sumo_seed)]
+    if not env.sumo_warnings:
+        args.append("--no-warnings")
+    if env.additional_sumo_cmd is not None:
+        args += env.additional_sumo_cmd.split()
+    return args
+
+
+class PooledSumoEnvironment(SumoEnvironment):
+    """
+    sumo_rl.SumoEnvironment that leases its SUMO process from a SumoPool:
+    reset() reloads the leased process with traci.load() instead of closing
+    TraCI and launching a new SUMO, and close() returns it to the pool.
+    GUI environments fall back to sumo-rl's own process handling.
+    """
+
+    def __init__(self, *args, pool=None, **kwargs):
+        self.pool = pool or get_pool()
+        self._lease = None
+        if kwargs.get("use_gui") or kwargs.get("render_mode") is not None or sumo_rl_env.LIBSUMO:
+            super().__init__(*args, **kwargs)
+            return
+        real_traci = sumo_rl_env.traci
+        sumo_rl_env.traci = _InitTraci(self.pool)
+        try:
+            super().__init__(*args, **kwargs)
+        finally:
+            sumo_rl_env.traci = real_traci
+
+    def _start_simulation(self):
+        if self.use_gui or self.render_mode is not None:
+            return super()._start_simulation()
+        if self._lease is None:
+            self._lease = self.pool.lease()
+        self._lease.load(sumo_rl_args(self))
+        self.sumo = self._lease.conn
+
+    def close(self):
+        if self._lease is None:
+            return super().close()
+        self.pool.release(self._lease)
+        self._lease = None
+        self.sumo = None
@@ -0,0 +1,494 @@
+import argparse
+import json
+import math
+import os
+import time
+
+import gymnasium as gym
+import numpy as np
+import traci
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+from scenario import is_green
+
+PARAMS_FILE = "surrogate_params.json"
+CONTROLLED_TL = "J4"
+BIN_SECONDS = 60
+# sumo-rl's density/queue normalisation: vehicles per lane = length / (MIN_GAP + vehicle length)
+MIN_GAP = 2.5
+VEHICLE_LENGTH = 5.0
+# Reward weight of custom_ambulance_reward's civilian term (train_optimized.py)
+WAIT_WEIGHT = 0.7
+# Saturation flow of a lane is only measured from at least this many
+# seconds of green with a queue (summed over the recorded runs)
+MIN_DISCHARGE_SECONDS = 30
+# Saturation flow (veh/s) of lanes with fewer samples: 1800 veh/h per lane,
+# the usual base saturation flow (~2s discharge headway). Overridden with
+# --saturation in surrogate_env.py / train_optimized.py
+DEFAULT_SATURATION = 0.5
+
+
+def lane_greens(sumo, tl, lanes):
+    """(num_green_phases, len(lanes)) bool: which lanes have a G/g link in each green phase of `tl`."""
+    phases = [p.state for p in sumo.trafficlight.getAllProgramLogics(tl)[0].phases if is_green(p.state)]
+    links = sumo.trafficlight.getControlledLinks(tl)
+    index = {lane: i for i, lane in enumerate(lanes)}
+    greens = np.zeros((len(phases), len(lanes)), dtype=bool)
+    for p, state in enumerate(phases):
+        for k, link in enumerate(links):
+            for in_lane, _, _ in link:
+                if in_lane in index and state[k] in "Gg":
+                    greens[p, index[in_lane]] = True
+    return phases, greens
+
+
+class CalibrationRecorder(traci.StepListener):
+    """
+    Records, on every simulation step of a run, what the queue model needs:
+    intended departures per entry edge (demand, including vehicles SUMO
+    couldn't insert), the lane vehicles enter on, stop-line crossings with
+    the lane they lead to, queue discharge and the state of the traffic
+    lights nobody controls.
+
+    Discharge is what the queue model's saturation flow stands for: the
+    stop-line crossings in the seconds a lane had green and any vehicle
+    halted on it at the start of the second. That needs no queue of a
+    given length, so it works on the short (15-35m) lanes here, where a
+    queue is two or three vehicles. Blocked seconds count too, so the rate
+    is the effective discharge of the recorded env, including head-of-line
+    and junction blocking the queue model has no notion of.
+    discharge_seconds / discharge_crossings are the per-lane sample counts.
+    """
+
+    def __init__(self, conn, lanes, tls, num_seconds):
+        self.conn = conn
+        self.lanes = lanes
+        self.index = {lane: i for i, lane in enumerate(lanes)}
+        self.edge_of = [lane.rsplit("_", 1)[0] for lane in lanes]
+        self.tls = tls
+        self.green_states, self.lane_green = {}, {}
+        for tl in tls:
+            self.green_states[tl], self.lane_green[tl] = lane_greens(conn, tl, lanes)
+        n = len(lanes)
+        bins = math.ceil(num_seconds / BIN_SECONDS)
+        self.demand = {}                        # entry edge -> arrivals per time bin
+        self.bins = bins
+        self.enter_lane = np.zeros(n)           # departures per lane
+        self.crossings = np.zeros(n)
+        self.transfers = np.zeros((n, n))
+        self.discharge_seconds = np.zeros(n)
+        self.discharge_crossings = np.zeros(n)
+        self.schedules = {tl: [] for tl in tls}
+        self._where = {}                        # veh_id -> lane index it is on
+        self._left = {}                         # veh_id -> lane it crossed from, until it shows up downstream
+        self._discharging = np.zeros(n, dtype=bool)   # queued green during the coming step
+        conn.addStepListener(self)
+
+    def _add_demand(self, edge, t):
+        counts = self.demand.setdefault(edge, np.zeros(self.bins))
+        counts[min(int(t // BIN_SECONDS), self.bins - 1)] += 1
+
+    def step(self, t=0):
+        sumo = self.conn
+        now = sumo.simulation.getTime()
+        for veh_id in sumo.simulation.getLoadedIDList():
+            # Negative delay = seconds until the intended departure
+            self._add_demand(sumo.vehicle.getRoute(veh_id)[0], now - sumo.vehicle.getDepartDelay(veh_id))
+        for veh_id in sumo.simulation.getDepartedIDList():
+            lane = self.index.get(sumo.vehicle.getLaneID(veh_id))
+            if lane is not None:
+                self.enter_lane[lane] += 1
+
+        where = {}
+        for i, lane in enumerate(self.lanes):
+            for veh_id in sumo.lane.getLastStepVehicleIDs(lane):
+                where[veh_id] = i
+        for veh_id, i in self._where.items():
+            j = where.get(veh_id)
+            if j == i or (j is not None and self.edge_of[j] == self.edge_of[i]):
+                continue  # still there, or changed lanes on the same edge
+            self.crossings[i] += 1
+            self.discharge_crossings[i] += self._discharging[i]
+            if j is None:
+                self._left[veh_id] = i
+            else:
+                self.transfers[i, j] += 1
+        for veh_id in list(self._left):
+            j = where.get(veh_id)
+            if j is not None:
+                self.transfers[self._left.pop(veh_id), j] += 1
+        self._where = where
+
+        # Signal state for the next step, and which lanes will discharge a queue
+        green = np.zeros(len(self.lanes), dtype=bool)
+        for tl in self.tls:
+            state = sumo.trafficlight.getRedYellowGreenState(tl)
+            phase = self.green_states[tl].index(state) if state in self.green_states[tl] else -1
+            self.schedules[tl].append(phase)
+            if phase >= 0:
+                green |= self.lane_green[tl][phase]
+        for i in np.flatnonzero(green):
+            self._discharging[i] = sumo.lane.getLastStepHaltingNumber(self.lanes[i]) > 0
+        self._discharging &= green
+        self.discharge_seconds += self._discharging
+        return True
+
+
+def _signal_lanes(sumo, tls):
+    lanes = []
+    for tl in tls:
+        lanes += [lane for lane in dict.fromkeys(sumo.trafficlight.getControlledLanes(tl)) if lane not in lanes]
+    return lanes
+
+
+def record_runs(seeds=(0, 1, 2), num_seconds=1000):
+    """
+    Drive the sumo-rl training environment (train_optimized.make_env) with
+    random actions and record one CalibrationRecorder per seed. Recording
+    the training env itself means the calibrated model also reproduces how
+    sumo-rl treats the junctions the agent doesn't control.
+    """
+    from train_optimized import make_env
+
+    recorders = []
+    env = make_env()
+    for seed in seeds:
+        env.reset(seed=seed)
+        env.action_space.seed(seed)
+        sumo = env.sumo
+        tls = list(sumo.trafficlight.getIDList())
+        recorder = CalibrationRecorder(sumo, _signal_lanes(sumo, tls), tls, num_seconds)
+        done = False
+        while not done:
+            _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+            done = terminated or truncated
+        sumo.removeStepListener(recorder.getID())
+        recorders.append(recorder)
+        network = {
+            "tls": tls,
+            "lanes": recorder.lanes,
+            "length": [sumo.lane.getLength(lane) for lane in recorder.lanes],
+            "speed": [sumo.lane.getMaxSpeed(lane) for lane in recorder.lanes],
+            "greens": {tl: lane_greens(sumo, tl, recorder.lanes)[1].tolist() for tl in tls},
+            "controlled_lanes": list(dict.fromkeys(sumo.trafficlight.getControlledLanes(CONTROLLED_TL))),
+        }
+        ts = env.traffic_signals[CONTROLLED_TL]
+        network.update(yellow_time=ts.yellow_time, min_green=ts.min_green, delta_time=env.delta_time,
+                       num_seconds=num_seconds)
+    env.close()
+    return network, recorders
+
+
+def calibrate(network, recorders, saturation=DEFAULT_SATURATION):
+    """
+    Turn recorded runs into queue-model parameters (plain lists,
+    JSON-serialisable). Lanes the runs couldn't measure a saturation flow
+    for get `saturation` (veh/s), with a warning.
+    """
+    lanes = network["lanes"]
+    n = len(lanes)
+    runs = len(recorders)
+    edge_of = [lane.rsplit("_", 1)[0] for lane in lanes]
+
+    # Demand: intended arrivals per entry edge and time bin, split over the
+    # edge's lanes by where SUMO inserted vehicles
+    enter = sum(r.enter_lane for r in recorders)
+    bins = recorders[0].bins
+    arrival_rate = np.zeros((bins, n))
+    for edge in {e for r in recorders for e in r.demand}:
+        per_bin = sum(r.demand.get(edge, np.zeros(bins)) for r in recorders) / runs / BIN_SECONDS
+        edge_lanes = [i for i in range(n) if edge_of[i] == edge]
+        if not edge_lanes:
+            continue  # starts outside the signalised lanes
+        split = enter[edge_lanes]
+        split = split / split.sum() if split.sum() else np.full(len(edge_lanes), 1 / len(edge_lanes))
+        arrival_rate[:, edge_lanes] += per_bin[:, None] * split
+
+    # Saturation flow: vehicles per second of green with a queue
+    seconds = sum(r.discharge_seconds for r in recorders)
+    discharged = sum(r.discharge_crossings for r in recorders)
+    measured = seconds >= MIN_DISCHARGE_SECONDS
+    rates = np.where(measured, discharged / np.maximum(seconds, 1), saturation)
+    sources = np.where(measured, "measured", "default")
+    if not measured.all():
+        print(f"⚠️ Saturation flow defaults to {saturation:g} veh/s on {int((~measured).sum())}/{n} lanes with "
+              f"less than {MIN_DISCHARGE_SECONDS}s of queued green in {runs} runs: "
+              + ", ".join(f"{lanes[i]} ({seconds[i]:.0f}s)" for i in np.flatnonzero(~measured)))
+
+    # Turning: share of each lane's crossings that continue onto another
+    # signalised lane (the rest leave the network)
+    crossings = sum(r.crossings for r in recorders)
+    transfers = sum(r.transfers for r in recorders)
+    turning = transfers / np.maximum(crossings, 1)[:, None]
+
+    # Uncontrolled signals: the green phase most runs had at each second
+    schedules = {}
+    for tl in network["tls"]:
+        if tl == CONTROLLED_TL:
+            continue
+        steps = np.array([r.schedules[tl][:network["num_seconds"]] for r in recorders])
+        schedules[tl] = [int(np.bincount(col + 1).argmax()) - 1 for col in steps.T]
+
+    length = np.array(network["length"])
+    return {
+        **network,
+        "capacity": (length / (MIN_GAP + VEHICLE_LENGTH)).tolist(),
+        "travel_steps": np.maximum(1, np.ceil(length / np.array(network["speed"]))).astype(int).tolist(),
+        "bin_seconds": BIN_SECONDS,
+        "arrival_rate": arrival_rate.tolist(),
+        "saturation": rates.tolist(),
+        "saturation_source": sources.tolist(),
+        "default_saturation": saturation,
+        "saturation_seconds": seconds.tolist(),
+        "saturation_crossings": discharged.tolist(),
+        "turning": turning.tolist(),
+        "schedules": schedules,
+        "calibration_runs": runs,
+    }
+
+
+def load_or_calibrate(path=PARAMS_FILE, seeds=(0, 1, 2), saturation=DEFAULT_SATURATION):
+    if os.path.exists(path):
+        with open(path) as f:
+            params = json.load(f)
+        if params.get("default_saturation") == saturation:
+            return params
+        print(f"📐 {path} was calibrated with another default saturation flow, re-calibrating")
+    params = calibrate(*record_runs(seeds), saturation=saturation)
+    with open(path, "w") as f:
+        json.dump(params, f)
+    return params
+
+
+class QueueModel:
+    """
+    Batched point-queue model of the signalised lanes, one row per
+    simulated instance, advanced one second at a time in NumPy.
+
+    Each lane holds vehicles driving to the stop line (a short pipeline of
+    its free-flow travel time) and a queue of halted vehicles. On green a
+    lane discharges at its saturation flow; discharged vehicles follow the
+    turning shares onto downstream signalised lanes (or leave), and flow
+    is held back when those lanes are full. New vehicles arrive at the
+    calibrated (Poisson) rates and wait outside the network while their
+    entry lane is full, like SUMO's insertion backlog. Queued vehicles
+    accumulate waiting time per lane, which leaves with them on discharge.
+    """
+
+    def __init__(self, params, num_envs, seed=None):
+        self.params = params
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.lanes = params["lanes"]
+        self.capacity = np.array(params["capacity"])
+        self.travel = np.array(params["travel_steps"])
+        self.saturation = np.array(params["saturation"])
+        self.turning = np.array(params["turning"])
+        self.arrival_rate = np.array(params["arrival_rate"])
+        self.bin_seconds = params["bin_seconds"]
+        self.greens = {tl: np.array(g, dtype=bool) for tl, g in params["greens"].items()}
+        self.schedules = {tl: np.array(s) for tl, s in params["schedules"].items()}
+        self.controlled = np.array([self.lanes.index(lane) for lane in params["controlled_lanes"]])
+        self.yellow_time = params["yellow_time"]
+        self.min_green = params["min_green"]
+
+        n = len(self.lanes)
+        shape = (num_envs, n)
+        self.pipeline = np.zeros((num_envs, n, self.travel.max()))
+        self.queue = np.zeros(shape)
+        self.waiting = np.zeros(shape)
+        self.backlog = np.zeros(shape)
+        self.time = np.zeros(num_envs, dtype=int)
+        self.green_phase = np.zeros(num_envs, dtype=int)
+        self.is_yellow = np.zeros(num_envs, dtype=bool)
+        self.since_change = np.zeros(num_envs, dtype=int)
+        self._rows = np.arange(num_envs)
+        self._entry = self.travel - 1
+
+    def reset(self, mask=None):
+        mask = np.ones(self.num_envs, dtype=bool) if mask is None else mask
+        for array in (self.pipeline, self.queue, self.waiting, self.backlog):
+            array[mask] = 0
+        self.time[mask] = 0
+        self.green_phase[mask] = 0
+        self.is_yellow[mask] = False
+        self.since_change[mask] = 0
+
+    def set_next_phase(self, actions):
+        """sumo-rl's TrafficSignal.set_next_phase for the controlled signal, for every instance."""
+        switch = (actions != self.green_phase) & (self.since_change >= self.yellow_time + self.min_green)
+        self.green_phase = np.where(switch, actions, self.green_phase)
+        self.is_yellow |= switch
+        self.since_change[switch] = 0
+
+    def _green_mask(self):
+        n = len(self.lanes)
+        green = np.zeros((self.num_envs, n), dtype=bool)
+        green[~self.is_yellow] |= self.greens[CONTROLLED_TL][self.green_phase[~self.is_yellow]]
+        for tl, schedule in self.schedules.items():
+            phase = schedule[np.minimum(self.time, len(schedule) - 1)]
+            on = phase >= 0
+            green[on] |= self.greens[tl][phase[on]]
+        return green
+
+    def advance(self):
+        """One simulated second for every instance."""
+        green = self._green_mask()
+        at_line = self.queue + self.pipeline[:, :, 0]
+        self.pipeline[:, :, :-1] = self.pipeline[:, :, 1:]
+        self.pipeline[:, :, -1] = 0
+
+        # Discharge, held back where the downstream lanes are full
+        outflow = np.minimum(at_line, self.saturation * green)
+        space = np.maximum(self.capacity - self.queue - self.pipeline.sum(axis=2), 0)
+        demand = outflow @ self.turning
+        fits = np.where(demand > 0, np.minimum(1.0, space / np.maximum(demand, 1e-9)), 1.0)
+        blocked = np.where(self.turning > 0, fits[:, None, :], 1.0).min(axis=2)
+        outflow *= blocked
+        transfer = outflow @ self.turning
+
+        from_queue = np.minimum(outflow, self.queue)
+        self.waiting *= np.where(self.queue > 0, 1 - from_queue / np.maximum(self.queue, 1e-9), 1.0)
+        self.queue = at_line - outflow
+        self.waiting += self.queue
+        self.pipeline[self._rows[:, None], np.arange(len(self.lanes)), self._entry] += transfer
+
+        # New vehicles enter where there is room, the rest wait outside
+        rate = self.arrival_rate[np.minimum(self.time // self.bin_seconds, len(self.arrival_rate) - 1)]
+        self.backlog += self.rng.poisson(rate)
+        space = np.maximum(self.capacity - self.queue - self.pipeline.sum(axis=2), 0)
+        entering = np.minimum(self.backlog, np.floor(space))
+        self.backlog -= entering
+        self.pipeline[self._rows[:, None], np.arange(len(self.lanes)), self._entry] += entering
+
+        # sumo-rl's TrafficSignal.update: yellow ends after yellow_time steps
+        self.time += 1
+        self.since_change += 1
+        self.is_yellow &= self.since_change != self.yellow_time
+
+    def observation(self):
+        """sumo-rl's default observation for the controlled signal."""
+        lanes = self.controlled
+        cap = self.capacity[lanes]
+        phase = np.eye(self.greens[CONTROLLED_TL].shape[0], dtype=np.float32)[self.green_phase]
+        min_green = (self.since_change >= self.min_green + self.yellow_time).astype(np.float32)[:, None]
+        vehicles = self.queue[:, lanes] + self.pipeline[:, lanes].sum(axis=2)
+        density = np.minimum(1, vehicles / cap)
+        queue = np.minimum(1, self.queue[:, lanes] / cap)
+        return np.concatenate([phase, min_green, density, queue], axis=1).astype(np.float32)
+
+    def reward(self):
+        """custom_ambulance_reward's civilian term: weighted waiting time on the controlled lanes."""
+        return -WAIT_WEIGHT * self.waiting[:, self.controlled].sum(axis=1)
+
+
+class SurrogateVecEnv(VecEnv):
+    """
+    SB3 VecEnv of `num_envs` queue-model instances stepped together, with
+    the observation and action spaces of the sumo-rl training env: each
+    step applies the action like sumo-rl and advances delta_time seconds.
+    Episodes end (truncated) after num_seconds and reset automatically.
+    """
+
+    def __init__(self, params, num_envs=64, seed=None):
+        self.model = QueueModel(params, num_envs, seed)
+        self.delta_time = params["delta_time"]
+        self.num_seconds = params["num_seconds"]
+        n_obs = 2 * len(params["controlled_lanes"]) + len(params["greens"][CONTROLLED_TL]) + 1
+        observation_space = spaces.Box(0.0, 1.0, shape=(n_obs,), dtype=np.float32)
+        action_space = spaces.Discrete(len(params["greens"][CONTROLLED_TL]))
+        super().__init__(num_envs, observation_space, action_space)
+        self._actions = None
+
+    def reset(self):
+        self.model.reset()
+        return self.model.observation()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions).reshape(self.num_envs)
+
+    def step_wait(self):
+        model = self.model
+        model.set_next_phase(self._actions)
+        for _ in range(self.delta_time):
+            model.advance()
+        obs = model.observation()
+        rewards = model.reward().astype(np.float32)
+        dones = model.time >= self.num_seconds
+        infos = [{} for _ in range(self.num_envs)]
+        if dones.any():
+            for i in np.flatnonzero(dones):
+                infos[i]["terminal_observation"] = obs[i].copy()
+                infos[i]["TimeLimit.truncated"] = True
+            model.reset(dones)
+            obs[dones] = model.observation()[dones]
+        return obs, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name)] * len(self._get_indices(indices))
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        raise AttributeError(f"SurrogateVecEnv instances have no per-env method {method_name!r}")
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
+
+
+class SurrogateEnv(gym.Env):
+    """Single-instance gymnasium view of the queue model (for checks and debugging)."""
+
+    def __init__(self, params, seed=None):
+        self.venv = SurrogateVecEnv(params, num_envs=1, seed=seed)
+        self.observation_space = self.venv.observation_space
+        self.action_space = self.venv.action_space
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        if seed is not None:
+            self.venv.model.rng = np.random.default_rng(seed)
+        return self.venv.reset()[0], {}
+
+    def step(self, action):
+        obs, rewards, dones, infos = self.venv.step(np.array([action]))
+        if dones[0]:
+            obs = infos[0]["terminal_observation"][None]
+        return obs[0], float(rewards[0]), False, bool(dones[0]), {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the queue-model surrogate from recorded SUMO runs")
+    parser.add_argument("--seeds", type=int, default=3, help="Number of recorded SUMO episodes")
+    parser.add_argument("--out", default=PARAMS_FILE)
+    parser.add_argument("--envs", type=int, default=4096, help="Batch size for the speed check")
+    parser.add_argument("--saturation", type=float, default=DEFAULT_SATURATION,
+                        help="Saturation flow (veh/s) of lanes the recorded runs can't measure")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    params = calibrate(*record_runs(range(args.seeds)), saturation=args.saturation)
+    with open(args.out, "w") as f:
+        json.dump(params, f)
+    print(f"📐 Calibrated {len(params['lanes'])} lanes from {args.seeds} SUMO runs "
+          f"in {time.perf_counter() - start:.1f}s -> {args.out}")
+    print("   saturation flow (veh/s) from queued green:")
+    for lane, rate, source, seconds, crossings in zip(params["lanes"], params["saturation"],
+                                                      params["saturation_source"], params["saturation_seconds"],
+                                                      params["saturation_crossings"]):
+        print(f"   {lane:>8}: {rate:.2f} ({source}) from {crossings:.0f} crossings in {seconds:.0f}s")
+
+    venv = SurrogateVecEnv(params, num_envs=args.envs, seed=0)
+    venv.reset()
+    steps = params["num_seconds"] // params["delta_time"]
+    start = time.perf_counter()
+    for _ in range(steps):
+        venv.step(np.random.randint(venv.action_space.n, size=args.envs))
+    elapsed = time.perf_counter() - start
+    print(f"⚡ {args.envs} surrogate envs: {args.envs * steps / elapsed:,.0f} decisions/s "
+          f"({args.envs * steps * params['delta_time'] / elapsed:,.0f} simulated seconds/s)")
@@ -1,18 +1,33 @@
 import gymnasium as gym
-from stable_baselines3 import PPO
 from stable_baselines3.common.vec_env import DummyVecEnv, VecNormalize
 import sumo_rl
 import traci
 import os
 import time
+import argparse
 
-def test_optimized():
+from action_masking import EventDrivenDecisions, MaskedPolicy
+from emergency_observation import CONTEXT_RADIUS, emergency_observation
+from emergency_tracker import EmergencyTracker, count_emergency_vehicles, print_summary
+from frame_history import with_saved_history
+from streaming_stats import VehicleStats, print_vehicle_summary
+from train_optimized import algorithm
+
+ROUTE_FILES = ["vtypes.rou.xml", "draft02.rou.xml", "ambulance.rou.xml"]
+
+def test_optimized(masked=False, emergency_obs=False, emergency_radius=CONTEXT_RADIUS):
+    """
+    masked / emergency_obs: the model was trained with train_optimized.py
+    --masked (MaskablePPO, event-driven decisions) / --emergency-obs (with
+    --emergency-radius emergency_radius).
+    """
     print("🚀 Loading Optimized Trained Model...")
     
     # 1. Setup Same Environment
+    extra = {"observation_class": emergency_observation(emergency_radius)} if emergency_obs else {}
     env = sumo_rl.SumoEnvironment(
         net_file="draft02.net.xml",
-        route_file="vtypes.rou.xml,draft02.rou.xml,ambulance.rou.xml",
+        route_file=",".join(ROUTE_FILES),
         out_csv_name=None,
         use_gui=True,
         num_seconds=1000,
@@ -20,9 +35,13 @@ def test_optimized():
         yellow_time=4,
         min_green=5,
         max_green=60,
-        single_agent=True
+        single_agent=True,
+        **extra
     )
     
+    if masked:
+        env = EventDrivenDecisions(env)
+
     # 2. Re-Apply Normalization Wrapper
     env = DummyVecEnv([lambda: env])
     
@@ -35,7 +54,7 @@ def test_optimized():
             if norm_files:
                 norm_path = os.path.join("modelsop", norm_files[-1])
                 print(f"🔄 Found normalization file: {norm_path}")
-                env = VecNormalize.load(norm_path, env)
+                env = VecNormalize.load(norm_path, with_saved_history(env, norm_path))
             else:
                 print("❌ No normalization file found! Model will likely fail.")
                 return
@@ -44,7 +63,7 @@ def test_optimized():
             return
     else:
         # Load the stats we learned during training
-        env = VecNormalize.load("vec_normalize.pkl", env)
+        env = VecNormalize.load("vec_normalize.pkl", with_saved_history(env, "vec_normalize.pkl"))
     
     # Turn OFF training and reward updating (we just want to test now)
     env.training = False
@@ -69,17 +88,23 @@ def test_optimized():
                 print("❌ No models found! Did training finish?")
                 return
 
-    model = PPO.load(model_path)
+    model = algorithm(masked).load(model_path)
+    # MaskablePPO has to be given the valid phases of every decision
+    policy = MaskedPolicy(model, env) if masked else model
     print(f"✅ Optimized Model Loaded from: {model_path}")
 
     # 4. Reset and Run
     obs = env.reset()
     done = False
-    ambulance_start = 0
-    ambulance_end = 0
-    ambulance_duration = 0
+    # Records every emergency vehicle on each simulation step (sumo-rl takes
+    # several per agent decision)
+    tracker = EmergencyTracker(traci)
+    expected = count_emergency_vehicles(ROUTE_FILES)
+    reported = 0
     step = 0
-    vehicle_waiting_times = {}  # Track max waiting time per vehicle
+    # Max waiting time / time loss per civilian vehicle; arrived vehicles are
+    # folded into streaming quantiles so memory stays constant
+    civilians = VehicleStats(traci, exclude=tracker)
     
     print("🚦 Starting Optimized Evaluation Run...")
     
@@ -90,7 +115,7 @@ def test_optimized():
         pass
     
     while not done:
-        action, _ = model.predict(obs, deterministic=True)
+        action, _ = policy.predict(obs, deterministic=True)
         obs, reward, done, info = env.step(action)
         
         # Slow down visualization so you can see the cars
@@ -100,56 +125,58 @@ def test_optimized():
         
         # Track Ambulance
         try:
-            current_time = traci.simulation.getTime()
-            veh_list = traci.vehicle.getIDList()
-            
             # Print status every 20 steps
             if step % 20 == 0:
-                print(f"   [Debug] Time: {current_time}s | Vehicles on road: {len(veh_list)}")
+                print(f"   [Debug] Time: {traci.simulation.getTime()}s | "
+                      f"Vehicles on road: {traci.vehicle.getIDCount()}")
             
             # Track max waiting time for each civilian vehicle
-            for veh_id in veh_list:
-                if veh_id != "hero_ambulance":
-                    waiting = traci.vehicle.getWaitingTime(veh_id)
-                    # Keep the maximum waiting time seen for this vehicle
-                    if veh_id not in vehicle_waiting_times or waiting > vehicle_waiting_times[veh_id]:
-                        vehicle_waiting_times[veh_id] = waiting
+            civilians.observe()
 
-            # Check for ambulance
-            if "hero_ambulance" in veh_list:
-                if ambulance_start == 0:
-                    ambulance_start = current_time
-                    print(f"🚑 Ambulance entered at: {ambulance_start}")
-            
-            # Check if finished
-            if ambulance_start > 0 and "hero_ambulance" not in veh_list and ambulance_end == 0:
-                ambulance_end = current_time
-                ambulance_duration = ambulance_end - ambulance_start
-                print(f"🏁 Optimized Agent Finished! Total Time: {ambulance_duration} seconds")
-                # Exit immediately after ambulance finishes to avoid multi-episode data
+            # Report emergency vehicles as they enter
+            for veh_id in tracker.ids[reported:]:
+                print(f"🚑 {veh_id} entered at: {tracker.depart[tracker.slots[veh_id]]}")
+            reported = tracker.count
+
+            # Check if all emergency vehicles finished
+            if expected and tracker.finished() == expected:
+                print(f"🏁 Optimized Agent Finished! All {expected} emergency vehicles arrived")
+                # Exit immediately to avoid multi-episode data
                 break
 
         except Exception as e:
             print(f"❌ Error: {e}")
             break
 
+    summary = tracker.summary()
+    tracker.close()
+    civilians.finish()
     env.close()
     print("✅ Evaluation Complete.")
+    print_summary(summary)
+    transit = summary["transit"]
+    ambulance_duration = transit["mean"] if transit else 0
     
     # Calculate civilian average waiting time
-    if vehicle_waiting_times:
-        civilian_avg_wait = sum(vehicle_waiting_times.values()) / len(vehicle_waiting_times)
-    else:
-        civilian_avg_wait = 0
+    print_vehicle_summary(civilians.summary())
+    civilian_avg_wait = civilians.wait.mean if civilians.wait.count else 0
     
     # Save results to file for plotting
     with open("optimized_result.txt", "w") as f:
         f.write(f"{ambulance_duration}\n")
         f.write(f"{civilian_avg_wait}\n")
-    print(f"📊 Optimized ambulance time: {ambulance_duration}s")
+    print(f"📊 Optimized ambulance time (mean): {ambulance_duration}s")
     print(f"📊 Optimized civilian avg waiting time: {civilian_avg_wait:.2f}s")
     
     return ambulance_duration, civilian_avg_wait
 
 if __name__ == "__main__":
-    test_optimized()
+    parser = argparse.ArgumentParser(description="Watch the trained agent in sumo-gui")
+    parser.add_argument("--masked", action="store_true",
+                        help="The model is a MaskablePPO one from train_optimized.py --masked")
+    parser.add_argument("--emergency-obs", action="store_true",
+                        help="The model was trained with train_optimized.py --emergency-obs")
+    parser.add_argument("--emergency-radius", type=float, default=CONTEXT_RADIUS,
+                        help="Its train_optimized.py --emergency-radius")
+    args = parser.parse_args()
+    test_optimized(masked=args.masked, emergency_obs=args.emergency_obs, emergency_radius=args.emergency_radius)
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+if "SUMO_HOME" not in os.environ:
+    pytest.skip("benchmark exits without SUMO_HOME", allow_module_level=True)
+
+from benchmark import bootstrap_ci, paired_comparison
+
+
+def test_bootstrap_ci_covers_mean():
+    values = np.random.default_rng(0).normal(100.0, 10.0, size=50)
+    low, high = bootstrap_ci(values, 2000, 0.95, np.random.default_rng(1))
+    assert low < values.mean() < high
+    assert np.isnan(bootstrap_ci([1.0], 2000, 0.95, np.random.default_rng(1))[0])
+
+
+def test_paired_comparison_detects_consistent_improvement():
+    rng = np.random.default_rng(0)
+    baseline = rng.normal(100.0, 20.0, size=30)
+    # Large spread between pairs, small but consistent paired gain
+    candidate = baseline - 5.0 + rng.normal(0.0, 1.0, size=30)
+    result = paired_comparison(baseline, candidate, 2000, 0.95, np.random.default_rng(1))
+    assert result["pairs"] == 30
+    assert result["p_value"] < 0.01
+    assert result["ci_high"] < 0
+    assert result["improvement_pct"] > 0
+
+
+def test_paired_comparison_no_difference():
+    baseline = np.random.default_rng(0).normal(100.0, 20.0, size=30)
+    candidate = baseline + np.random.default_rng(1).normal(0.0, 5.0, size=30)
+    result = paired_comparison(baseline, candidate, 2000, 0.95, np.random.default_rng(2))
+    assert result["p_value"] > 0.05
+    assert result["ci_low"] < 0 < result["ci_high"]
+
+
+def test_paired_comparison_p_value_floor_and_missing_pairs():
+    baseline = np.array([10.0, 12.0, np.nan, 11.0, 13.0])
+    candidate = np.array([20.0, 22.0, 5.0, 21.0, np.nan])
+    result = paired_comparison(baseline, candidate, 999, 0.95, np.random.default_rng(0))
+    assert result["pairs"] == 3
+    # Three equal differences: 2 of the 8 sign patterns reach the observed mean
+    assert abs(result["p_value"] - 0.25) < 0.05
+    assert paired_comparison([1.0], [2.0], 999, 0.95, np.random.default_rng(0)) == {"pairs": 1}
@@ -0,0 +1,85 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+if "SUMO_HOME" not in os.environ:
+    pytest.skip("distill imports benchmark, which needs SUMO_HOME", allow_module_level=True)
+
+from distill import DecisionTreePolicy, fit_tree
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 6))
+    # Three actions decided by two features, with 5% label noise
+    y = np.where(X[:, 1] > 0.5, 2, np.where(X[:, 4] < -0.2, 1, 0))
+    noise = rng.random(len(y)) < 0.05
+    y[noise] = rng.integers(0, 3, size=noise.sum())
+    return X, y
+
+
+def test_fit_learns_the_rule(data):
+    X, y = data
+    tree = fit_tree(X, y, n_actions=3, max_depth=4, history=2)
+    assert tree.depth <= 4
+    assert tree.history == 2
+    predicted, _ = tree.predict(X)
+    assert np.mean(predicted == y) > 0.9
+    # Sibling leaves with the same answer were merged away
+    assert all(tree.value[l] != tree.value[r] for l, r in zip(tree.left, tree.right)
+               if l >= 0 and tree.left[l] < 0 and tree.left[r] < 0)
+
+
+def test_max_depth_zero_is_majority_leaf(data):
+    X, y = data
+    tree = fit_tree(X, y, n_actions=3, max_depth=0)
+    assert tree.n_nodes == 1 and tree.depth == 0
+    assert tree.act(X[0]) == np.bincount(y).argmax()
+
+
+def test_json_round_trip(data, tmp_path):
+    X, y = data
+    tree = fit_tree(X, y, n_actions=3, max_depth=6, history=3)
+    path = tmp_path / "student.json"
+    tree.save(path)
+    loaded = DecisionTreePolicy.load(path)
+    assert loaded.history == 3
+    assert [loaded.act(row) for row in X] == [tree.act(row) for row in X]
+
+
+def test_python_export_matches(data):
+    X, y = data
+    tree = fit_tree(X, y, n_actions=3, max_depth=6)
+    namespace = {}
+    exec(tree.to_python(), namespace)
+    assert [namespace["act"](row) for row in X] == [tree.act(row) for row in X]
+
+
+def test_fold_normalization(data):
+    X, y = data
+    mean = np.array([3.0, -1.0, 0.5, 10.0, 2.0, 0.0])
+    var = np.array([4.0, 0.25, 1.0, 9.0, 16.0, 1.0])
+    tree = fit_tree(X, y, n_actions=3, max_depth=6)
+    raw = X * np.sqrt(var + 1e-8) + mean
+    folded = tree.fold_normalization(mean, var)
+    assert [folded.act(row) for row in raw] == [tree.act(row) for row in X]
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="needs gcc")
+def test_c_export_matches(data, tmp_path):
+    X, y = data
+    tree = fit_tree(X, y, n_actions=3, max_depth=6)
+    X = X.astype(np.float32)
+    rows = "\n".join("{" + ", ".join(f"{x!r}f" for x in row) + "}," for row in X.tolist())
+    main = (f"#include <stdio.h>\nstatic const float X[{len(X)}][{X.shape[1]}] = {{\n{rows}\n}};\n"
+            f"int main(void) {{ for (int i = 0; i < {len(X)}; i++) printf(\"%d\\n\", student_act(X[i])); "
+            "return 0; }\n")
+    source = tmp_path / "student.c"
+    source.write_text(tree.to_c() + main)
+    subprocess.run(["gcc", "-O2", "-o", str(tmp_path / "student"), str(source)], check=True)
+    output = subprocess.run([str(tmp_path / "student")], check=True, capture_output=True, text=True).stdout
+    assert list(map(int, output.split())) == [tree.act(row) for row in X]
@@ -0,0 +1,74 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import DummyVecEnv, VecFrameStack
+
+from frame_history import RingFrameStack
+
+
+class CountingEnv(gym.Env):
+    """Observation [env, step, episode]; episodes of a fixed, per-env length."""
+
+    def __init__(self, index, length):
+        self.index = index
+        self.length = length
+        self.episode = 0
+        self.t = 0
+        self.observation_space = spaces.Box(-np.inf, np.inf, shape=(3,), dtype=np.float32)
+        self.action_space = spaces.Discrete(2)
+
+    def _obs(self):
+        return np.array([self.index + 1, self.t, self.episode], dtype=np.float32)
+
+    def reset(self, seed=None, options=None):
+        self.episode += 1
+        self.t = 0
+        return self._obs(), {}
+
+    def step(self, action):
+        self.t += 1
+        return self._obs(), float(self.t), self.t >= self.length, False, {}
+
+
+def make_venv(lengths=(3, 5, 7)):
+    return DummyVecEnv([lambda i=i, n=n: CountingEnv(i, n) for i, n in enumerate(lengths)])
+
+
+@pytest.mark.parametrize("history", [1, 2, 4])
+def test_matches_vec_frame_stack(history):
+    ring = RingFrameStack(make_venv(), history)
+    stack = VecFrameStack(make_venv(), history)
+    assert ring.observation_space == stack.observation_space
+    assert np.array_equal(ring.reset(), stack.reset())
+    actions = np.zeros(ring.num_envs, dtype=int)
+    for _ in range(20):
+        obs, rewards, dones, infos = ring.step(actions)
+        expected_obs, expected_rewards, expected_dones, expected_infos = stack.step(actions)
+        assert np.array_equal(obs, expected_obs)
+        assert np.array_equal(rewards, expected_rewards)
+        assert np.array_equal(dones, expected_dones)
+        for info, expected in zip(infos, expected_infos):
+            if "terminal_observation" in expected:
+                assert np.array_equal(info["terminal_observation"], expected["terminal_observation"])
+
+
+def test_returned_view_survives_next_step():
+    ring = RingFrameStack(make_venv(lengths=(2, 3)), history=3)
+    previous = ring.reset()
+    snapshot = previous.copy()
+    actions = np.zeros(ring.num_envs, dtype=int)
+    for _ in range(10):
+        obs, _, _, _ = ring.step(actions)
+        assert np.array_equal(previous, snapshot)
+        previous, snapshot = obs, obs.copy()
+
+
+def test_rejects_non_flat_observations():
+    class ImageEnv(CountingEnv):
+        def __init__(self):
+            super().__init__(0, 3)
+            self.observation_space = spaces.Box(0, 255, shape=(4, 4), dtype=np.uint8)
+
+    with pytest.raises(ValueError):
+        RingFrameStack(DummyVecEnv([ImageEnv]), 2)
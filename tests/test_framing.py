@@ -0,0 +1,59 @@
+import socket
+import threading
+
+import numpy as np
+
+from distributed_rollouts import MSG_BATCH, MSG_HEARTBEAT, pack_arrays, recv_frame, send_frame, unpack_arrays
+
+
+def sample_arrays():
+    rng = np.random.default_rng(0)
+    return [
+        rng.normal(size=(64, 33)).astype(np.float32),
+        rng.normal(size=64),
+        rng.integers(0, 4, size=(64,)),
+        rng.integers(0, 2, size=(64, 4)).astype(np.uint8),
+        np.zeros((0, 3), dtype=np.float32),
+    ]
+
+
+def test_pack_round_trip():
+    arrays = sample_arrays()
+    unpacked = unpack_arrays(pack_arrays(arrays))
+    assert len(unpacked) == len(arrays)
+    for array, result in zip(arrays, unpacked):
+        assert result.dtype == array.dtype
+        assert np.array_equal(result, array)
+
+
+def test_pack_non_contiguous():
+    array = np.arange(24, dtype=np.float32).reshape(4, 6)[:, ::2]
+    (result,) = unpack_arrays(pack_arrays([array]))
+    assert np.array_equal(result, array)
+
+
+def test_frames_over_socket():
+    learner, worker = socket.socketpair()
+    payload = pack_arrays(sample_arrays())
+    lock = threading.Lock()
+    # Big enough that sendall and recv both take several chunks
+    big = bytes(range(256)) * 4096
+
+    def send():
+        send_frame(worker, MSG_HEARTBEAT)
+        send_frame(worker, MSG_BATCH, payload, lock)
+        send_frame(worker, MSG_BATCH, big, lock)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    try:
+        assert recv_frame(learner) == (MSG_HEARTBEAT, b"")
+        msg_type, received = recv_frame(learner)
+        assert msg_type == MSG_BATCH
+        for array, result in zip(sample_arrays(), unpack_arrays(received)):
+            assert np.array_equal(result, array)
+        assert recv_frame(learner) == (MSG_BATCH, big)
+    finally:
+        learner.close()
+        worker.close()
+        sender.join()
@@ -0,0 +1,85 @@
+import numpy as np
+
+from streaming_stats import KLLSketch, RunningMoments, StreamingStats
+
+
+def test_running_moments_match_numpy():
+    values = np.random.default_rng(0).normal(50.0, 12.0, size=5000)
+    moments = RunningMoments()
+    for x in values[:1000]:
+        moments.add(x)
+    moments.add_many(values[1000:])
+    assert moments.count == len(values)
+    assert np.isclose(moments.mean, values.mean())
+    assert np.isclose(moments.std, values.std(ddof=1))
+    assert moments.min == values.min() and moments.max == values.max()
+
+
+def test_running_moments_merge_is_exact():
+    values = np.random.default_rng(1).exponential(30.0, size=3000)
+    parts = [RunningMoments() for _ in range(3)]
+    for part, chunk in zip(parts, np.array_split(values, 3)):
+        part.add_many(chunk)
+    merged = parts[0].merge(parts[1]).merge(parts[2]).merge(RunningMoments())
+    assert merged.count == len(values)
+    assert np.isclose(merged.mean, values.mean())
+    assert np.isclose(merged.std, values.std(ddof=1))
+
+
+def _rank_error(sketch, values, qs):
+    ordered = np.sort(values)
+    estimates = sketch.quantiles(qs)
+    ranks = np.searchsorted(ordered, estimates, side="right") / len(values)
+    return np.abs(ranks - np.asarray(qs))
+
+
+def test_kll_rank_error_and_bounded_memory():
+    values = np.random.default_rng(2).exponential(30.0, size=100_000)
+    sketch = KLLSketch(k=200, seed=0)
+    for x in values[:5000]:
+        sketch.update(x)
+    sketch.update_many(values[5000:])
+    qs = np.linspace(0.01, 0.99, 99)
+    assert sketch.n == len(values)
+    assert len(sketch) < 1000
+    assert _rank_error(sketch, values, qs).max() < 0.01
+
+
+def test_kll_merge_and_cdf():
+    values = np.random.default_rng(3).exponential(30.0, size=50_000)
+    sketches = []
+    for i, chunk in enumerate(np.array_split(values, 20)):
+        sketch = KLLSketch(k=200, seed=i)
+        sketch.update_many(chunk)
+        sketches.append(sketch)
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    qs = np.linspace(0.01, 0.99, 99)
+    assert merged.n == len(values)
+    assert _rank_error(merged, values, qs).max() < 0.015
+    for x in np.percentile(values, [10, 50, 90]):
+        assert abs(merged.cdf(x) - np.mean(values <= x)) < 0.015
+    assert merged.cdf(values.min() - 1.0) == 0.0
+    assert merged.cdf(values.max()) == 1.0
+
+
+def test_small_stream_is_exact():
+    sketch = KLLSketch(k=200)
+    assert np.isnan(sketch.quantile(0.5))
+    for x in range(1, 101):
+        sketch.update(float(x))
+    assert sketch.quantile(0.5) == 50.0
+    assert sketch.cdf(25.0) == 0.25
+
+
+def test_streaming_stats_summary():
+    stats = StreamingStats(seed=0)
+    assert stats.summary() == {"count": 0}
+    for x in range(1, 101):
+        stats.add(float(x))
+    summary = stats.summary()
+    assert summary["count"] == 100
+    assert summary["mean"] == 50.5
+    assert summary["min"] == 1.0 and summary["max"] == 100.0
+    assert summary["p50"] == 50.0 and summary["p99"] == 99.0
@@ -1,19 +1,70 @@
 import gymnasium as gym
 from stable_baselines3 import PPO
 from stable_baselines3.common.vec_env import DummyVecEnv, VecNormalize
-from stable_baselines3.common.callbacks import CheckpointCallback
-import sumo_rl
 import traci
 import os
+import re
+import math
+import argparse
+import functools
 import torch.nn as nn
 
+from checkpointing import AsyncCheckpointCallback, find_latest_checkpoint, load_training_state
+from sumo_pool import PooledSumoEnvironment
+from frame_history import wrap_history
+from action_masking import EventDrivenDecisions
+from emergency_observation import CONTEXT_RADIUS, emergency_observation
+from mesoscopic import (MESO_SUMO_CMD, MesoObservationFunction, check_space_compatibility, lane_waiting_times,
+                        remember_signal_timings)
+from surrogate_env import DEFAULT_SATURATION, SurrogateVecEnv, load_or_calibrate
+
+TOTAL_TIMESTEPS = 100000
+CHECKPOINT_DIR = "./modelsop/"
+CHECKPOINT_PREFIX = "rl_model_optimized"
+
+# --- MESOSCOPIC PRETRAINING ---
+# The first MESO_TIMESTEPS (of TOTAL_TIMESTEPS) run on SUMO's mesoscopic model:
+# an almost-random policy doesn't need lane-change-level fidelity
+MESO_TIMESTEPS = 30000
+MESO_STEP_LENGTH = 2     # Seconds per simulation step
+MESO_DELTA_TIME = 10     # Seconds between agent actions
+
+# --- SURROGATE PRETRAINING ---
+# Optional (--surrogate-steps): before anything runs in SUMO, a separate PPO
+# learns on thousands of batched NumPy queue-model instances calibrated from
+# SUMO runs (surrogate_env.py); its weights and normalisation stats seed the agent
+SURROGATE_ENVS = 256
+SURROGATE_N_STEPS = 32     # Rollout length per surrogate env (256 x 32 = 8192 steps per update)
+SURROGATE_BATCH_SIZE = 1024
+
+# Number of past decisions the policy sees (1 = current snapshot only).
+# Stacked in a preallocated ring buffer, see frame_history.py
+HISTORY_LENGTH = 1
+
+# Define a Custom "Big Brain" Policy
+POLICY_KWARGS = dict(
+    activation_fn=nn.Tanh,
+    net_arch=dict(pi=[256, 256], vf=[256, 256])  # Two layers of 256 neurons
+)
+
+# --- HYPERPARAMETER TUNING ---
+PPO_KWARGS = dict(
+    learning_rate=3e-4,      # 0.0003 (Standard Stable Value)
+    gamma=0.995,             # Care about long-term future
+    gae_lambda=0.95,         # Smooth variance
+    clip_range=0.2,          # Don't make wild changes
+    ent_coef=0.01,           # Explore more!
+    n_steps=2048,            # Collect more experience before updating
+    batch_size=64,           # Smaller batches for better gradient updates
+)
+
 def custom_ambulance_reward(traffic_signal):
     """
     Weighted Reward:
     - Penalize Ambulance delay 10x more than normal cars.
     """
     # 1. Civilian Traffic Penalty
-    lane_waits = traffic_signal.get_accumulated_waiting_time_per_lane()
+    lane_waits = lane_waiting_times(traffic_signal)
     civilian_penalty = sum(lane_waits)
     
     # 2. Emergency Penalty
@@ -34,19 +85,14 @@ def custom_ambulance_reward(traffic_signal):
     reward = -1 * ((civilian_penalty * 0.7) + ambulance_penalty)
     return reward
 
-def train_optimized():
+def make_env(observation_class=None, **overrides):
+    """The training environment; `overrides` replace SumoEnvironment arguments (e.g. use_gui, num_seconds)."""
     net_file = "draft02.net.xml"
     route_file = "vtypes.rou.xml,draft02.rou.xml,ambulance.rou.xml"
-    
-    # Define the Checkpoint: Save every 10,000 steps
-    checkpoint_callback = CheckpointCallback(
-        save_freq=10000,
-        save_path="./modelsop/",
-        name_prefix="rl_model_optimized"
-    )
-    
-    # 1. Create the Environment
-    env = sumo_rl.SumoEnvironment(
+    # None = sumo-rl's default observation
+    extra = {"observation_class": observation_class} if observation_class else {}
+
+    kwargs = dict(
         net_file=net_file,
         route_file=route_file,
         fixed_ts=False,
@@ -57,39 +103,182 @@ def train_optimized():
         min_green=5,
         max_green=60,
         single_agent=True,
-        reward_fn=custom_ambulance_reward
+        reward_fn=custom_ambulance_reward,
+        **extra
     )
+    kwargs.update(overrides)
+    return PooledSumoEnvironment(**kwargs)
 
-    # 2. VECTORIZE & NORMALIZE (The Magic Fix)
-    # We wrap the env to squash those huge -200,000 rewards into nice small numbers
-    env = DummyVecEnv([lambda: env])
-    env = VecNormalize(env, norm_obs=True, norm_reward=True, clip_obs=10.)
+def make_meso_env(step_length=MESO_STEP_LENGTH, delta_time=MESO_DELTA_TIME, **overrides):
+    """Same scenario on SUMO's mesoscopic model, for cheap early training."""
+    if delta_time % step_length:
+        raise ValueError(f"delta_time ({delta_time}s) must be a multiple of the step length ({step_length}s)")
 
-    print("🧠 Initializing Optimized PPO Agent...")
-    
-    # 3. Define a Custom "Big Brain" Policy
-    policy_kwargs = dict(
-        activation_fn=nn.Tanh,
-        net_arch=dict(pi=[256, 256], vf=[256, 256])  # Two layers of 256 neurons
+    # sumo-rl counts yellow/min/max green in simulation steps, so convert
+    # the same 4s/5s/60s timings to steps of `step_length` seconds
+    kwargs = dict(
+        net_file="draft02.net.xml",
+        route_file="vtypes.rou.xml,draft02.rou.xml,ambulance.rou.xml",
+        fixed_ts=False,
+        out_csv_name="training_results_meso",
+        use_gui=False,
+        num_seconds=1000,
+        delta_time=delta_time,
+        yellow_time=math.ceil(4 / step_length),
+        min_green=math.ceil(5 / step_length),
+        max_green=math.ceil(60 / step_length),
+        single_agent=True,
+        reward_fn=custom_ambulance_reward,
+        observation_class=MesoObservationFunction,
+        additional_sumo_cmd=f"{MESO_SUMO_CMD} --step-length {step_length}"
     )
+    kwargs.update(overrides)
+    return PooledSumoEnvironment(**kwargs)
+
+def vectorize(env_fn, history=HISTORY_LENGTH, masked=False):
+    """DummyVecEnv around env_fn, with event-driven decisions (--masked) and observation history."""
+    if masked:
+        return wrap_history(DummyVecEnv([lambda: EventDrivenDecisions(env_fn())]), history)
+    return wrap_history(DummyVecEnv([env_fn]), history)
+
+def algorithm(masked):
+    """PPO, or sb3-contrib's MaskablePPO when invalid actions are masked."""
+    if not masked:
+        return PPO
+    try:
+        from sb3_contrib import MaskablePPO
+    except ImportError:
+        raise SystemExit("❌ --masked needs sb3-contrib: pip install sb3-contrib")
+    return MaskablePPO
 
-    model = PPO(
-        "MlpPolicy",
-        env,
-        verbose=1,
-        # --- HYPERPARAMETER TUNING ---
-        learning_rate=3e-4,      # 0.0003 (Standard Stable Value)
-        gamma=0.995,             # Care about long-term future
-        gae_lambda=0.95,         # Smooth variance
-        clip_range=0.2,          # Don't make wild changes
-        ent_coef=0.01,           # Explore more!
-        n_steps=2048,            # Collect more experience before updating
-        batch_size=64,           # Smaller batches for better gradient updates
-        policy_kwargs=policy_kwargs
+def switch_to_microsim(model, meso_env, history=HISTORY_LENGTH, masked=False):
+    """
+    Move the policy and its observation stats from the mesoscopic env to a
+    fresh microscopic one. The reward stats start over: the meso reward
+    measures a different waiting time (see lane_waiting_times).
+    """
+    micro_env = vectorize(make_env, history, masked)
+    micro_env = VecNormalize(micro_env, norm_obs=True, norm_reward=True, clip_obs=10.)
+    check_space_compatibility(meso_env, micro_env)
+    micro_env.obs_rms = meso_env.obs_rms
+    meso_env.close()
+    model.set_env(micro_env)
+    remember_signal_timings(model, micro_env)
+    return micro_env
+
+def pretrain_on_surrogate(model, env, timesteps, history=HISTORY_LENGTH, saturation=DEFAULT_SATURATION):
+    """
+    Train a copy of the policy on the batched queue-model surrogate, then
+    load its weights and VecNormalize stats into `model` / `env`.
+    """
+    params = load_or_calibrate(saturation=saturation)
+    surrogate = wrap_history(SurrogateVecEnv(params, num_envs=SURROGATE_ENVS), history)
+    surrogate = VecNormalize(surrogate, norm_obs=True, norm_reward=True, clip_obs=10.)
+    check_space_compatibility(surrogate, env)
+    kwargs = dict(PPO_KWARGS, n_steps=SURROGATE_N_STEPS, batch_size=SURROGATE_BATCH_SIZE)
+    pretrainer = PPO("MlpPolicy", surrogate, verbose=1, policy_kwargs=POLICY_KWARGS, **kwargs)
+    pretrainer.learn(total_timesteps=timesteps)
+    model.policy.load_state_dict(pretrainer.policy.state_dict())
+    env.obs_rms = surrogate.obs_rms
+    env.ret_rms = surrogate.ret_rms
+
+def resolve_checkpoint(resume):
+    """'latest' -> newest complete checkpoint in modelsop/, otherwise strip file suffixes from a path."""
+    if resume == "latest":
+        return find_latest_checkpoint(CHECKPOINT_DIR, CHECKPOINT_PREFIX)
+    for suffix in (".resume.gz", ".zip"):
+        if resume.endswith(suffix):
+            return resume[: -len(suffix)]
+    return resume
+
+def checkpoint_steps(checkpoint):
+    return int(re.search(r"_(\d+)_steps$", checkpoint).group(1))
+
+def train_optimized(resume=None, meso_timesteps=MESO_TIMESTEPS, meso_step_length=MESO_STEP_LENGTH,
+                    meso_delta_time=MESO_DELTA_TIME, history=HISTORY_LENGTH, masked=False, surrogate_timesteps=0,
+                    emergency_obs=False, saturation=DEFAULT_SATURATION, emergency_radius=CONTEXT_RADIUS):
+    if surrogate_timesteps and masked:
+        print("❌ --surrogate-steps can't be combined with --masked (the surrogate decides every delta_time)")
+        return
+    micro_env = make_env
+    if emergency_obs:
+        # The emergency features need lane positions (no mesosim) and vehicle
+        # classes (not in the queue-model surrogate)
+        if surrogate_timesteps:
+            print("❌ --surrogate-steps can't be combined with --emergency-obs (the surrogate has no ambulances)")
+            return
+        if meso_timesteps:
+            print("ℹ️ --emergency-obs trains on microsimulation only, skipping mesoscopic pretraining")
+            meso_timesteps = 0
+        micro_env = functools.partial(make_env, observation_class=emergency_observation(emergency_radius))
+
+    # Define the Checkpoint: Save every 10,000 steps
+    # Snapshots are taken in memory and written by a background thread,
+    # so rollout collection doesn't stall on disk I/O
+    checkpoint_callback = AsyncCheckpointCallback(
+        save_freq=10000,
+        save_path=CHECKPOINT_DIR,
+        name_prefix=CHECKPOINT_PREFIX,
+        verbose=1
     )
+    
+    # 1. Create the Environment (mesoscopic while pretraining)
+    def make_pretraining_env():
+        return make_meso_env(step_length=meso_step_length, delta_time=meso_delta_time)
+
+    if resume:
+        checkpoint = resolve_checkpoint(resume)
+        if checkpoint is None or not os.path.exists(checkpoint + ".resume.gz"):
+            print(f"❌ No complete checkpoint found for '{resume}' in {CHECKPOINT_DIR}")
+            return
+
+        # Restores policy, optimiser, step counter, VecNormalize stats and RNG state.
+        # The SUMO episode that was running when the checkpoint was taken restarts.
+        in_pretraining = checkpoint_steps(checkpoint) < meso_timesteps
+        venv = vectorize(make_pretraining_env if in_pretraining else micro_env, history, masked)
+        model, env = load_training_state(checkpoint, venv, algorithm=algorithm(masked))
+        print(f"🔄 Resuming from {checkpoint} at {model.num_timesteps} steps")
+    else:
+        # 2. VECTORIZE & NORMALIZE (The Magic Fix)
+        # We wrap the env to squash those huge -200,000 rewards into nice small numbers
+        in_pretraining = meso_timesteps > 0
+        env = vectorize(make_pretraining_env if in_pretraining else micro_env, history, masked)
+        env = VecNormalize(env, norm_obs=True, norm_reward=True, clip_obs=10.)
+
+        print("🧠 Initializing Optimized PPO Agent...")
+
+        # 3. "Big Brain" policy with the tuned hyperparameters above
+        # (MaskablePPO with --masked: the agent only sees decisions that matter)
+        model = algorithm(masked)(
+            "MlpPolicy",
+            env,
+            verbose=1,
+            policy_kwargs=POLICY_KWARGS,
+            **PPO_KWARGS
+        )
+
+        # 4. Optional warm start on the queue-model surrogate (doesn't count
+        # towards TOTAL_TIMESTEPS: it costs seconds, not SUMO episodes)
+        if surrogate_timesteps:
+            print(f"🧮 Surrogate Pretraining ({surrogate_timesteps} Steps on {SURROGATE_ENVS} queue-model envs)...")
+            pretrain_on_surrogate(model, env, surrogate_timesteps, history, saturation)
+
+    # Saved with the model, so realtime.py can check a loaded one against its env
+    remember_signal_timings(model, env)
+
+    if in_pretraining:
+        remaining = meso_timesteps - model.num_timesteps
+        print(f"🏎️ Mesoscopic Pretraining ({remaining} of {meso_timesteps} Steps, "
+              f"{meso_step_length}s steps, action every {meso_delta_time}s)...")
+        model.learn(total_timesteps=remaining, callback=checkpoint_callback, reset_num_timesteps=not resume)
+        resume = True
+
+        print("🔬 Switching to microsimulation for fine-tuning (same policy & normalization stats)")
+        env = switch_to_microsim(model, env, history, masked)
 
-    print("🚀 Starting Optimized Training (100k Steps)...")
-    model.learn(total_timesteps=100000, callback=checkpoint_callback)
+    remaining = TOTAL_TIMESTEPS - model.num_timesteps
+    print(f"🚀 Starting Optimized Training ({remaining} of {TOTAL_TIMESTEPS} Steps)...")
+    model.learn(total_timesteps=remaining, callback=checkpoint_callback, reset_num_timesteps=not resume)
 
     # SAVE BOTH MODEL AND NORMALIZATION STATS
     # You MUST save the normalization stats or the agent will be blind when testing!
@@ -98,4 +287,29 @@ def train_optimized():
     print("✅ Model & Normalization Stats saved.")
 
 if __name__ == "__main__":
-    train_optimized()
+    parser = argparse.ArgumentParser(description="Train the optimized PPO traffic agent")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None,
+                        help="Resume from the latest checkpoint in modelsop/ or from a given checkpoint path")
+    parser.add_argument("--meso-steps", type=int, default=MESO_TIMESTEPS,
+                        help="Timesteps of mesoscopic pretraining before microsimulation (0 to disable)")
+    parser.add_argument("--meso-step-length", type=int, default=MESO_STEP_LENGTH,
+                        help="Simulation step length (s) during mesoscopic pretraining")
+    parser.add_argument("--meso-delta-time", type=int, default=MESO_DELTA_TIME,
+                        help="Seconds between actions during mesoscopic pretraining")
+    parser.add_argument("--history", type=int, default=HISTORY_LENGTH,
+                        help="Number of past observations stacked into the policy input")
+    parser.add_argument("--masked", action="store_true",
+                        help="Only ask the agent when a decision matters, masking invalid phases (needs sb3-contrib)")
+    parser.add_argument("--surrogate-steps", type=int, default=0,
+                        help="Timesteps of queue-model surrogate pretraining before any SUMO run (fresh runs only)")
+    parser.add_argument("--saturation", type=float, default=DEFAULT_SATURATION,
+                        help="Surrogate saturation flow (veh/s) for lanes the calibration runs can't measure")
+    parser.add_argument("--emergency-obs", action="store_true",
+                        help="Add nearest-emergency-vehicle features from one context subscription per junction")
+    parser.add_argument("--emergency-radius", type=float, default=CONTEXT_RADIUS,
+                        help="Detection radius (m) of --emergency-obs; evaluate with the same value")
+    args = parser.parse_args()
+    train_optimized(resume=args.resume, meso_timesteps=args.meso_steps, meso_step_length=args.meso_step_length,
+                    meso_delta_time=args.meso_delta_time, history=args.history, masked=args.masked,
+                    surrogate_timesteps=args.surrogate_steps, emergency_obs=args.emergency_obs,
+                    saturation=args.saturation, emergency_radius=args.emergency_radius)